@@ -1,29 +1,42 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from backend.instances import USER_MANAGER, CHAT_MANAGER
-from backend.routes import user_routes, chat_routes, web_socket
+from backend.instances import USER_MANAGER, CHAT_MANAGER, PERSISTENCE_WORKER, BACKPLANE, PASSWORD_HASHER
+from backend.routes import user_routes, chat_routes, web_socket, metrics_routes
+from backend.utils.logging_utils import configure_logging, get_logger, shutdown_logging
 import uvicorn
 import os
 from contextlib import asynccontextmanager
 
+configure_logging()
+log = get_logger("app")
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    print("Checking database files...")
+    log.info("checking database files")
     if not os.path.exists("user_manager.pkl"):
-        print("Creating user_manager.pkl...")
+        log.info("creating database file", extra={"file": "user_manager.pkl"})
         USER_MANAGER.save()
     if not os.path.exists("chat_manager.pkl"):
-        print("Creating chat_manager.pkl...")
+        log.info("creating database file", extra={"file": "chat_manager.pkl"})
         CHAT_MANAGER.save_chat_database()
-    print("Database initialization complete.")
+    log.info("database initialization complete")
+    PERSISTENCE_WORKER.start()
+    await BACKPLANE.start()
 
     yield
 
-    print("Saving all AVL trees before shutdown...")
+    await web_socket.READ_RECEIPTS.flush()
+    await BACKPLANE.stop()
+
+    log.info("saving all trees before shutdown")
     USER_MANAGER.save()
     CHAT_MANAGER.save_chat_database()
-    print("Data saved.")
+    PERSISTENCE_WORKER.stop()
+    USER_MANAGER.close()
+    CHAT_MANAGER.close()
+    PASSWORD_HASHER.shutdown()
+    log.info("data saved")
+    shutdown_logging()
 
 
 app = FastAPI(title="Chat App", lifespan=lifespan)
@@ -35,11 +48,15 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(metrics_routes.HTTPMetricsMiddleware)
 
 
 app.include_router(user_routes.router, prefix="/users", tags=["Users"])
 app.include_router(chat_routes.router, prefix="/chats", tags=["Chats"])
 app.include_router(web_socket.router, prefix="/ws", tags=["WebSocket"])
+app.include_router(metrics_routes.router, tags=["Metrics"])
 
 if __name__ == "__main__":
-    uvicorn.run("app:app", host="0.0.0.0", port=8000, reload=True)
\ No newline at end of file
+    # permessage-deflate is negotiated with every browser that offers it (all current ones do); with context
+    # takeover, field names and chat IDs repeated across frames compress to back-references
+    uvicorn.run("app:app", host="0.0.0.0", port=8000, reload=True, ws_per_message_deflate=True)
\ No newline at end of file
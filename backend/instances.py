@@ -1,9 +1,36 @@
+import os
 from typing import Dict, Any
 
 from starlette.websockets import WebSocket
 
+from backend.models.connections.backplane import InProcessBackplane
+from backend.models.connections.chat_actor import ChatActors
 from backend.models.databases.chat_database import ChatDatabase
+from backend.models.databases.persistence_worker import PersistenceWorker
 from backend.models.databases.user_database import UserDatabase
+from backend.utils.metrics import METRICS
+from backend.utils.password_hashing import PasswordHasher
+from backend.utils.session_tokens import SessionManager
 
-USER_MANAGER = UserDatabase("user_manager.pkl")
-CHAT_MANAGER = ChatDatabase("chat_manager.pkl")
+USER_MANAGER = UserDatabase("user_manager.pkl", journaled=True)
+CHAT_MANAGER = ChatDatabase("chat_manager.pkl", journaled=True, segment_directory="chat_segments", hot_message_chunks=2,
+                            message_search=os.environ.get("CHATTER_MESSAGE_SEARCH", "").lower() in ("1", "true"))
+
+PERSISTENCE_WORKER = PersistenceWorker(flush_interval=0.25, max_pending_bytes=256 * 1024)
+USER_MANAGER.attach_persistence_worker(PERSISTENCE_WORKER)
+CHAT_MANAGER.attach_persistence_worker(PERSISTENCE_WORKER)
+
+PASSWORD_HASHER = PasswordHasher(max_workers=4, max_queued=64)
+SESSIONS = SessionManager(os.environ.get("CHATTER_SESSION_SECRET"), ttl_seconds=7 * 24 * 3600, cache_size=10000)
+
+BACKPLANE = InProcessBackplane()
+
+# Every mutation of a chat, from a socket or a REST route, goes through that chat's actor
+CHAT_ACTORS = ChatActors(max_batch=64)
+
+METRICS.gauge("chatter_persistence_pending_bytes", "Journal and snapshot bytes waiting for the persistence worker.", lambda: PERSISTENCE_WORKER._pending_bytes)
+METRICS.gauge("chatter_persistence_dirty_trees", "Trees waiting for the persistence worker to flush them.", lambda: len(PERSISTENCE_WORKER._dirty_trees))
+METRICS.gauge("chatter_password_hasher", "Password hashing pool state.", PASSWORD_HASHER.metrics, ("stat",))
+METRICS.gauge("chatter_users", "Registered users.", lambda: len(USER_MANAGER.user_index))
+METRICS.gauge("chatter_chats", "Chats.", lambda: len(CHAT_MANAGER.chat_index))
+METRICS.gauge("chatter_chat_actors", "Chats with an actor task applying queued commands.", lambda: len(CHAT_ACTORS.actors))
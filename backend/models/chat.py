@@ -1,9 +1,13 @@
 import uuid
+from copy import copy
 from datetime import datetime
 from typing import Dict, List
 
 from backend.models.linked_list.linked_list import LinkedList
+from backend.models.message_store.message_store import MessageStore
 from backend.models.user import User
+from backend.models.message_store.message_store import to_timestamp
+from backend.utils.formatting import now_iso
 
 
 class Chat:
@@ -19,16 +23,49 @@ class Chat:
 
         self.chat_id : str = chat_id
         self.participants : Dict[str, Dict[str, str | bool]]= {participant['username']: participant for participant in chat_participants}
-        self.messages : LinkedList = LinkedList()
+        self.messages : MessageStore = MessageStore(chat_id)
         self.time_created : datetime = datetime.now()
-        self.unread_messages_by : set = set(participant['username']   for participant in chat_participants)
+        # username -> sequence number of the last message the participant has read (messages are numbered from 1)
+        self.read_seqs : Dict[str, int] = {}
         self.owner : str = owner_username
+        self.dashboard_index = None
+        self.search_index = None
 
         if chat_name is None:
             self.chat_name = f"Chat with {', '.join([participant['username'] for participant in chat_participants])}"
         else:
             self.chat_name = chat_name
 
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        # The dashboard and search indexes are rebuilt in memory, never persisted
+        state.pop("dashboard_index", None)
+        state.pop("search_index", None)
+        return state
+
+    def __copy__(self):
+        # Snapshot copy taken on the event loop and pickled off it: whatever the loop changes in place is copied
+        chat = Chat.__new__(Chat)
+        chat.__dict__.update(self.__dict__)
+        chat.participants = {username: dict(permissions) for username, permissions in self.participants.items()}
+        chat.read_seqs = dict(self.read_seqs)
+        chat.messages = copy(self.messages)
+        return chat
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.dashboard_index = None
+        self.search_index = None
+        # Chats pickled before the message store kept their history in a LinkedList
+        if isinstance(self.messages, LinkedList):
+            legacy_messages = self.messages.get_all_chats()
+            self.messages = MessageStore(self.chat_id)
+            for message in legacy_messages:
+                self.messages.append(message)
+        # Chats pickled before read sequence numbers kept an explicit set of participants with unread messages
+        if "unread_messages_by" in self.__dict__:
+            self.read_seqs = self._read_seqs_from_unread(self.__dict__.pop("unread_messages_by"))
+
     def __str__(self) -> str:
         return f"Chat: {self.chat_id}, {self.chat_name}, {self.participants}, {self.time_created}, {self.unread_messages_by}"
 
@@ -36,8 +73,14 @@ class Chat:
         pass
 
     def add_message(self, message_data : Dict[str, str | datetime]) -> None:
+        # Checked before anything changes, so a bad message never lands in memory without reaching the journal
+        if not isinstance(message_data.get("message", ""), str):
+            raise ValueError("Message text must be a string.")
+        message_data["seq"] = self.latest_seq + 1
         self.messages.append(message_data)
-        self.mark_as_unread_for_all()
+        self.notify_activity()
+        if self.search_index is not None and message_data.get("sender") != "System":
+            self.search_index.add(self.chat_id, message_data["seq"], message_data.get("message") or "")
 
     def send_user_leave_message(self, username) -> Dict[str, str | datetime]:
         message_info : Dict[str, str | datetime] = self.add_system_message(f"{username} has left the chat.")
@@ -67,23 +110,48 @@ class Chat:
         self.participants[new_owner_username] = {"username": new_owner_username, "can_edit": True, "can_delete": True}
         self.owner = new_owner_username
 
-    def mark_as_unread_for_all(self) -> None:
-        for participant in self.participants.keys():
-            self.unread_messages_by.add(participant)
+    @property
+    def latest_seq(self) -> int:
+        return len(self.messages)
+
+    @property
+    def unread_messages_by(self) -> set:
+        latest_seq : int = self.latest_seq
+        return {username for username in self.participants if self.read_seqs.get(username, 0) < latest_seq}
+
+    def get_unread_count(self, username : str) -> int:
+        return max(0, self.latest_seq - self.read_seqs.get(username, 0))
 
     def mark_as_read_by(self, username : str) -> None:
-        if username in self.unread_messages_by:
-            self.unread_messages_by.remove(username)
+        if username in self.participants:
+            self.read_seqs[username] = self.latest_seq
 
     def get_last_message(self) -> str | None:
         if self.messages.is_empty():
             return None
-        return self.messages.tail.value.get('message')
+        return self.messages.last().get('message')
 
     def get_last_message_time(self) -> datetime | None:
         if self.messages.is_empty():
             return None
-        return self.messages.tail.value.get('time_sent')
+        return self.messages.last().get('time_sent')
+
+    def get_last_activity_timestamp(self) -> int:
+        last_timestamp : int | None = self.messages.last_timestamp()
+        return last_timestamp if last_timestamp is not None else to_timestamp(self.time_created)
+
+    def attach_dashboard_index(self, dashboard_index) -> None:
+        self.dashboard_index = dashboard_index
+
+    def attach_search_index(self, search_index) -> None:
+        self.search_index = search_index
+        for seq, sender, text in self.messages.iter_texts():
+            if sender != "System":
+                search_index.add(self.chat_id, seq, text)
+
+    def notify_activity(self) -> None:
+        if self.dashboard_index is not None:
+            self.dashboard_index.chat_active(self)
 
     def get_participant_permissions(self, username : str) -> Dict[str, bool] | None:
         participant : Dict[str, bool] = self.participants.get(username)
@@ -101,50 +169,77 @@ class Chat:
             "can_edit": participant_edit_permissions,
             "can_delete": False
         }
+        if self.dashboard_index is not None:
+            self.dashboard_index.participant_added(self, new_participant_username)
 
     def remove_participant(self, participant : User) -> None:
         participant_username : str = participant.username
         if participant_username in self.participants:
             del self.participants[participant_username]
-            if participant_username in self.unread_messages_by:
-                self.unread_messages_by.remove(participant_username)
+            self.read_seqs.pop(participant_username, None)
         participant.remove_chat_id(self.chat_id)
 
-    def get_chat_overview(self) -> Dict[str, str | List[str] | datetime | List[str]]:
-        return {
+    def get_chat_overview(self, username : str | None =None) -> Dict[str, str | List[str] | datetime | List[str]]:
+        overview = {
             "chat_id": self.chat_id,
             "chat_name": self.chat_name,
             "participants": list(self.participants.keys()),
             "time_created": self.time_created.isoformat(),
-            "unread_messages_by": list(self.unread_messages_by),
+            "latest_seq": self.latest_seq,
             "last_message": self.get_last_message(),
             "last_message_time": self.get_last_message_time(),
             "participant_permissions": self.participants
         }
+        # A viewer gets their own O(1) unread count; broadcasts carry every cursor so each client can work out its own
+        if username is not None:
+            overview["last_read_seq"] = self.read_seqs.get(username, 0)
+            overview["unread_count"] = self.get_unread_count(username)
+        else:
+            overview["read_seqs"] = dict(self.read_seqs)
+        return overview
 
     def add_system_message(self, message : str) -> Dict[str, str | datetime]:
         system_message : Dict[str, str | datetime] = {
             "message_id": f"{str(uuid.uuid4())}",
             "sender": "System",
             "message": message,
-            "time_sent": datetime.now().isoformat()
+            "time_sent": now_iso(),
+            "seq": self.latest_seq + 1
         }
         self.messages.append(system_message)
-        self.mark_as_unread_for_all()
+        self.notify_activity()
         return system_message
 
+    def get_messages(self, before_message_id : str | None =None, limit : int =50) -> tuple[List[Dict[str, str | datetime]], bool]:
+        before_position = None
+        if before_message_id is not None:
+            before_position = self.messages.position_of(before_message_id)
+            if before_position is None:
+                raise ValueError("Message not found in this chat.")
+        return self.messages.get_before(before_position, limit)
+
+    def get_messages_after(self, after_seq : int, limit : int =200) -> tuple[List[Dict[str, str | datetime]], bool]:
+        return self.messages.get_after(after_seq, limit)
+
+    def _read_seqs_from_unread(self, unread_messages_by) -> Dict[str, int]:
+        return {username: self.latest_seq for username in self.participants if username not in unread_messages_by}
+
     def to_dict(self) -> Dict[str, str | List[str] | datetime | List[str]]:
         return {
             "chat_id": self.chat_id,
             "chat_name": self.chat_name,
             "participants": list(self.participants.keys()),
             "time_created": self.time_created.isoformat(),
-            "unread_messages_by": list(self.unread_messages_by),
-            "messages": [msg for msg in self.messages.get_all_chats()],
+            "latest_seq": self.latest_seq,
+            "read_seqs": dict(self.read_seqs),
+            "messages": self.messages.get_all(),
             "last_message": self.get_last_message(),
             "last_message_time": self.get_last_message_time(),
             "participant_permissions": self.participants
         }
 
     def remove_last_message(self) -> None:
-        self.messages.remove_last()
\ No newline at end of file
+        removed_seq : int = self.latest_seq
+        removed_message = self.messages.remove_last()
+        if self.search_index is not None and removed_message is not None:
+            self.search_index.remove(self.chat_id, removed_seq, removed_message.get("message") or "")
\ No newline at end of file
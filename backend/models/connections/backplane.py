@@ -0,0 +1,25 @@
+# Where chat broadcasts are published and every member socket on this process receives them. Users, chats, sessions
+# and chat actors all live in this one process, so its sockets are the only ones there are; a backplane shared
+# between workers needs that state shared first
+class InProcessBackplane:
+
+    def __init__(self):
+        self.deliver = None
+
+    def set_handler(self, deliver):
+        self.deliver = deliver
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+    def publish(self, chat_id, frame):
+        self.deliver(chat_id, frame)
+
+    def subscribe(self, chat_id):
+        pass
+
+    def unsubscribe(self, chat_id):
+        pass
@@ -0,0 +1,83 @@
+import asyncio
+
+from backend.utils.logging_utils import get_logger
+
+log = get_logger("chat_actor")
+
+MAX_BATCH = 64
+
+
+# Owns one chat while it has work queued. Commands are plain functions run one after another on the actor's
+# task, so no other mutation can slip in at an await halfway through one; the events a batch emits are
+# published in order before any caller of that batch is answered
+class ChatActor:
+
+    def __init__(self, chat_id, publish, on_idle, max_batch=MAX_BATCH):
+        self.chat_id = chat_id
+        self.publish = publish
+        self.on_idle = on_idle
+        self.max_batch = max_batch
+        self.inbox = asyncio.Queue()
+        self.task = asyncio.create_task(self._run())
+
+    def submit(self, command):
+        future = asyncio.get_running_loop().create_future()
+        self.inbox.put_nowait((command, future))
+        return future
+
+    async def _run(self):
+        # Exits once the inbox is empty; the registry forgets the actor in the same step, so nothing is queued to a dead one
+        while not self.inbox.empty():
+            batch = []
+            while not self.inbox.empty() and len(batch) < self.max_batch:
+                batch.append(self.inbox.get_nowait())
+
+            events = []
+            outcomes = []
+            for command, future in batch:
+                try:
+                    outcomes.append((future, command(events.append), None))
+                except Exception as exception:
+                    outcomes.append((future, None, exception))
+
+            if events:
+                try:
+                    await self.publish(self.chat_id, events)
+                except Exception:
+                    log.exception("chat event publish failed", extra={"chat_id": self.chat_id, "events": len(events)})
+
+            for future, result, exception in outcomes:
+                if future.done():  # the caller went away
+                    continue
+                if exception is not None:
+                    future.set_exception(exception)
+                else:
+                    future.set_result(result)
+        self.on_idle(self.chat_id)
+
+
+# chat_id -> actor, for chats with commands in flight. Chats nobody is touching cost nothing
+class ChatActors:
+
+    def __init__(self, max_batch=MAX_BATCH):
+        self.max_batch = max_batch
+        self.actors = {}
+        self.publisher = None
+
+    def set_publisher(self, publish):
+        # publish(chat_id, events) is awaited once per batch with that batch's events in order
+        self.publisher = publish
+
+    async def run(self, chat_id, command):
+        # command(emit) mutates the chat and calls emit(event) for whatever members should see; its return value comes back here
+        actor = self.actors.get(chat_id)
+        if actor is None:
+            actor = self.actors[chat_id] = ChatActor(chat_id, self._publish, self._forget, self.max_batch)
+        return await actor.submit(command)
+
+    async def _publish(self, chat_id, events):
+        if self.publisher is not None:
+            await self.publisher(chat_id, events)
+
+    def _forget(self, chat_id):
+        self.actors.pop(chat_id, None)
@@ -0,0 +1,110 @@
+import asyncio
+
+from backend.utils.compact_encoding import encode_compact
+from backend.utils.json_encoding import encode_json
+from backend.utils.metrics import METRICS
+
+DROP_OLDEST = "drop_oldest"
+DISCONNECT = "disconnect"
+OVERFLOW_POLICIES = (DROP_OLDEST, DISCONNECT)
+
+TRY_AGAIN_LATER = 1013
+
+MAX_BATCH_FRAMES = 64
+
+SEND_QUEUE_OVERFLOWS = METRICS.counter("chatter_send_queue_overflows_total", "Frames that found a client's send queue full, by the policy applied.", ("policy",))
+FRAMES_SENT = METRICS.counter("chatter_ws_frames_sent_total", "WebSocket frames written to clients.")
+EVENTS_SENT = METRICS.counter("chatter_ws_events_sent_total", "Events written to clients; above frames sent when batching coalesces them.")
+
+
+# Wraps a WebSocket with a bounded outbound queue drained by its own writer task,
+# so a slow client only ever delays itself
+class ClientConnection:
+
+    def __init__(self, websocket, max_queue_size=256, overflow_policy=DROP_OLDEST, batch_window=None, max_batch_frames=MAX_BATCH_FRAMES, compact=False):
+        if overflow_policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy: {overflow_policy}")
+        self.websocket = websocket
+        self.overflow_policy = overflow_policy
+        # Seconds to hold the first queued frame while others catch up; None sends every frame on its own
+        self.batch_window = batch_window
+        self.max_batch_frames = max_batch_frames
+        # Compact clients get short field codes; broadcasters check this to hand them the compact frame
+        self.compact = compact
+        self._encode = encode_compact if compact else encode_json
+        self.queue = asyncio.Queue(maxsize=max_queue_size)
+        self.dropped_messages = 0
+        self.closed = False
+        self._writer_task = None
+
+    def start(self):
+        if self._writer_task is None:
+            self._writer_task = asyncio.create_task(self._write_loop())
+
+    async def send_json(self, payload):
+        # Same call shape as WebSocket.send_json, so handlers can reply through the connection unchanged
+        self.enqueue(self._encode(payload))
+
+    def enqueue(self, frame):
+        # Frames are already-encoded JSON text, so a broadcast encodes once for all recipients
+        if self.closed:
+            return False
+        try:
+            self.queue.put_nowait(frame)
+            return True
+        except asyncio.QueueFull:
+            pass
+
+        SEND_QUEUE_OVERFLOWS.inc(self.overflow_policy)
+        if self.overflow_policy == DISCONNECT:
+            self.close(TRY_AGAIN_LATER, "Client is not keeping up.")
+            return False
+        self.queue.get_nowait()
+        self.dropped_messages += 1
+        self.queue.put_nowait(frame)
+        return True
+
+    def close(self, code=1000, reason=None):
+        if self.closed:
+            return
+        self.closed = True
+        if self._writer_task is not None:
+            self._writer_task.cancel()
+        asyncio.create_task(self._close_socket(code, reason))
+
+    async def stop(self):
+        self.closed = True
+        if self._writer_task is not None:
+            self._writer_task.cancel()
+            try:
+                await self._writer_task
+            except asyncio.CancelledError:
+                pass
+            self._writer_task = None
+
+    async def _write_loop(self):
+        while True:
+            frame = await self.queue.get()
+            frame_count = 1
+            if self.batch_window is not None:
+                # Everything queued within the window (broadcasts, then the sender's ack) goes out as one JSON array
+                await asyncio.sleep(self.batch_window)
+                frames = [frame]
+                while len(frames) < self.max_batch_frames and not self.queue.empty():
+                    frames.append(self.queue.get_nowait())
+                frame_count = len(frames)
+                if frame_count > 1:
+                    frame = "[" + ",".join(frames) + "]"
+            try:
+                await self.websocket.send_text(frame)
+            except Exception:
+                self.close()
+                return
+            FRAMES_SENT.inc()
+            EVENTS_SENT.inc(amount=frame_count)
+
+    async def _close_socket(self, code, reason):
+        try:
+            await self.websocket.close(code, reason)
+        except Exception:
+            pass
@@ -0,0 +1,89 @@
+# Live websocket connections, indexed both ways so that neither a broadcast nor a disconnect scans other chats
+class ConnectionRegistry:
+
+    def __init__(self, backplane=None):
+        # Told which chats have local members, so other workers only forward frames this process needs
+        self.backplane = backplane
+        # username -> ClientConnection
+        self.user_connections = {}
+        # chat_id -> {username: {"connection": ClientConnection, "subscription_type": str | None}}
+        self.chat_members = {}
+        # username -> set of chat IDs the user's connection is attached to
+        self.user_chats = {}
+
+    def add_user(self, username, connection):
+        self.user_connections[username] = connection
+
+    def get_user(self, username):
+        return self.user_connections.get(username)
+
+    def remove_user(self, username, connection=None):
+        # A reconnect may already have replaced this connection; only its own owner cleans up
+        if connection is not None and self.user_connections.get(username) is not connection:
+            return
+        self.user_connections.pop(username, None)
+        for chat_id in self.user_chats.pop(username, ()):
+            self._remove_member(chat_id, username)
+
+    def attach(self, chat_id, username):
+        connection = self.user_connections.get(username)
+        if connection is None:
+            return
+        chat_map = self.chat_members.get(chat_id)
+        if chat_map is None:
+            chat_map = self.chat_members[chat_id] = {}
+            if self.backplane is not None:
+                self.backplane.subscribe(chat_id)
+        chat_map[username] = {"connection": connection, "subscription_type": None}
+        self.user_chats.setdefault(username, set()).add(chat_id)
+
+    def detach(self, chat_id, username):
+        chat_ids = self.user_chats.get(username)
+        if chat_ids is not None:
+            chat_ids.discard(chat_id)
+            if not chat_ids:
+                del self.user_chats[username]
+        self._remove_member(chat_id, username)
+
+    def drop_chat(self, chat_id):
+        chat_map = self.chat_members.pop(chat_id, None)
+        if chat_map is None:
+            return
+        if self.backplane is not None:
+            self.backplane.unsubscribe(chat_id)
+        for username in chat_map:
+            chat_ids = self.user_chats.get(username)
+            if chat_ids is not None:
+                chat_ids.discard(chat_id)
+                if not chat_ids:
+                    del self.user_chats[username]
+
+    def members(self, chat_id):
+        return self.chat_members.get(chat_id) or {}
+
+    def set_subscription(self, chat_id, username, subscription_type):
+        member = self.members(chat_id).get(username)
+        if member is not None:
+            member["subscription_type"] = subscription_type
+
+    def rename_user(self, old_username, new_username):
+        connection = self.user_connections.pop(old_username, None)
+        if connection is not None:
+            self.user_connections[new_username] = connection
+        chat_ids = self.user_chats.pop(old_username, set())
+        for chat_id in chat_ids:
+            chat_map = self.chat_members.get(chat_id)
+            if chat_map is not None and old_username in chat_map:
+                chat_map[new_username] = chat_map.pop(old_username)
+        if chat_ids:
+            self.user_chats[new_username] = chat_ids
+
+    def _remove_member(self, chat_id, username):
+        chat_map = self.chat_members.get(chat_id)
+        if not chat_map:
+            return
+        chat_map.pop(username, None)
+        if not chat_map:
+            del self.chat_members[chat_id]
+            if self.backplane is not None:
+                self.backplane.unsubscribe(chat_id)
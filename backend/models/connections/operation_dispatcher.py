@@ -0,0 +1,131 @@
+import asyncio
+import time
+
+from backend.utils.logging_utils import get_logger
+
+log = get_logger("operation_dispatcher")
+
+# How an operation is ordered against the others from the same connection
+CHAT_LANE = "chat"              # In order with the connection's other operations on the same chat_id
+CONNECTION_LANE = "connection"  # In order with the connection's other chat-less operations
+EXCLUSIVE = "exclusive"         # Waits for every lane to drain and holds back everything after it
+
+MAX_LANE_BACKLOG = 64
+
+
+class Operation:
+
+    __slots__ = ("name", "handler", "fields", "lane")
+
+    def __init__(self, name, handler, fields, lane):
+        self.name = name
+        self.handler = handler
+        self.fields = fields
+        self.lane = lane
+
+
+class Lane:
+
+    __slots__ = ("queue", "task", "waiting_puts")
+
+    def __init__(self, queue):
+        self.queue = queue
+        self.task = None
+        # Submitters blocked on a full queue; the worker may not retire the lane while any are waiting
+        self.waiting_puts = 0
+
+
+# Operation name -> handler, with the payload fields each handler requires declared up front
+class OperationRegistry:
+
+    def __init__(self):
+        self.operations = {}
+
+    def register(self, name, fields=None, lane=CHAT_LANE):
+        fields = dict(fields or {})
+        if lane == CHAT_LANE:
+            fields.setdefault("chat_id", str)
+
+        def decorator(handler):
+            self.operations[name] = Operation(name, handler, fields, lane)
+            return handler
+        return decorator
+
+    def get(self, name):
+        return self.operations.get(name)
+
+
+# One per connection. Operations on different chats run concurrently, so a slow create_chat no longer
+# holds up the same user's messages, while each chat's operations still run in the order they arrived
+class OperationPipeline:
+
+    def __init__(self, registry, session, send_error, operation_seconds=None, max_lane_backlog=MAX_LANE_BACKLOG):
+        self.registry = registry
+        self.session = session
+        self.send_error = send_error
+        self.operation_seconds = operation_seconds
+        self.max_lane_backlog = max_lane_backlog
+        # lane key -> Lane holding the queue of pending (operation, payload) and its worker task
+        self.lanes = {}
+
+    async def submit(self, name, payload):
+        operation = self.registry.get(name)
+        if operation is None:
+            await self.send_error(self.session.connection, name or "unknown", "unsupported_operation", "Unsupported operation")
+            return
+        if not isinstance(payload, dict):
+            await self.send_error(self.session.connection, name, "invalid_payload", "Payload must be an object")
+            return
+        for field, field_type in operation.fields.items():
+            value = payload.get(field)
+            if not value:
+                await self.send_error(self.session.connection, name, f"missing_{field}", f"Missing {field.replace('_', ' ')}")
+                return
+            if not isinstance(value, field_type):
+                await self.send_error(self.session.connection, name, f"invalid_{field}", f"Invalid {field.replace('_', ' ')}")
+                return
+
+        if operation.lane == EXCLUSIVE:
+            await self.drain()
+            await self._run(operation, payload)
+            return
+
+        lane_key = payload["chat_id"] if operation.lane == CHAT_LANE else None
+        lane = self.lanes.get(lane_key)
+        if lane is None:
+            lane = self.lanes[lane_key] = Lane(asyncio.Queue(self.max_lane_backlog))
+            lane.task = asyncio.create_task(self._run_lane(lane_key, lane))
+        # A full lane pushes back on the receive loop rather than buffering without bound
+        lane.waiting_puts += 1
+        try:
+            await lane.queue.put((operation, payload))
+        finally:
+            lane.waiting_puts -= 1
+
+    async def drain(self):
+        while self.lanes:
+            await asyncio.gather(*(lane.task for lane in list(self.lanes.values())))
+
+    async def stop(self):
+        for lane in list(self.lanes.values()):
+            lane.task.cancel()
+        await asyncio.gather(*(lane.task for lane in list(self.lanes.values())), return_exceptions=True)
+        self.lanes.clear()
+
+    async def _run_lane(self, lane_key, lane):
+        # Lanes exit once idle, so a connection only holds tasks for chats it is actively using. Idle means
+        # nothing queued and nobody blocked on a put; the check and the pop happen without an await between them
+        while not lane.queue.empty() or lane.waiting_puts:
+            operation, payload = await lane.queue.get()
+            await self._run(operation, payload)
+        self.lanes.pop(lane_key, None)
+
+    async def _run(self, operation, payload):
+        started = time.perf_counter()
+        try:
+            await operation.handler(self.session, payload)
+        except Exception:
+            log.exception("operation failed", extra={"operation": operation.name, "username": self.session.username})
+            await self.send_error(self.session.connection, operation.name, "internal_error", "Operation failed")
+        if self.operation_seconds is not None:
+            self.operation_seconds.observe(time.perf_counter() - started, operation.name)
@@ -0,0 +1,30 @@
+import asyncio
+
+
+# Coalesces read receipts per chat over a short window: one journal record and at most one
+# broadcast per chat per window, however many participants read in the meantime
+class ReadReceiptBatcher:
+
+    def __init__(self, flush_handler, window_seconds=0.05):
+        self.flush_handler = flush_handler
+        self.window_seconds = window_seconds
+        # chat_id -> {username: whether the read should be announced to the chat}
+        self.pending = {}
+        self._flush_task = None
+
+    def add(self, chat_id, username, announce=True):
+        chat_reads = self.pending.setdefault(chat_id, {})
+        chat_reads[username] = chat_reads.get(username, False) or announce
+        if self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush_later())
+
+    async def flush(self):
+        pending, self.pending = self.pending, {}
+        for chat_id, chat_reads in pending.items():
+            announced_usernames = [username for username, announce in chat_reads.items() if announce]
+            await self.flush_handler(chat_id, list(chat_reads), announced_usernames)
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.window_seconds)
+        self._flush_task = None
+        await self.flush()
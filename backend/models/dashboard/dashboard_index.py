@@ -0,0 +1,70 @@
+from collections import OrderedDict
+
+
+# Per-user chat lists ordered by last activity, kept up to date by the chats themselves
+class DashboardIndex:
+
+    def __init__(self, chat_lookup):
+        self.chat_lookup = chat_lookup
+        # username -> OrderedDict of chat IDs, least recently active first
+        self.dashboards = {}
+        # chat ID -> usernames whose built dashboard holds it. Dashboards are built lazily, so a message in a chat
+        # whose members have not loaded theirs (including every message during replay) touches nothing here
+        self.watchers = {}
+
+    def chat_active(self, chat):
+        for username in self.watchers.get(chat.chat_id, ()):
+            self.dashboards[username].move_to_end(chat.chat_id)
+
+    def participant_added(self, chat, username):
+        # A new member has no activity position for this chat yet; rebuild their dashboard on the next load
+        self.invalidate(username)
+
+    def invalidate(self, username):
+        dashboard = self.dashboards.pop(username, None)
+        for chat_id in dashboard or ():
+            self._unwatch(chat_id, username)
+
+    def get_page(self, user, offset, limit):
+        dashboard = self.dashboards.get(user.username)
+        if dashboard is None or len(dashboard) < len(user.chat_ids):
+            dashboard = self._build(user)
+
+        chats = []
+        stale_chat_ids = []
+        has_more = False
+        skipped = 0
+        for chat_id in reversed(dashboard):
+            chat = self.chat_lookup(chat_id)
+            if chat is None or chat_id not in user.chat_ids:
+                stale_chat_ids.append(chat_id)  # Deleted chats and chats the user left are pruned on read
+                continue
+            if skipped < offset:
+                skipped += 1
+                continue
+            if len(chats) == limit:
+                has_more = True
+                break
+            chats.append(chat)
+
+        for chat_id in stale_chat_ids:
+            del dashboard[chat_id]
+            self._unwatch(chat_id, user.username)
+        return chats, has_more
+
+    def _build(self, user):
+        self.invalidate(user.username)
+        chats = [chat for chat in map(self.chat_lookup, user.chat_ids) if chat is not None]
+        chats.sort(key=lambda chat: chat.get_last_activity_timestamp())
+        dashboard = OrderedDict((chat.chat_id, None) for chat in chats)
+        self.dashboards[user.username] = dashboard
+        for chat_id in dashboard:
+            self.watchers.setdefault(chat_id, set()).add(user.username)
+        return dashboard
+
+    def _unwatch(self, chat_id, username):
+        watchers = self.watchers.get(chat_id)
+        if watchers is not None:
+            watchers.discard(username)
+            if not watchers:
+                del self.watchers[chat_id]
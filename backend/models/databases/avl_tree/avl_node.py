@@ -1,5 +1,7 @@
 class AVLNode:
 
+    __slots__ = ("key", "value", "left", "right", "height")
+
     def __init__(self, key, value, left=None, right=None):
         self.key = key
         self.value = value
@@ -7,5 +9,12 @@ class AVLNode:
         self.right = right
         self.height = 1
 
+    def __setstate__(self, state):
+        # Snapshots written before __slots__ pickled nodes with a plain __dict__ state
+        if isinstance(state, tuple):
+            state = state[1]
+        for attribute, value in state.items():
+            setattr(self, attribute, value)
+
     def __str__(self):
-        return f"AVL Node: Key: {self.key}, Value: {self.value}, Height: {self.height}, Left: {self.left if self.left else None}, Right: {self.right if self.right else None}"
\ No newline at end of file
+        return f"AVL Node: Key: {self.key}, Value: {self.value}, Height: {self.height}, Left: {self.left if self.left else None}, Right: {self.right if self.right else None}"
@@ -1,86 +1,246 @@
 import os
 import pickle
+import threading
+from copy import copy
 
 from backend.models.databases.avl_tree.avl_node import AVLNode
+from backend.models.databases.journal.journal import Journal
+from backend.utils.metrics import METRICS
+
+CAPTURE_SECONDS = METRICS.histogram("chatter_tree_capture_seconds", "Time the event loop spends copying a tree's items for a snapshot.", ("tree",))
+SAVE_SECONDS = METRICS.histogram("chatter_tree_save_seconds", "Time to serialize a full tree snapshot.", ("tree",))
+FLUSH_SECONDS = METRICS.histogram("chatter_tree_flush_seconds", "Time to write pending snapshots and journal records to disk.", ("tree",))
 
 
 class AVLTree:
 
-    def __init__(self, file_name):
+    def __init__(self, file_name, journaled=False, compaction_threshold=5000):
         self.root = None
         self.file_name = file_name
+        self.journal_epoch = 0
+        self.journal = Journal(f"{file_name}.journal", compaction_threshold) if journaled else None
+        self.persistence_worker = None
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._pending_snapshot = None
         if os.path.exists(file_name):
             self._load_from_file()
         else:
             self.save()
 
     def insert(self, key, value):
-        self.root = self._insert(self.root, key, value)
+        path = []
+        node = self.root
+        while node is not None:
+            if key < node.key:
+                path.append(node)
+                node = node.left
+            elif key > node.key:
+                path.append(node)
+                node = node.right
+            else:
+                return node  # Duplicate keys not allowed
+
+        new_node = AVLNode(key, value)
+        self._attach(path, new_node)
+        return new_node
 
     def delete(self, key):
-        self.root = self._delete(self.root, key)
+        path = []
+        node = self.root
+        while node is not None and node.key != key:
+            path.append(node)
+            node = node.left if key < node.key else node.right
+        if node is None:
+            return None
+
+        parent = path[-1] if path else None
+        if node.left is None or node.right is None:
+            self._replace_child(parent, node, node.left if node.left is not None else node.right)
+        else:
+            # Move the in-order successor node into place so node identities stay stable
+            successor_path = []
+            successor = node.right
+            while successor.left is not None:
+                successor_path.append(successor)
+                successor = successor.left
+            if successor_path:
+                successor_path[-1].left = successor.right
+                successor.right = node.right
+            successor.left = node.left
+            successor.height = node.height
+            self._replace_child(parent, node, successor)
+            path.append(successor)
+            path.extend(successor_path)
+
+        node.left = None
+        node.right = None
+        node.height = 1
+        self._rebalance_path(path)
+        return node
 
     def search(self, key):
-        return self._search(self.root, key)
+        node = self.root
+        while node is not None:
+            node_key = node.key
+            if key == node_key: return node
+            node = node.left if key < node_key else node.right
+        return None
+
+    def nodes(self):
+        stack = []
+        node = self.root
+        while stack or node is not None:
+            while node is not None:
+                stack.append(node)
+                node = node.left
+            node = stack.pop()
+            yield node
+            node = node.right
+
+    def items(self):
+        for node in self.nodes():
+            yield node.key, node.value
+
+    def range_items(self, lower=None, upper=None, include_lower=True, include_upper=False):
+        # Descend to the lower bound once, then continue an in-order walk: O(log n + k)
+        stack = []
+        node = self.root
+        while node is not None:
+            if lower is None or node.key > lower or (include_lower and node.key == lower):
+                stack.append(node)
+                node = node.left
+            else:
+                node = node.right
+
+        while stack:
+            node = stack.pop()
+            if upper is not None and (node.key > upper or (node.key == upper and not include_upper)):
+                return
+            yield node.key, node.value
+            node = node.right
+            while node is not None:
+                stack.append(node)
+                node = node.left
+
+    def prefix_items(self, prefix, after=None):
+        lower, include_lower = prefix, True
+        if after is not None and after >= prefix:
+            lower, include_lower = after, False
+        for key, value in self.range_items(lower, include_lower=include_lower):
+            if not key.startswith(prefix):
+                return
+            yield key, value
+
+    def bulk_load(self, sorted_items):
+        sorted_items = list(sorted_items)
+        for index in range(1, len(sorted_items)):
+            if not sorted_items[index - 1][0] < sorted_items[index][0]:
+                raise ValueError("bulk_load requires items sorted by strictly increasing key")
+        self.root = self._build_balanced(sorted_items, 0, len(sorted_items))
+
+    def log(self, operation, *args):
+        # Without a journal every mutation falls back to rewriting the whole snapshot
+        if self.journal is None:
+            self.save()
+            return
+        with self._lock:
+            record_size = self.journal.append(operation, *args)
+            needs_compaction = self.journal.needs_compaction()
+        if needs_compaction:
+            self.save()
+        else:
+            self._schedule_flush(record_size)
+
+    def replay(self, apply_record):
+        if self.journal is None:
+            return 0
+        replayed = self.journal.replay(self.journal_epoch, apply_record)
+        self.flush()
+        return replayed
+
+    def flush(self):
+        # Runs on the persistence worker: snapshots are pickled and written here, outside the state lock
+        with self._flush_lock, FLUSH_SECONDS.time(os.path.basename(self.file_name)):
+            with self._lock:
+                snapshot, self._pending_snapshot = self._pending_snapshot, None
+                journal_writes = self.journal.drain() if self.journal is not None else None
+            if snapshot is not None:
+                with SAVE_SECONDS.time(os.path.basename(self.file_name)):
+                    data = pickle.dumps(snapshot, protocol=pickle.HIGHEST_PROTOCOL)
+                self._write_snapshot(data)
+            if journal_writes is not None and (journal_writes[0] or journal_writes[1]):
+                self.journal.write(*journal_writes)
+
+    def close(self):
+        self.flush()
+        if self.journal is not None:
+            self.journal.close()
+
+    def _schedule_flush(self, pending_bytes):
+        if self.persistence_worker is None:
+            self.flush()
+        else:
+            self.persistence_worker.mark_dirty(self, pending_bytes)
 
     def change_key(self, old_key, new_key):
         if old_key == new_key:
             return None
 
-        node = self._search(self.root, old_key)
-        if node is None:
+        if self.search(old_key) is None:
             return None
 
         # prevent duplicates (tree rejects duplicates on insert)
-        if self._search(self.root, new_key) is not None:
+        if self.search(new_key) is not None:
             raise ValueError("new_key already exists")
 
-        value = node.value
-        self.root = self._delete(self.root, old_key)
-        self.root = self._insert(self.root, new_key, value)
+        node = self.delete(old_key)
+        node.key = new_key
+        path = []
+        parent = self.root
+        while parent is not None:
+            path.append(parent)
+            parent = parent.left if new_key < parent.key else parent.right
+        self._attach(path, node)
         return None
 
-    def _insert(self, node, key, value):
-        if node is None:
-            return AVLNode(key, value)
-
-        if key < node.key:
-            node.left = self._insert(node.left, key, value)
-        elif key > node.key:
-            node.right = self._insert(node.right, key, value)
+    def _attach(self, path, new_node):
+        if not path:
+            self.root = new_node
+            return
+        parent = path[-1]
+        if new_node.key < parent.key:
+            parent.left = new_node
         else:
-            return node  # Duplicate keys not allowed
-
-        return self._rebalance(node)
-
-    def _delete(self, node, key):
-        if node is None:
-            return None
-
-        if key < node.key:
-            node.left = self._delete(node.left, key)
-        elif key > node.key:
-            node.right = self._delete(node.right, key)
+            parent.right = new_node
+        self._rebalance_path(path)
+
+    def _rebalance_path(self, path):
+        for index in range(len(path) - 1, -1, -1):
+            node = path[index]
+            previous_height = node.height
+            subtree_root = self._rebalance(node)
+            if subtree_root is node and node.height == previous_height:
+                return  # Nothing above this node can have changed
+            self._replace_child(path[index - 1] if index > 0 else None, node, subtree_root)
+
+    def _replace_child(self, parent, old_child, new_child):
+        if parent is None:
+            self.root = new_child
+        elif parent.left is old_child:
+            parent.left = new_child
         else:
-            if node.left is None and node.right is None:
-                return None
-
-            if node.left is None:
-                return node.right
-            if node.right is None:
-                return node.left
-
-            in_order_successor = self._min_value_node(node.right)
-            node.key = in_order_successor.key
-            node.value = in_order_successor.value
-            node.right = self._delete(node.right, in_order_successor.key)
-
-        return self._rebalance(node)
-
-    def _search(self, node, key):
-        if node is None or node.key == key: return node
-        if key < node.key: return self._search(node.left, key)
-        return self._search(node.right, key)
+            parent.right = new_child
+
+    def _build_balanced(self, sorted_items, start, end):
+        if start >= end: return None
+        middle = (start + end) // 2
+        key, value = sorted_items[middle]
+        node = AVLNode(key, value)
+        node.left = self._build_balanced(sorted_items, start, middle)
+        node.right = self._build_balanced(sorted_items, middle + 1, end)
+        node.height = 1 + max(self._get_height(node.left), self._get_height(node.right))
+        return node
 
     def _rotate_left(self, node):
         temp_right_node = node.right
@@ -132,15 +292,47 @@ class AVLTree:
 
         return node
 
-    def _min_value_node(self, node):
-        if node.left is None: return node
-        return self._min_value_node(node.left)
-
     def _load_from_file(self):
         with open(self.file_name, "rb") as file:
             loaded_tree = pickle.load(file)
             self.root = loaded_tree.root
+            self.journal_epoch = getattr(loaded_tree, "journal_epoch", 0)
 
     def save(self):
-        with open(self.file_name, "wb") as file:
-            pickle.dump(self, file)
+        # The loop only copies the items, at the same instant the journal starts its new epoch; values copy whatever
+        # they change in place (see their __copy__), so the worker can pickle the copy while the loop keeps mutating
+        with self._lock, CAPTURE_SECONDS.time(os.path.basename(self.file_name)):
+            self.journal_epoch += 1
+            self._pending_snapshot = TreeSnapshot(self.file_name, self.journal_epoch, [(key, copy(value)) for key, value in self.items()])
+            if self.journal is not None:
+                self.journal.reset(self.journal_epoch)
+        self._schedule_flush(0)
+
+    def _write_snapshot(self, snapshot):
+        temp_file_name = f"{self.file_name}.tmp"
+        with open(temp_file_name, "wb") as file:
+            file.write(snapshot)
+        os.replace(temp_file_name, self.file_name)
+
+    def __getstate__(self):
+        # Snapshots store sorted items rather than the node graph so loading can bulk_load in O(n)
+        return {"file_name": self.file_name, "journal_epoch": self.journal_epoch, "items": list(self.items())}
+
+    def __setstate__(self, state):
+        self.root = state.get("root")
+        self.file_name = state.get("file_name")
+        self.journal_epoch = state.get("journal_epoch", 0)
+        if "items" in state:
+            self.bulk_load(state["items"])
+
+
+# A point-in-time copy of a tree's items. It pickles exactly as the tree itself does, so loading gets an AVLTree
+class TreeSnapshot:
+
+    def __init__(self, file_name, journal_epoch, items):
+        self.file_name = file_name
+        self.journal_epoch = journal_epoch
+        self.items = items
+
+    def __reduce__(self):
+        return object.__new__, (AVLTree,), {"file_name": self.file_name, "journal_epoch": self.journal_epoch, "items": self.items}
@@ -1,28 +1,148 @@
+import os
 import uuid
 
 from backend.models.chat import Chat
+from backend.models.dashboard.dashboard_index import DashboardIndex
 from backend.models.databases.avl_tree.avl_tree import AVLTree
+from backend.models.message_store.segment_file import remove_segment
+from backend.models.search.message_index import MessageIndex
 
 
 class ChatDatabase:
 
-    def __init__(self, file_path):
-        self.chats = AVLTree(file_path)
+    def __init__(self, file_path, journaled=False, segment_directory=None, hot_message_chunks=2, message_search=False):
+        self.segment_directory = segment_directory
+        self.hot_message_chunks = hot_message_chunks
+        if segment_directory is not None:
+            os.makedirs(segment_directory, exist_ok=True)
+
+        self.chats = AVLTree(file_path, journaled=journaled)
+        # Point lookups by chat ID go through the hash index; the tree keeps the ordered view
+        self.chat_index = {}
+        self.dashboards = DashboardIndex(self._find_chat)
+        # The search index lives in memory (a few hundred bytes per message) and is rebuilt at startup by reading every
+        # cold chunk, which gives up the bounded resident history of the message store; deployments opt in to it
+        self.search_index = MessageIndex() if message_search else None
+        for node in self.chats.nodes():
+            self._index_chat(node)
+        self.chats.replay(self._apply_record)
+        self._remove_orphaned_segments()
 
     def search_for_chat(self, chat_id):
-        return self.chats.search(chat_id)
+        return self.chat_index.get(chat_id)
+
+    def get_dashboard_page(self, user, offset, limit):
+        return self.dashboards.get_page(user, offset, limit)
+
+    def search_messages(self, user, query, offset, limit):
+        hits, has_more = self.search_index.search(user.chat_ids, query, offset, limit)
+        results = []
+        for chat_id, seq, score in hits:
+            chat = self._find_chat(chat_id)
+            if chat is not None:
+                results.append((chat, chat.messages.get(seq - 1), score))
+        return results, has_more
 
     def add_chat(self, owner, participants, chat_name, participant_permissions) -> tuple[str, Chat]:
         chat_id = str(uuid.uuid4())
-        if self.chats.search(chat_id) is not None:
+        if chat_id in self.chat_index:
             raise ValueError("Chat ID already exists.")
 
         new_chat = Chat(chat_id= chat_id, chat_owner= owner, participants= participants, participant_permissions= participant_permissions, chat_name= chat_name)
-        self.chats.insert(chat_id, new_chat)
+        self._insert_chat(chat_id, new_chat)
+        self.chats.log("add_chat", chat_id, new_chat)
         return chat_id, new_chat
 
     def delete_chat(self, chat_id):
-        self.chats.delete(chat_id)
+        self._delete_chat(chat_id)
+        self.chats.log("delete_chat", chat_id)
+
+    def record_message(self, chat_id, message):
+        self.chats.log("message", chat_id, message)
+
+    def record_read_seqs(self, chat, usernames):
+        read_seqs = {username: chat.read_seqs[username] for username in usernames if username in chat.read_seqs}
+        if read_seqs:
+            self.chats.log("read_seqs", chat.chat_id, read_seqs)
+
+    def record_participant(self, chat, username):
+        self.chats.log("participant", chat.chat_id, username, dict(chat.participants[username]))
+
+    def record_participant_removed(self, chat, username):
+        self.chats.log("participant_removed", chat.chat_id, username)
+
+    def record_fields(self, chat, *fields):
+        self.chats.log("fields", chat.chat_id, {field: getattr(chat, field) for field in fields})
 
     def save_chat_database(self):
-        self.chats.save()
\ No newline at end of file
+        self.chats.save()
+
+    def attach_persistence_worker(self, worker):
+        worker.register(self.chats)
+
+    def flush(self):
+        self.chats.flush()
+
+    def close(self):
+        self.chats.close()
+
+    def _insert_chat(self, chat_id, chat):
+        self._index_chat(self.chats.insert(chat_id, chat))
+
+    def _index_chat(self, chat_node):
+        self.chat_index[chat_node.key] = chat_node
+        chat_node.value.attach_dashboard_index(self.dashboards)
+        if self.segment_directory is not None:
+            chat_node.value.messages.enable_spill(self._segment_path(chat_node.key), self.hot_message_chunks)
+        if self.search_index is not None:
+            chat_node.value.attach_search_index(self.search_index)
+
+    def _find_chat(self, chat_id):
+        chat_node = self.chat_index.get(chat_id)
+        return chat_node.value if chat_node is not None else None
+
+    def _segment_path(self, chat_id):
+        return os.path.join(self.segment_directory, f"{chat_id}.seg")
+
+    def _remove_orphaned_segments(self):
+        # Segments of deleted chats are only removed here, once the deletion can no longer be lost from the journal
+        if self.segment_directory is None:
+            return
+        for file_name in os.listdir(self.segment_directory):
+            chat_id, extension = os.path.splitext(file_name)
+            if extension == ".seg" and chat_id not in self.chat_index:
+                remove_segment(os.path.join(self.segment_directory, file_name))
+
+    def _delete_chat(self, chat_id):
+        self.chats.delete(chat_id)
+        self.chat_index.pop(chat_id, None)
+        if self.search_index is not None:
+            self.search_index.drop_chat(chat_id)
+
+    def _apply_record(self, operation, *args):
+        if operation == "add_chat":
+            chat_id, chat = args
+            self._insert_chat(chat_id, chat)
+            return
+        if operation == "delete_chat":
+            self._delete_chat(args[0])
+            return
+
+        chat_node = self.chat_index.get(args[0])
+        if chat_node is None: return  # Chat was deleted later in the journal
+        chat = chat_node.value
+
+        if operation == "message":
+            chat.add_message(args[1])
+        elif operation == "read":
+            chat.mark_as_read_by(args[1])  # Journals written before read sequence numbers
+        elif operation == "read_seqs":
+            chat.read_seqs.update(args[1])
+        elif operation == "participant":
+            chat.participants[args[1]] = args[2]
+        elif operation == "participant_removed":
+            chat.participants.pop(args[1], None)
+            chat.read_seqs.pop(args[1], None)
+        elif operation == "fields":
+            for field, value in args[1].items():
+                setattr(chat, field, value)
@@ -0,0 +1,90 @@
+import os
+import pickle
+
+EPOCH_RECORD = "epoch"
+
+
+class Journal:
+
+    def __init__(self, file_name, compaction_threshold=5000):
+        self.file_name = file_name
+        self.compaction_threshold = compaction_threshold
+        self.epoch = 0
+        self.record_count = 0
+        self._file = None
+        self._buffer = bytearray()
+        self._truncate = False
+
+    def append(self, operation, *args):
+        record = pickle.dumps((operation, args), protocol=pickle.HIGHEST_PROTOCOL)
+        self._buffer += record
+        self.record_count += 1
+        return len(record)
+
+    def needs_compaction(self):
+        return self.record_count >= self.compaction_threshold
+
+    def has_pending_writes(self):
+        return self._truncate or len(self._buffer) > 0
+
+    def replay(self, epoch, apply_record):
+        self.epoch = epoch
+        self.record_count = 0
+        if not os.path.exists(self.file_name):
+            self.reset(epoch)
+            return 0
+
+        valid_length = 0
+        with open(self.file_name, "rb") as file:
+            try:
+                header = pickle.load(file)
+            except Exception:
+                header = None
+
+            # A journal from another epoch was already folded into the snapshot (crash between snapshot and reset).
+            if header != (EPOCH_RECORD, (epoch,)):
+                file.close()
+                self.reset(epoch)
+                return 0
+
+            valid_length = file.tell()
+            while True:
+                try:
+                    operation, args = pickle.load(file)
+                except Exception:
+                    break  # End of the journal, or a torn final write from a crash
+                apply_record(operation, *args)
+                valid_length = file.tell()
+                self.record_count += 1
+
+        with open(self.file_name, "r+b") as file:
+            file.truncate(valid_length)
+        return self.record_count
+
+    def reset(self, epoch):
+        # Records buffered for the previous epoch are already part of the new snapshot
+        self.epoch = epoch
+        self.record_count = 0
+        self._truncate = True
+        self._buffer = bytearray(pickle.dumps((EPOCH_RECORD, (epoch,)), protocol=pickle.HIGHEST_PROTOCOL))
+
+    def drain(self):
+        pending = (self._truncate, bytes(self._buffer))
+        self._truncate = False
+        self._buffer = bytearray()
+        return pending
+
+    def write(self, truncate, data):
+        if truncate:
+            self.close()
+            self._file = open(self.file_name, "wb")
+        elif self._file is None:
+            self._file = open(self.file_name, "ab")
+        if not data: return
+        self._file.write(data)
+        self._file.flush()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
@@ -0,0 +1,65 @@
+import threading
+
+from backend.utils.logging_utils import get_logger
+
+log = get_logger("persistence_worker")
+
+
+class PersistenceWorker:
+
+    def __init__(self, flush_interval=0.25, max_pending_bytes=256 * 1024):
+        self.flush_interval = flush_interval
+        self.max_pending_bytes = max_pending_bytes
+        self._dirty_trees = set()
+        self._pending_bytes = 0
+        self._condition = threading.Condition()
+        self._running = False
+        self._thread = None
+
+    def register(self, tree):
+        tree.persistence_worker = self
+
+    def start(self):
+        if self._running: return
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="persistence-worker", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        with self._condition:
+            self._running = False
+            self._condition.notify()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.flush()
+
+    def mark_dirty(self, tree, pending_bytes=0):
+        # Without a running worker (scripts, tests) writes stay synchronous
+        if not self._running:
+            tree.flush()
+            return
+        with self._condition:
+            self._dirty_trees.add(tree)
+            self._pending_bytes += pending_bytes
+            if self._pending_bytes >= self.max_pending_bytes:
+                self._condition.notify()
+
+    def flush(self):
+        with self._condition:
+            dirty_trees = self._dirty_trees
+            self._dirty_trees = set()
+            self._pending_bytes = 0
+        for tree in dirty_trees:
+            tree.flush()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                if self._running and self._pending_bytes < self.max_pending_bytes:
+                    self._condition.wait(self.flush_interval)
+                if not self._running: return
+            try:
+                self.flush()
+            except Exception:
+                log.exception("persistence worker flush failed")
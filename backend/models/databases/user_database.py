@@ -3,19 +3,81 @@ from backend.models.databases.avl_tree.avl_tree import AVLTree
 
 class UserDatabase:
 
-    def __init__(self, file_path):
-        self.users = AVLTree(file_path)
+    def __init__(self, file_path, journaled=False):
+        self.users = AVLTree(file_path, journaled=journaled)
+        # Point lookups by username go through the hash index; the tree keeps the ordered view
+        self.user_index = {node.key: node for node in self.users.nodes()}
+        self.users.replay(self._apply_record)
 
     def add_user(self, username, password):
-        if self.users.search(username) is not None:
+        if username in self.user_index:
             raise ValueError("Username already exists.")
-        self.users.insert(username, password)
+        self._insert_user(username, password)
+        self.users.log("add_user", username, password)
 
     def search_for_user(self, username):
-        return self.users.search(username)
+        return self.user_index.get(username)
+
+    def search_by_prefix(self, prefix, limit, after=None):
+        users = []
+        for _, user in self.users.prefix_items(prefix, after):
+            if len(users) == limit:
+                return users, users[-1].username
+            users.append(user)
+        return users, None
 
     def update_username_key(self, old_username, new_username):
-        self.users.change_key(old_username, new_username)
+        self._change_user_key(old_username, new_username)
+        self.users.log("rename", old_username, new_username)
+
+    # Each change is journaled as itself (one set member or field), so its record does not grow with the user
+    def record_added(self, user, field, member):
+        self.users.log("set_add", user.username, field, member)
+
+    def record_removed(self, user, field, member):
+        self.users.log("set_remove", user.username, field, member)
+
+    def record_fields(self, user, *fields):
+        self.users.log("fields", user.username, {field: getattr(user, field) for field in fields})
 
     def save(self):
-        self.users.save()
\ No newline at end of file
+        self.users.save()
+
+    def attach_persistence_worker(self, worker):
+        worker.register(self.users)
+
+    def flush(self):
+        self.users.flush()
+
+    def close(self):
+        self.users.close()
+
+    def _insert_user(self, username, user):
+        self.user_index[username] = self.users.insert(username, user)
+
+    def _change_user_key(self, old_username, new_username):
+        self.users.change_key(old_username, new_username)
+        user_node = self.user_index.pop(old_username, None)
+        if user_node is not None:
+            self.user_index[new_username] = user_node
+
+    def _apply_record(self, operation, *args):
+        if operation == "add_user":
+            username, user = args
+            self._insert_user(username, user)
+            return
+
+        user_node = self.user_index.get(args[0])
+        if user_node is None: return
+
+        if operation == "rename":
+            new_username = args[1]
+            user_node.value.username = new_username
+            self._change_user_key(args[0], new_username)
+        elif operation == "set_add":
+            getattr(user_node.value, args[1]).add(args[2])
+        elif operation == "set_remove":
+            getattr(user_node.value, args[1]).discard(args[2])
+        elif operation == "fields":
+            for field, value in args[1].items():
+                setattr(user_node.value, field, value)
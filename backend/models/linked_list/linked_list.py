@@ -40,3 +40,17 @@ class LinkedList:
 
     def is_empty(self):
         return self.head is None
+
+    def __getstate__(self):
+        # Pickling the node chain directly recurses once per node; store the values flat instead
+        return {"values": self.get_all_chats()}
+
+    def __setstate__(self, state):
+        self.head = None
+        self.tail = None
+        if "values" in state:
+            for value in state["values"]:
+                self.append(value)
+        else:
+            self.head = state.get("head")
+            self.tail = state.get("tail")
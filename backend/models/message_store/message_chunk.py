@@ -0,0 +1,61 @@
+from array import array
+
+
+class MessageChunk:
+
+    __slots__ = ("message_ids", "types", "senders", "texts", "timestamps")
+
+    def __init__(self):
+        self.message_ids = []
+        self.types = []
+        self.senders = []
+        self.texts = []
+        self.timestamps = array("q")
+
+    def __len__(self):
+        return len(self.texts)
+
+    def append(self, message_id, message_type, sender, text, timestamp):
+        self.message_ids.append(message_id)
+        self.types.append(message_type)
+        self.senders.append(sender)
+        self.texts.append(text)
+        self.timestamps.append(timestamp)
+
+    def pop(self):
+        self.message_ids.pop()
+        self.types.pop()
+        self.senders.pop()
+        self.texts.pop()
+        self.timestamps.pop()
+
+    def __copy__(self):
+        chunk = MessageChunk()
+        chunk.message_ids = self.message_ids[:]
+        chunk.types = self.types[:]
+        chunk.senders = self.senders[:]
+        chunk.texts = self.texts[:]
+        chunk.timestamps = self.timestamps[:]
+        return chunk
+
+    def get(self, offset):
+        return self.message_ids[offset], self.types[offset], self.senders[offset], self.texts[offset], self.timestamps[offset]
+
+    def __repr__(self):
+        return f"MessageChunk({len(self)} messages)"
+
+
+class ColdChunk:
+
+    __slots__ = ("offset", "length", "count")
+
+    def __init__(self, offset, length, count):
+        self.offset = offset
+        self.length = length
+        self.count = count
+
+    def __len__(self):
+        return self.count
+
+    def __repr__(self):
+        return f"ColdChunk({self.count} messages at {self.offset})"
@@ -0,0 +1,258 @@
+import hashlib
+import pickle
+import sys
+from array import array
+from copy import copy
+from datetime import datetime, timedelta, timezone
+
+from backend.models.message_store.message_chunk import MessageChunk, ColdChunk
+from backend.models.message_store.segment_file import get_segment, truncate_segment
+
+CHUNK_SIZE = 512
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+# Message history for one chat, stored as fixed-size columnar chunks instead of a dict per message
+class MessageStore:
+
+    def __init__(self, chat_id, chunk_size=CHUNK_SIZE):
+        self.chat_id = chat_id
+        self.chunk_size = chunk_size
+        self.chunks = []
+        self.length = 0
+        self.index = {}
+
+        # Chunks before first_hot_chunk live in the segment file; only the hot tail stays in memory
+        self.segment_path = None
+        self.hot_chunks = None
+        self.first_hot_chunk = 0
+        # Bytes of the segment file this store has written; anything past it is left over from before a restart
+        self.segment_end = 0
+        # 64-bit hash of every cold message ID, indexed by position: 8 bytes a message instead of a dict entry
+        self.cold_id_hashes = array("Q")
+        self._cold_cache = None
+        # Set while a snapshot copy may still hold the last chunk; the next change copies it first
+        self._tail_shared = False
+
+    def __len__(self):
+        return self.length
+
+    def __iter__(self):
+        for position in range(self.length):
+            yield self.get(position)
+
+    def enable_spill(self, segment_path, hot_chunks):
+        self.segment_path = segment_path
+        self.hot_chunks = hot_chunks
+        truncate_segment(segment_path, self.segment_end)
+        self._evict_cold_chunks()
+
+    def append(self, message):
+        if not self.chunks or len(self.chunks[-1]) == self.chunk_size:
+            self.chunks.append(MessageChunk())
+            self._tail_shared = False
+            self._evict_cold_chunks()
+
+        message_id = message.get("message_id") or message.get("id")
+        message_type = message.get("type")
+        self._writable_tail().append(
+            message_id,
+            sys.intern(message_type) if message_type else None,
+            sys.intern(message.get("sender") or ""),
+            message.get("message") or "",
+            to_timestamp(message.get("time_sent") or message.get("timestamp"))
+        )
+        if message_id is not None:
+            self.index[message_id] = self.length
+        self.length += 1
+
+    def remove_last(self):
+        if self.is_empty():
+            return None
+        removed_message = self.last()
+        if isinstance(self.chunks[-1], ColdChunk):
+            self._rehydrate_last_chunk()
+        last_chunk = self._writable_tail()
+        last_chunk.pop()
+        if len(last_chunk) == 0:
+            self.chunks.pop()
+            # The chunk now at the end may be held by a snapshot taken when it was not the last one
+            self._tail_shared = True
+        self.length -= 1
+        self.index.pop(removed_message["message_id"], None)
+        return removed_message
+
+    def is_empty(self):
+        return self.length == 0
+
+    def last(self):
+        if self.is_empty():
+            return None
+        return self.get(self.length - 1)
+
+    def last_message_id(self):
+        if self.is_empty():
+            return None
+        chunk_number, offset = divmod(self.length - 1, self.chunk_size)
+        return self._load_chunk(chunk_number).message_ids[offset]
+
+    def last_timestamp(self):
+        if self.is_empty():
+            return None
+        chunk_number, offset = divmod(self.length - 1, self.chunk_size)
+        return self._load_chunk(chunk_number).timestamps[offset]
+
+    def get(self, position):
+        chunk_number, offset = divmod(position, self.chunk_size)
+        message_id, message_type, sender, text, timestamp = self._load_chunk(chunk_number).get(offset)
+        # A message's sequence number is its position counted from 1; history is append-only so it never changes
+        message = {"message_id": message_id, "chat_id": self.chat_id, "seq": position + 1, "sender": sender, "message": text, "time_sent": from_timestamp(timestamp)}
+        if message_type is not None:
+            message["type"] = message_type
+        return message
+
+    def position_of(self, message_id):
+        position = self.index.get(message_id)
+        if position is not None:
+            return position
+        # Cold IDs are found by scanning the hash array in memory; only a matching chunk is read from disk
+        target = id_hash(message_id)
+        start = 0
+        while True:
+            try:
+                position = self.cold_id_hashes.index(target, start)
+            except ValueError:
+                return None
+            chunk_number, offset = divmod(position, self.chunk_size)
+            if self._load_chunk(chunk_number).message_ids[offset] == message_id:
+                return position
+            start = position + 1
+
+    def get_before(self, position, limit):
+        # Chunks are full except the last, so any position is reached with one divmod: O(limit) per page
+        end = self.length if position is None else position
+        start = max(0, end - limit)
+        return [self.get(current) for current in range(start, end)], start > 0
+
+    def get_after(self, seq, limit):
+        start = max(0, seq)
+        end = min(self.length, start + limit)
+        return [self.get(current) for current in range(start, end)], end < self.length
+
+    def iter_texts(self):
+        # Reads the sender and text columns directly, without building a dict per message
+        for chunk_number in range(len(self.chunks)):
+            chunk = self._load_chunk(chunk_number)
+            first_seq = chunk_number * self.chunk_size + 1
+            for offset, (sender, text) in enumerate(zip(chunk.senders, chunk.texts)):
+                yield first_seq + offset, sender, text
+
+    def get_all(self):
+        return list(self)
+
+    def _load_chunk(self, chunk_number):
+        chunk = self.chunks[chunk_number]
+        if not isinstance(chunk, ColdChunk):
+            return chunk
+        if self._cold_cache is not None and self._cold_cache[0] == chunk_number:
+            return self._cold_cache[1]
+        loaded_chunk = pickle.loads(get_segment(self.segment_path).read(chunk.offset, chunk.length))
+        self._cold_cache = (chunk_number, loaded_chunk)
+        return loaded_chunk
+
+    def _evict_cold_chunks(self):
+        if self.segment_path is None:
+            return
+        segment = get_segment(self.segment_path)
+        # The newest chunk is still being appended to and is never evicted
+        while len(self.chunks) - self.first_hot_chunk > max(self.hot_chunks, 1):
+            chunk = self.chunks[self.first_hot_chunk]
+            data = pickle.dumps(chunk, protocol=pickle.HIGHEST_PROTOCOL)
+            offset = segment.append(data)
+            self.segment_end = offset + len(data)
+            self.chunks[self.first_hot_chunk] = ColdChunk(offset, len(data), len(chunk))
+            self.cold_id_hashes.extend(id_hash(message_id) for message_id in chunk.message_ids)
+            for message_id in chunk.message_ids:
+                self.index.pop(message_id, None)
+            self.first_hot_chunk += 1
+
+    def _writable_tail(self):
+        if self._tail_shared:
+            self.chunks[-1] = copy(self.chunks[-1])
+            self._tail_shared = False
+        return self.chunks[-1]
+
+    def _rehydrate_last_chunk(self):
+        chunk_number = len(self.chunks) - 1
+        self.chunks[chunk_number] = self._load_chunk(chunk_number)
+        self._tail_shared = False
+        self.first_hot_chunk = chunk_number
+        self._cold_cache = None
+        del self.cold_id_hashes[chunk_number * self.chunk_size:]
+        for offset, message_id in enumerate(self.chunks[chunk_number].message_ids):
+            if message_id is not None:
+                self.index[message_id] = chunk_number * self.chunk_size + offset
+
+    def __copy__(self):
+        # Only the last chunk is ever changed in place, and it is copied on its next change instead of here
+        store = MessageStore(self.chat_id, self.chunk_size)
+        store.chunks = self.chunks[:]
+        self._tail_shared = True
+        store.length = self.length
+        store.segment_path = self.segment_path
+        store.hot_chunks = self.hot_chunks
+        store.first_hot_chunk = self.first_hot_chunk
+        store.segment_end = self.segment_end
+        store.cold_id_hashes = self.cold_id_hashes[:]
+        return store
+
+    def __getstate__(self):
+        return {
+            "chat_id": self.chat_id,
+            "chunk_size": self.chunk_size,
+            "chunks": self.chunks,
+            "length": self.length,
+            "segment_path": self.segment_path,
+            "hot_chunks": self.hot_chunks,
+            "first_hot_chunk": self.first_hot_chunk,
+            "segment_end": self.segment_end,
+            "cold_id_hashes": self.cold_id_hashes
+        }
+
+    def __setstate__(self, state):
+        self.__init__(state["chat_id"], state["chunk_size"])
+        self.chunks = state["chunks"]
+        self.length = state["length"]
+        self.segment_path = state.get("segment_path")
+        self.hot_chunks = state.get("hot_chunks")
+        self.first_hot_chunk = state.get("first_hot_chunk", 0)
+        self.segment_end = state["segment_end"]
+        self.cold_id_hashes = state["cold_id_hashes"]
+        for chunk_number in range(self.first_hot_chunk, len(self.chunks)):
+            for offset, message_id in enumerate(self.chunks[chunk_number].message_ids):
+                if message_id is not None:
+                    self.index[message_id] = chunk_number * self.chunk_size + offset
+
+
+def id_hash(message_id):
+    # Stable across processes (unlike hash()), since the array is saved with the store; 0 stands for a missing ID
+    if message_id is None:
+        return 0
+    return int.from_bytes(hashlib.blake2b(message_id.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+def to_timestamp(value):
+    if isinstance(value, str):
+        try:
+            value = datetime.fromisoformat(value)
+        except ValueError:
+            value = None
+    if not isinstance(value, datetime):
+        value = datetime.now(timezone.utc)
+    if value.tzinfo is None:
+        value = value.astimezone()  # Naive timestamps were produced with datetime.now(), i.e. local time
+    return (value - EPOCH) // timedelta(microseconds=1)
+
+
+def from_timestamp(timestamp):
+    return (EPOCH + timedelta(microseconds=timestamp)).isoformat()
@@ -0,0 +1,70 @@
+import mmap
+import os
+from collections import OrderedDict
+
+MAX_MAPPED_SEGMENTS = 64
+
+_mapped_segments = OrderedDict()
+
+
+class SegmentFile:
+
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+        self._map = None
+
+    def append(self, data):
+        with open(self.path, "ab") as file:
+            offset = file.tell()
+            file.write(data)
+        return offset
+
+    def read(self, offset, length):
+        # The mapping is taken at a fixed size, so remap once the file has grown past it
+        if self._map is None or offset + length > len(self._map):
+            self._remap()
+        return self._map[offset:offset + length]
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _remap(self):
+        self.close()
+        self._file = open(self.path, "rb")
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def get_segment(path):
+    segment = _mapped_segments.get(path)
+    if segment is None:
+        segment = SegmentFile(path)
+        _mapped_segments[path] = segment
+        if len(_mapped_segments) > MAX_MAPPED_SEGMENTS:
+            _, evicted_segment = _mapped_segments.popitem(last=False)
+            evicted_segment.close()
+    else:
+        _mapped_segments.move_to_end(path)
+    return segment
+
+
+def truncate_segment(path, size):
+    # Drops bytes past `size`, e.g. chunks spilled after the last snapshot that journal replay is about to spill again
+    segment = _mapped_segments.pop(path, None)
+    if segment is not None:
+        segment.close()
+    if os.path.exists(path) and os.path.getsize(path) > size:
+        os.truncate(path, size)
+
+
+def remove_segment(path):
+    segment = _mapped_segments.pop(path, None)
+    if segment is not None:
+        segment.close()
+    if os.path.exists(path):
+        os.remove(path)
@@ -0,0 +1,137 @@
+import heapq
+import math
+import re
+import sys
+from array import array
+from bisect import bisect_left
+
+TOKEN_PATTERN = re.compile(r"\w+")
+MAX_TERM_LENGTH = 64
+BM25_K1 = 1.2
+
+
+def tokenize(text):
+    return [sys.intern(term) for term in TOKEN_PATTERN.findall(text.lower()) if len(term) <= MAX_TERM_LENGTH]
+
+
+# Inverted index over message text, kept per chat so a user's search only touches the chats they belong to.
+# A posting packs a message's sequence number and the term's count in it into one integer (seq << 8 | count).
+# Most terms occur once per chat, so a lone posting is stored as a bare int and only grows into an array
+# on the second hit. Sequence numbers only grow, so every postings array stays sorted without re-sorting
+class MessageIndex:
+
+    def __init__(self):
+        # chat_id -> term -> posting int or array("Q") of postings
+        self.chats = {}
+        # term -> number of indexed messages containing it, across every chat, for IDF
+        self.document_frequency = {}
+        self.chat_document_counts = {}
+        self.document_count = 0
+
+    def add(self, chat_id, seq, text):
+        terms = tokenize(text)
+        if not terms:
+            return
+        chat_terms = self.chats.setdefault(chat_id, {})
+        term_counts = {}
+        for term in terms:
+            term_counts[term] = term_counts.get(term, 0) + 1
+        for term, count in term_counts.items():
+            posting = seq << 8 | min(count, 255)
+            postings = chat_terms.get(term)
+            if postings is None:
+                chat_terms[term] = posting
+            elif isinstance(postings, int):
+                chat_terms[term] = array("Q", (postings, posting))
+            else:
+                postings.append(posting)
+            self.document_frequency[term] = self.document_frequency.get(term, 0) + 1
+        self.chat_document_counts[chat_id] = self.chat_document_counts.get(chat_id, 0) + 1
+        self.document_count += 1
+
+    def remove(self, chat_id, seq, text):
+        # Only the newest message of a chat is ever removed, so its postings are always at the tail
+        chat_terms = self.chats.get(chat_id)
+        if chat_terms is None:
+            return
+        removed = False
+        for term in set(tokenize(text)):
+            postings = chat_terms.get(term)
+            if postings is None:
+                continue
+            if isinstance(postings, int):
+                if postings >> 8 != seq:
+                    continue
+                del chat_terms[term]
+            else:
+                if postings[-1] >> 8 != seq:
+                    continue
+                postings.pop()
+                if len(postings) == 1:
+                    chat_terms[term] = postings[0]
+            self._decrement_frequency(term, 1)
+            removed = True
+        if removed:
+            self.chat_document_counts[chat_id] -= 1
+            self.document_count -= 1
+
+    def drop_chat(self, chat_id):
+        chat_terms = self.chats.pop(chat_id, None)
+        if chat_terms is None:
+            return
+        for term, postings in chat_terms.items():
+            self._decrement_frequency(term, 1 if isinstance(postings, int) else len(postings))
+        self.document_count -= self.chat_document_counts.pop(chat_id, 0)
+
+    def search(self, chat_ids, query, offset=0, limit=20):
+        # Every query term must appear (AND); hits are ranked by BM25 term weight, newest first on ties
+        terms = list(dict.fromkeys(tokenize(query)))
+        if not terms:
+            return [], False
+        weights = [self._idf(term) for term in terms]
+
+        hits = []
+        for chat_id in chat_ids:
+            chat_terms = self.chats.get(chat_id)
+            if chat_terms is None:
+                continue
+            term_postings = [chat_terms.get(term) for term in terms]
+            if any(postings is None for postings in term_postings):
+                continue
+            term_postings = [(postings,) if isinstance(postings, int) else postings for postings in term_postings]
+            hits.extend(self._match_chat(chat_id, term_postings, weights))
+
+        ranked = heapq.nlargest(offset + limit + 1, hits)
+        page = [(chat_id, seq, score) for score, seq, chat_id in ranked[offset:offset + limit]]
+        return page, len(ranked) > offset + limit
+
+    def _match_chat(self, chat_id, term_postings, weights):
+        # Walk the shortest postings list and probe the others by binary search
+        order = sorted(range(len(term_postings)), key=lambda position: len(term_postings[position]))
+        shortest = order[0]
+        for posting in term_postings[shortest]:
+            seq = posting >> 8
+            score = weights[shortest] * _term_weight(posting & 0xFF)
+            for position in order[1:]:
+                postings = term_postings[position]
+                found = bisect_left(postings, seq << 8)
+                if found == len(postings) or postings[found] >> 8 != seq:
+                    break
+                score += weights[position] * _term_weight(postings[found] & 0xFF)
+            else:
+                yield score, seq, chat_id
+
+    def _idf(self, term):
+        frequency = self.document_frequency.get(term, 0)
+        return math.log(1 + (self.document_count - frequency + 0.5) / (frequency + 0.5))
+
+    def _decrement_frequency(self, term, amount):
+        frequency = self.document_frequency[term] - amount
+        if frequency > 0:
+            self.document_frequency[term] = frequency
+        else:
+            del self.document_frequency[term]
+
+
+def _term_weight(count):
+    return count * (BM25_K1 + 1) / (count + BM25_K1)
@@ -1,8 +1,8 @@
 from __future__ import annotations
 
 from typing import Dict, List
-import bcrypt
 
+from backend.utils.password_hashing import hash_password, verify_password
 from backend.utils.user_utils import find_user
 
 
@@ -25,16 +25,26 @@ class User:
         self.is_active : bool = False
         self.show_active : bool = False
 
+    def __copy__(self):
+        # Snapshot copy taken on the event loop and pickled off it: the sets are the only state changed in place
+        user = User.__new__(User)
+        user.__dict__.update(self.__dict__)
+        user.followers = set(self.followers)
+        user.following = set(self.following)
+        user.follow_requests = set(self.follow_requests)
+        user.blocked_users = set(self.blocked_users)
+        user.chat_ids = set(self.chat_ids)
+        return user
+
     def __str__(self) -> str:
         return f"User(id={self.id}, username={self.username}, followers={len(self.followers)}, following={len(self.following)})"
 
     @staticmethod
     def _hash_password(plain_text) -> bytes:
-        salt : bytes = bcrypt.gensalt()
-        return bcrypt.hashpw(plain_text.encode('utf-8'), salt)
+        return hash_password(plain_text)
 
     def check_password(self, attempt) -> bool:
-        return bcrypt.checkpw(attempt.encode('utf-8'), self.password)
+        return verify_password(attempt, self.password)
 
     def add_chat_id(self, chat_id : str) -> Dict[str, str]:
         if chat_id not in self.chat_ids:
@@ -119,6 +129,13 @@ class User:
                 following_list.append(user_obj.to_dict())
         return following_list
 
+    def to_search_result(self) -> Dict[str, str | bool | None]:
+        return {
+            "username": self.username,
+            "profile_picture": self.profile_picture,
+            "public_status": self.public_status,
+        }
+
     def to_dict(self) -> Dict[str, str | List[str] | bool]:
         return {
             "id": self.id,
@@ -1,39 +1,50 @@
+import logging
 import uuid
 from datetime import datetime
 
-from fastapi import APIRouter
+from fastapi import APIRouter, Depends
 from starlette.requests import Request
-from starlette.websockets import WebSocket
+from starlette.websockets import WebSocket, WebSocketDisconnect
 
-from backend.instances import USER_MANAGER, CHAT_MANAGER
-from backend.utils.chat_utils import find_chat
-from backend.utils.user_utils import find_user
+from backend.instances import USER_MANAGER, CHAT_MANAGER, CHAT_ACTORS
+from backend.utils.auth_utils import authenticate, require_user_session
+from backend.utils.formatting import format_chat_dict
+from backend.utils.logging_utils import get_logger, Sampler
 
 router = APIRouter()
+log = get_logger("chat_routes")
+MESSAGE_LOG_SAMPLER = Sampler()
 
 
-@router.get("/user/{username}/chats") # List all chats for a user
-async def get_chats(username: str):
-    user_status, user_obj = find_user(username)
-    if not user_status or user_obj is None:
+@router.get("/user/{username}/chats", dependencies=[Depends(require_user_session)]) # List a user's chats, most recently active first
+async def get_chats(username: str, offset: int = 0, limit: int = 50):
+    user_node = USER_MANAGER.search_for_user(username)
+    if user_node is None:
         return {"error": "User not found."}
 
-    user_chat_ids = user_obj.get_chat_ids()
-    chat_overviews = []
-
-    for chat_id in user_chat_ids:
-        chat_status, chat_obj = find_chat(chat_id)
-        if chat_status and chat_obj is not None:
-            chat_overviews.append(chat_obj.get_chat_overview())
-
-    chat_overviews.sort(
-        key=lambda c: c["last_message_time"] or datetime.min.isoformat(),
-        reverse=True
-    )
-    return {"chats": chat_overviews}
+    offset = max(0, offset)
+    limit = max(1, min(limit, 200))
+    chats, has_more = CHAT_MANAGER.get_dashboard_page(user_node.value, offset, limit)
+    next_offset = offset + len(chats) if has_more else None
+    return {"chats": [chat.get_chat_overview(username) for chat in chats], "has_more": has_more, "next_offset": next_offset}
 
-@router.get("/user/{username}/chats/{chat_id}") # Get a specific chat by ID for a user
-async def get_chat(username: str, chat_id: str):
+@router.get("/user/{username}/search", dependencies=[Depends(require_user_session)]) # Search message history across a user's chats, best matches first
+async def search_messages(username: str, q: str, offset: int = 0, limit: int = 20):
+    user_node = USER_MANAGER.search_for_user(username)
+    if user_node is None:
+        return {"error": "User not found."}
+    if CHAT_MANAGER.search_index is None:
+        return {"error": "Message search is not enabled."}
+
+    offset = max(0, offset)
+    limit = max(1, min(limit, 100))
+    results, has_more = CHAT_MANAGER.search_messages(user_node.value, q, offset, limit)
+    hits = [{"chat_id": chat.chat_id, "chat_name": chat.chat_name, "score": round(score, 4)} | message for chat, message, score in results]
+    next_offset = offset + len(hits) if has_more else None
+    return {"hits": hits, "has_more": has_more, "next_offset": next_offset}
+
+@router.get("/user/{username}/chats/{chat_id}", dependencies=[Depends(require_user_session)]) # Get a specific chat by ID for a user, one page of history at a time
+async def get_chat(username: str, chat_id: str, before_message_id: str | None = None, limit: int = 50):
     user_node = USER_MANAGER.search_for_user(username)
     if user_node is None:
         return {"error": "User not found."}
@@ -47,9 +58,16 @@ async def get_chat(username: str, chat_id: str):
     if chat.chat_id not in user.chat_ids:
         return {"error": "Chat does not belong to the user."}
 
-    return chat.to_dict()
+    limit = max(1, min(limit, 200))
+    try:
+        messages, has_more = chat.get_messages(before_message_id, limit)
+    except ValueError as exception:
+        return {"error": str(exception)}
 
-@router.post("/user/{username}/chats") # Create a new chat for a user
+    next_before_message_id = messages[0].get("message_id") if has_more and messages else None
+    return chat.get_chat_overview(username) | {"messages": messages, "has_more": has_more, "next_before_message_id": next_before_message_id}
+
+@router.post("/user/{username}/chats", dependencies=[Depends(require_user_session)]) # Create a new chat for a user
 async def create_chat(username: str, chat_data: Request):
     data = await chat_data.json()
     chat_name = data.get("chat_name")
@@ -80,7 +98,8 @@ async def create_chat(username: str, chat_data: Request):
 
     try:
         new_chat_id, chat = CHAT_MANAGER.add_chat(owner= user, participants= participants, chat_name= chat_name)
-        chat.add_system_message(f"Chat created by {user.username}.")
+        system_message = chat.add_system_message(f"Chat created by {user.username}.")
+        CHAT_MANAGER.record_message(new_chat_id, system_message)
 
         for participant in participants:
             participant.add_chat_id(new_chat_id)
@@ -89,44 +108,48 @@ async def create_chat(username: str, chat_data: Request):
     except ValueError as exception:
         return {"error": str(exception)}
 
-    CHAT_MANAGER.save_chat_database()
-    USER_MANAGER.save()
+    for participant in participants:
+        USER_MANAGER.record_added(participant, "chat_ids", new_chat_id)
+    USER_MANAGER.record_added(user, "chat_ids", new_chat_id)
     return {"message": f"Chat created successfully with ID: {new_chat_id}",
             "chat_id": new_chat_id,
             "skipped_users": skipped_users,
             "last_message": chat.get_last_message()
             }
 
-@router.post("/user/{username}/chats/{chat_id}/send_message") # Send a message in a chat
+@router.post("/user/{username}/chats/{chat_id}/send_message", dependencies=[Depends(require_user_session)]) # Send a message in a chat
 async def send_message(username : str, chat_id : str, message_data: Request):
     data = await message_data.json()
-    print(data)
-    # {
-    #     "id": "unique_message_id",
-    #     "type": "message",
-    #     "chat_id": "...",
-    #     "sender": "justin",
-    #     "message": "yo",
-    #     "timestamp": "..."
-    # }
+    log.debug("rest message received", extra={"chat_id": chat_id, "sender": username})
+    # {"message": "yo"} -- the rest of the message is filled in here, never taken from the client
 
     user_node = USER_MANAGER.search_for_user(username)
     if user_node is None:
         return {"error": "User not found."}
-    user = user_node.value
 
     chat_node = CHAT_MANAGER.search_for_chat(chat_id)
     if chat_node is None:
         return {"error": "Chat not found."}
     chat = chat_node.value
-    chat.add_message(data)
 
-    # TODO: Broadcast message to all active WebSocket clients for this chat_id
+    if username not in chat.participants:
+        return {"error": "User is not a participant in this chat."}
+
+    message_text = data.get("message") if isinstance(data, dict) else None
+    if not isinstance(message_text, str) or not message_text:
+        return {"error": "Message text is required."}
 
-    CHAT_MANAGER.save_chat_database()
+    new_message = format_chat_dict(chat_id, username, message_text)
+
+    def append_message(emit):
+        chat.add_message(new_message)
+        CHAT_MANAGER.record_message(chat_id, new_message)
+        emit({"operation": "message"} | new_message)
+
+    await CHAT_ACTORS.run(chat_id, append_message)
     return {"message": "Message sent successfully."}
 
-@router.post("/user/{username}/chats/{chat_id}/mark_as_read")
+@router.post("/user/{username}/chats/{chat_id}/mark_as_read", dependencies=[Depends(require_user_session)])
 async def mark_chat_as_read(username: str, chat_id: str):
     user_node = USER_MANAGER.search_for_user(username)
     if user_node is None:
@@ -138,14 +161,16 @@ async def mark_chat_as_read(username: str, chat_id: str):
         return {"error": "Chat not found."}
     chat = chat_node.value
 
-    chat.mark_as_read_by(username)
+    def mark_read(emit):
+        chat.mark_as_read_by(username)
+        CHAT_MANAGER.record_read_seqs(chat, [username])
+        if username in chat.read_seqs:
+            emit({"operation": "read_receipt", "chat_id": chat_id, "read_by": [username], "read_seqs": {username: chat.read_seqs[username]}})
 
-    # TODO: Broadcast that the chat has been marked as read to all active WebSocket clients for this chat_id
-
-    CHAT_MANAGER.save_chat_database()
+    await CHAT_ACTORS.run(chat_id, mark_read)
     return {"message": "Chat marked as read."}
 
-@router.delete("/user/{username}/chats/{chat_id}")
+@router.delete("/user/{username}/chats/{chat_id}", dependencies=[Depends(require_user_session)])
 async def delete_chat(username: str, chat_id: str):
     user_node = USER_MANAGER.search_for_user(username)
     if user_node is None:
@@ -164,20 +189,23 @@ async def delete_chat(username: str, chat_id: str):
     if not user_permissions or not user_permissions.get('can_delete', False):
         return {"error": "User does not have permission to delete this chat."}
 
-    user.chat_ids.remove(chat.chat_id)
-    for participant_info in chat.participants.values():
-        participant_username = participant_info["username"]
-        participant_node = USER_MANAGER.search_for_user(participant_username)
-        if participant_node:
-            participant_node.value.chat_ids.discard(chat.chat_id)  # discard avoids KeyError if not present
+    def delete(emit):
+        user.chat_ids.discard(chat.chat_id)
+        USER_MANAGER.record_removed(user, "chat_ids", chat.chat_id)
+        for participant_info in chat.participants.values():
+            participant_username = participant_info["username"]
+            participant_node = USER_MANAGER.search_for_user(participant_username)
+            if participant_node:
+                participant_node.value.chat_ids.discard(chat.chat_id)  # discard avoids KeyError if not present
+                USER_MANAGER.record_removed(participant_node.value, "chat_ids", chat.chat_id)
+
+        CHAT_MANAGER.delete_chat(chat_id)
 
-    CHAT_MANAGER.delete_chat(chat_id)
-    CHAT_MANAGER.save_chat_database()
-    USER_MANAGER.save()
+    await CHAT_ACTORS.run(chat_id, delete)
 
     return {"message": "Chat deleted successfully."}
 
-@router.post("/user/{username}/chats/{chat_id}/add_participant")
+@router.post("/user/{username}/chats/{chat_id}/add_participant", dependencies=[Depends(require_user_session)])
 async def add_participant_to_chat(username: str, chat_id: str, request: Request):
     user_node = USER_MANAGER.search_for_user(username)
     if user_node is None:
@@ -207,17 +235,18 @@ async def add_participant_to_chat(username: str, chat_id: str, request: Request)
     new_participant = new_participant_node.value
     participant_edit_permissions = data.get("can_edit", False)
 
-    chat.add_participant(new_participant, participant_edit_permissions)
-    new_participant.add_chat_id(chat_id)
+    def add(emit):
+        chat.add_participant(new_participant, participant_edit_permissions)
+        new_participant.add_chat_id(chat_id)
 
-    CHAT_MANAGER.save_chat_database()
-    USER_MANAGER.save()
-
-    # TODO: Broadcast to chat members that a new participant has joined
+        CHAT_MANAGER.record_participant(chat, new_participant_username)
+        USER_MANAGER.record_added(new_participant, "chat_ids", chat_id)
+        emit({"operation": "update_chat"} | chat.get_chat_overview())
 
+    await CHAT_ACTORS.run(chat_id, add)
     return {"message": f"Participant {new_participant_username} added to chat {chat_id}."}
 
-@router.post("/user/{username}/chats/{chat_id}/remove_participant")
+@router.post("/user/{username}/chats/{chat_id}/remove_participant", dependencies=[Depends(require_user_session)])
 async def remove_participant(username: str, chat_id: str, request: Request):
     user_node = USER_MANAGER.search_for_user(username)
     if user_node is None:
@@ -244,12 +273,16 @@ async def remove_participant(username: str, chat_id: str, request: Request):
         return {"error": "User is not a participant in this chat."}
 
     participant_node = USER_MANAGER.search_for_user(participant_username)
-    if participant_node:
-        participant = participant_node.value
-        chat.remove_participant(participant)
 
-    CHAT_MANAGER.save_chat_database()
-    USER_MANAGER.save()
+    def remove(emit):
+        if participant_node:
+            participant = participant_node.value
+            chat.remove_participant(participant)
+            USER_MANAGER.record_removed(participant, "chat_ids", chat_id)
+            CHAT_MANAGER.record_participant_removed(chat, participant_username)
+        emit({"operation": "update_chat"} | chat.get_chat_overview())
+
+    await CHAT_ACTORS.run(chat_id, remove)
 
     return {"message": f"Participant {participant_username} removed from chat {chat_id}."}
 
@@ -261,7 +294,10 @@ active_connections = {}
 
 @router.websocket("/ws/chat/{chat_id}/{username}")
 async def websocket_endpoint(websocket : WebSocket, chat_id: str, username: str):
-    print(f"WebSocket connection attempt: chat_id={chat_id}, username={username}")
+    log.debug("chat socket connecting", extra={"chat_id": chat_id, "username": username})
+    if authenticate(websocket) != username:
+        await websocket.close(1008, "Not authenticated")
+        return
     # Check if the chat exists
     chat_node = CHAT_MANAGER.search_for_chat(chat_id)
     if chat_node is None:
@@ -269,8 +305,6 @@ async def websocket_endpoint(websocket : WebSocket, chat_id: str, username: str)
         return
     chat = chat_node.value
 
-    print(f"Chat {chat_id} connected by {username}")
-
     # Verify that the user is a participant in the chat
     if username not in chat.participants:
         await websocket.close(1008, "User not a participant")
@@ -286,8 +320,8 @@ async def websocket_endpoint(websocket : WebSocket, chat_id: str, username: str)
         while True:
             # Receive message text from the client
             data = await websocket.receive_text()
-
-            print(f"RECEIVED MESSAGE in chat {chat_id} from {username}: {data}")
+            if log.isEnabledFor(logging.DEBUG) and MESSAGE_LOG_SAMPLER():
+                log.debug("chat socket message", extra={"chat_id": chat_id, "sender": username})
 
             # Create a full message object
             message = {
@@ -300,15 +334,20 @@ async def websocket_endpoint(websocket : WebSocket, chat_id: str, username: str)
             }
 
             # Add the message to the chat and save it
-            chat.add_message(message)
-            CHAT_MANAGER.save_chat_database()
+            def append_message(emit):
+                chat.add_message(message)
+                CHAT_MANAGER.record_message(chat_id, message)
+
+            await CHAT_ACTORS.run(chat_id, append_message)
 
             # Broadcast the message to all connected clients as JSON
             for connection in active_connections[chat_id]:
                 await connection.send_json(message)
 
-    except Exception as e:
-        print(f"Error: {e}")
+    except WebSocketDisconnect:
+        pass
+    except Exception:
+        log.warning("chat socket failed", exc_info=True, extra={"chat_id": chat_id, "username": username})
 
     finally:
         # Clean up the connection when it closes
@@ -318,16 +357,19 @@ async def websocket_endpoint(websocket : WebSocket, chat_id: str, username: str)
 
 @router.websocket("/ws/{username}")
 async def user_websocket_endpoint(websocket: WebSocket, username: str):
-    print(f"User WebSocket connection attempt: username={username}")
+    log.debug("user socket connecting", extra={"username": username})
+    if authenticate(websocket) != username:
+        await websocket.close(1008, "Not authenticated")
+        return
 
     await websocket.accept()
-    print (f"User WebSocket connected: {username}")
 
     try:
         while True:
-            data = await websocket.receive_text()
-            print(f"Received message from {username}: {data}")
+            await websocket.receive_text()
 
-    except Exception as e:
-        print(f"Error: {e}")
+    except WebSocketDisconnect:
+        pass
+    except Exception:
+        log.warning("user socket failed", exc_info=True, extra={"username": username})
 
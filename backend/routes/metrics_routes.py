@@ -0,0 +1,56 @@
+import time
+
+from fastapi import APIRouter
+from starlette.responses import PlainTextResponse
+
+from backend.utils.metrics import METRICS
+
+router = APIRouter()
+
+HTTP_REQUESTS = METRICS.counter("chatter_http_requests_total", "REST requests by route, method and status.", ("route", "method", "status"))
+HTTP_REQUEST_SECONDS = METRICS.histogram("chatter_http_request_duration_seconds", "REST request latency by route.", ("route", "method"))
+
+
+@router.get("/metrics", include_in_schema=False) # Prometheus scrape endpoint
+def metrics():
+    return PlainTextResponse(METRICS.render(), media_type="text/plain; version=0.0.4")
+
+
+def route_template(scope):
+    # Labelled by route template, never the raw path, so usernames and chat IDs don't explode the series.
+    # Routes of included routers may report their path without the router prefix; the prefix is whatever
+    # leading segments of the request path the template does not cover
+    template = getattr(scope.get("route"), "path", None)
+    if template is None:
+        return "unmatched"
+    segments = scope["path"].rstrip("/").split("/")
+    depth = template.rstrip("/").count("/")
+    return "/".join(segments[:len(segments) - depth]) + template
+
+
+# Plain ASGI middleware rather than BaseHTTPMiddleware, so timing a request adds no extra task or body copy
+class HTTPMetricsMiddleware:
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = [500]
+
+        async def send_with_status(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            route_path = route_template(scope)
+            method = scope["method"]
+            HTTP_REQUEST_SECONDS.observe(time.perf_counter() - started, route_path, method)
+            HTTP_REQUESTS.inc(route_path, method, status[0])
@@ -1,12 +1,16 @@
 import uuid
 from typing import Dict
 
-from fastapi import APIRouter, Request
-from backend.instances import USER_MANAGER
+from fastapi import APIRouter, Depends, Request
+from backend.instances import USER_MANAGER, PASSWORD_HASHER, SESSIONS
 from backend.models.user import User
+from backend.utils.auth_utils import get_session_token, require_session, require_user_session
+from backend.utils.logging_utils import get_logger
+from backend.utils.password_hashing import PasswordHasherBusy
 from backend.utils.user_utils import find_user
 
 router = APIRouter()
+log = get_logger("user_routes")
 
 @router.post("/login")
 async def login(request: Request):
@@ -23,9 +27,14 @@ async def login(request: Request):
     if user_node is None: return error_response
 
     user = user_node.value
-    if user.check_password(password):
+    try:
+        password_matches = await PASSWORD_HASHER.check_password(password, user.password)
+    except PasswordHasherBusy:
+        return {"error": "Server is busy, please try again."}
+
+    if password_matches:
         user.set_user_active()
-        return {"message": "Login successful."}
+        return {"message": "Login successful.", "token": SESSIONS.issue(user)}
 
     return error_response
 
@@ -42,18 +51,36 @@ async def register(request : Request):
     if USER_MANAGER.search_for_user(username) is not None:
         return {"error": "Username already exists."}
 
+    try:
+        hashed_password = await PASSWORD_HASHER.hash_password(password)
+    except PasswordHasherBusy:
+        return {"error": "Server is busy, please try again."}
+
+    # The username may have been taken while the password was being hashed
+    if USER_MANAGER.search_for_user(username) is not None:
+        return {"error": "Username already exists."}
+
     user_id = str(uuid.uuid4())
-    new_user = User(user_uuid= user_id, username= username, password= password, is_public= is_public)
+    new_user = User(user_uuid= user_id, username= username, password= hashed_password, is_public= is_public, is_hashed= True)
     USER_MANAGER.add_user(new_user.username, new_user)
-    USER_MANAGER.save()
-    return {"message": "User created successfully."}
+    return {"message": "User created successfully.", "token": SESSIONS.issue(new_user)}
 
 @router.get("/{username}/logout")
-def logout(username: str):
-    print(f"{username} IS LOGGING OUT")
+def logout(username: str, request: Request):
+    log.info("user logged out", extra={"username": username})
+    SESSIONS.revoke(get_session_token(request))
     return {"message": "Logout successful."}
 
-@router.get("/user/{username}")
+@router.get("/search", dependencies=[Depends(require_session)])
+async def search_users(prefix: str, limit: int = 20, after: str | None = None):
+    if not prefix:
+        return {"error": "A username prefix is required."}
+    limit = max(1, min(limit, 100))
+
+    users, next_after = USER_MANAGER.search_by_prefix(prefix, limit, after)
+    return {"users": [user.to_search_result() for user in users], "next_after": next_after}
+
+@router.get("/user/{username}", dependencies=[Depends(require_session)])
 async def get_user(username: str):
     user_node = USER_MANAGER.search_for_user(username)
     if user_node is None:
@@ -63,7 +90,7 @@ async def get_user(username: str):
     return user.to_dict()
 
 # Unfollow
-@router.post("/user/{username}/unfollow")
+@router.post("/user/{username}/unfollow", dependencies=[Depends(require_user_session)])
 async def unfollow_user(username: str, request: Request):
     data = await request.json()
     target_username = data.get('target_username')
@@ -91,10 +118,11 @@ async def unfollow_user(username: str, request: Request):
 
     target_user_obj.followers.remove(user_who_sent_unfollow)
     unfollower_user_obj.following.remove(target_username)
-    USER_MANAGER.save()
+    USER_MANAGER.record_removed(target_user_obj, "followers", user_who_sent_unfollow)
+    USER_MANAGER.record_removed(unfollower_user_obj, "following", target_username)
     return {"message": f"You have unfollowed {target_username}."}
 
-@router.post("/user/{username}/cancel_follow_request")
+@router.post("/user/{username}/cancel_follow_request", dependencies=[Depends(require_user_session)])
 async def cancel_follow_request(username: str, request: Request):
     data = await request.json()
     target_username = data.get("target_username")
@@ -117,22 +145,18 @@ async def cancel_follow_request(username: str, request: Request):
         return {"error": "No follow request from this user."}
 
     target_user_obj.follow_requests.remove(user_who_sent_request)
-    USER_MANAGER.save()
+    USER_MANAGER.record_removed(target_user_obj, "follow_requests", user_who_sent_request)
     return {"message": f"Follow request from {user_who_sent_request} cancelled."}
 
 
 # Follow
-@router.post("/user/{username}/follow")
+@router.post("/user/{username}/follow", dependencies=[Depends(require_user_session)])
 async def follow_user(username: str, request: Request):
 
-    print(f"Username: {username}")
-
     data = await request.json()
     target_username = data.get("target_username")
     follower_username = data.get("follower_username")
-
-    print(f"Target Username: {target_username}")
-    print(f"Follower Username: {follower_username}")
+    log.debug("follow requested", extra={"target": target_username, "follower": follower_username})
 
     if follower_username != username:
         return {"error": "Internal Error: follower username does not match authenticated user."}
@@ -149,18 +173,21 @@ async def follow_user(username: str, request: Request):
         return {"error": "Follower user not found."}
 
     target_user_obj.add_follower(follower_user_obj)
-    USER_MANAGER.save()
+    if target_user_obj.public_status:
+        USER_MANAGER.record_added(target_user_obj, "followers", follower_username)
+        USER_MANAGER.record_added(follower_user_obj, "following", target_username)
+    else:
+        USER_MANAGER.record_added(target_user_obj, "follow_requests", follower_username)
     return {"message": f"{follower_username} is now following {target_username}."}
 
-@router.post("/user/{username}/requests/accept")
+@router.post("/user/{username}/requests/accept", dependencies=[Depends(require_user_session)])
 async def accept_follow_request(request: Request, username: str):
     data = await request.json()
 
     target_username = data.get("target_username")
     follower_username = data.get("follower_username")
 
-    print(f"Target Username: {target_username}")
-    print(f"Follower Username: {follower_username}")
+    log.debug("follow request accepted", extra={"target": target_username, "follower": follower_username})
 
     if not target_username or not follower_username:
         return {"error": "Internal error: Target username and follower username are required."}
@@ -186,18 +213,19 @@ async def accept_follow_request(request: Request, username: str):
     target_user_obj.followers.add(follower_username)
     follower_user_obj.following.add(target_username)
 
-    USER_MANAGER.save()
+    USER_MANAGER.record_removed(target_user_obj, "follow_requests", follower_username)
+    USER_MANAGER.record_added(target_user_obj, "followers", follower_username)
+    USER_MANAGER.record_added(follower_user_obj, "following", target_username)
     return {"message": f"{follower_username} accepted your follow request."}
 
-@router.post("/user/{username}/requests/deny")
+@router.post("/user/{username}/requests/deny", dependencies=[Depends(require_user_session)])
 async def reject_follow_request(request: Request, username: str):
     data = await request.json()
 
     target_username = data.get("target_username")
     follower_username = data.get("follower_username")
 
-    print(f"Target Username: {target_username}")
-    print(f"Follower Username: {follower_username}")
+    log.debug("follow request denied", extra={"target": target_username, "follower": follower_username})
 
     if not target_username or not follower_username:
         return {"error": "Internal error: Target username and follower username are required."}
@@ -214,11 +242,11 @@ async def reject_follow_request(request: Request, username: str):
 
     target_user_obj.follow_requests.remove(follower_username)
 
-    USER_MANAGER.save()
+    USER_MANAGER.record_removed(target_user_obj, "follow_requests", follower_username)
     return {"message": f"Follow request from {follower_username} denied."}
 
 @router.post("/user/block")
-async def block_user(request: Request):
+async def block_user(request: Request, session_username: str = Depends(require_session)):
     data = await request.json()
     username = data.get("username")
     blocked_username = data.get("blocked_username")
@@ -226,6 +254,9 @@ async def block_user(request: Request):
     if not username or not blocked_username:
         return {"error": "Username and blocked username are required."}
 
+    if username != session_username:
+        return {"error": "Username does not match the authenticated user."}
+
     user_node = USER_MANAGER.search_for_user(username)
     if user_node is None:
         return {"error": "User not found."}
@@ -239,28 +270,30 @@ async def block_user(request: Request):
     blocked_user = blocked_user_node.value
 
     user.block_user(blocked_user)
-    USER_MANAGER.save()
+    USER_MANAGER.record_added(user, "blocked_users", blocked_username)
+    USER_MANAGER.record_removed(user, "followers", blocked_username)
+    USER_MANAGER.record_removed(user, "following", blocked_username)
     return {"message": f"{blocked_username} has been blocked."}
 
-@router.get("/user/{username}/followers")
+@router.get("/user/{username}/followers", dependencies=[Depends(require_session)])
 async def get_followers(username: str):
     user_status, user_obj = find_user(username)
     if not user_status or user_obj is None:
         return {"error": "User not found."}
     return user_obj.followers_to_list()
 
-@router.get("/user/{username}/following")
+@router.get("/user/{username}/following", dependencies=[Depends(require_session)])
 async def get_following(username: str):
     user_status, user_obj = find_user(username)
     if not user_status or user_obj is None:
         return {"error": "User not found."}
     return user_obj.following_to_list()
 
-@router.get("/user/{username}/update_pfp")
+@router.get("/user/{username}/update_pfp", dependencies=[Depends(require_user_session)])
 async def update_pfp(username: str, request: Request):
     pass
 
-@router.post("/user/{username}/update_username")
+@router.post("/user/{username}/update_username", dependencies=[Depends(require_user_session)])
 async def update_username(username: str, request: Request):
     data = await request.json()
 
@@ -281,13 +314,14 @@ async def update_username(username: str, request: Request):
     user_obj.username = new_username
 
     USER_MANAGER.update_username_key(old_username, new_username)
-    USER_MANAGER.save()
 
-    print(f"{old_username} has changed their username to {new_username} successfully.")
-    return {"message": "Username updated successfully."}
+    # Sessions are bound to the username they were issued for, so the renamed user gets a fresh one
+    SESSIONS.revoke(get_session_token(request))
+    log.info("username changed", extra={"old_username": old_username, "new_username": new_username})
+    return {"message": "Username updated successfully.", "token": SESSIONS.issue(user_obj)}
 
 
-@router.post("/user/{username}/update_public_status")
+@router.post("/user/{username}/update_public_status", dependencies=[Depends(require_user_session)])
 async def update_public_status(username: str, request: Request):
     data = await request.json()
     is_public = data.get("is_public")
@@ -305,8 +339,10 @@ async def update_public_status(username: str, request: Request):
             if not user_status or follow_request_user_obj is None: continue
             user_obj.follow_requests.remove(follow_request_username)
             follow_request_user_obj.following.add(username)
+            USER_MANAGER.record_removed(user_obj, "follow_requests", follow_request_username)
+            USER_MANAGER.record_added(follow_request_user_obj, "following", username)
 
-    USER_MANAGER.save()
+    USER_MANAGER.record_fields(user_obj, "public_status")
 
     public_status = "Public" if is_public else "Private"
     return {"message": f"Public status successfully updated to: {public_status}"}
\ No newline at end of file
@@ -1,35 +1,65 @@
+import logging
 from random import random, randint
 
 from fastapi import APIRouter
 from starlette.websockets import WebSocket, WebSocketDisconnect
-from typing import Dict, Any, List
+from typing import Dict, List
 from datetime import datetime, date, timezone
-from uuid import UUID
 
-from backend.instances import USER_MANAGER, CHAT_MANAGER
+from backend.instances import USER_MANAGER, CHAT_MANAGER, BACKPLANE, CHAT_ACTORS
+from backend.models.connections.client_connection import ClientConnection, DROP_OLDEST
+from backend.models.connections.connection_registry import ConnectionRegistry
+from backend.models.connections.operation_dispatcher import OperationRegistry, OperationPipeline, CONNECTION_LANE, EXCLUSIVE
+from backend.models.connections.read_receipt_batcher import ReadReceiptBatcher
 from backend.models.user import User
 from backend.routes.chat_routes import user_websocket_endpoint
+from backend.utils.auth_utils import authenticate
 from backend.utils.chat_utils import find_chat
+from backend.utils.compact_encoding import FIELD_CODES, KEYED_FIELDS, compact_frame
 from backend.utils.formatting import format_chat_dict, format_chat_dict_for_json
+from backend.utils.json_encoding import encode_json, decode_json
+from backend.utils.logging_utils import get_logger, Sampler
+from backend.utils.metrics import METRICS
 from backend.utils.user_utils import find_user
 
 router = APIRouter()
+log = get_logger("web_socket")
 
+SEND_QUEUE_SIZE = 256
+SEND_QUEUE_OVERFLOW_POLICY = DROP_OLDEST  # or DISCONNECT to close clients whose queue overflows
+READ_RECEIPT_WINDOW_SECONDS = 0.05
+RESUME_PAGE_SIZE = 200  # Missed messages replayed per chat per resume; clients ask again until complete
+BATCH_WINDOW_SECONDS = 0.01  # How long a batching client's first pending frame waits for others to join it
 
-active_user_connections: Dict[str, WebSocket] = {}
-active_chat_connections: Dict[str, Dict[str, Dict[str, Any]]] = {}
+# Opt-in protocol extensions a client can ask for with ?capabilities=a,b on connect
+BATCH = "batch"  # Frames may be JSON arrays of events, in order
+COMPACT = "compact"  # Field names are replaced by the short codes listed in the connect ack
+SUPPORTED_CAPABILITIES = (BATCH, COMPACT)
 
+CONNECTIONS = ConnectionRegistry(BACKPLANE)
+OPERATIONS = OperationRegistry()
 
-async def update_active_connection_username(old_username : str, new_username : str):
-    # ACTIVE USER CONNECTIONS: {'test': < starlette.websockets.WebSocket object at 0x000001CB8ACCA480 >}
-    active_user_connections[new_username] = active_user_connections.pop(old_username, None)
+# Per-message debug events are sampled; at the default INFO level they cost one level check
+OPERATION_LOG_SAMPLER = Sampler()
+MESSAGE_LOG_SAMPLER = Sampler()
 
-async def update_chat_connection_username(old_username : str, new_username : str, chat_ids : List[str]):
-    # ACTIVE CHAT CONNECTIONS: {'56d00d2b-6f93-42f9-95a2-ef4687a25aa5': {'test': {'websocket': < starlette.websockets.WebSocket object at 0x000001CB8ACCA480 >, 'subscription_type': None}}}
-    for chat_id in chat_ids:
-        chat_map = active_chat_connections.get(chat_id)
-        if not chat_map: continue
-        chat_map[new_username] = chat_map.pop(old_username, None)
+WS_OPERATION_SECONDS = METRICS.histogram("chatter_ws_operation_seconds", "WebSocket operation handling time, by operation.", ("operation",))
+WS_ERRORS = METRICS.counter("chatter_ws_errors_total", "WebSocket error replies, by operation and code.", ("operation", "code"))
+BROADCAST_SECONDS = METRICS.histogram("chatter_broadcast_seconds", "Time to encode and publish one chat broadcast.")
+BROADCAST_FANOUT = METRICS.histogram("chatter_broadcast_fanout", "Local connections a broadcast frame was queued for.", buckets=(0, 1, 2, 5, 10, 25, 50, 100, 250, 500, 1000))
+
+
+def connection_queue_depths():
+    depths = [connection.queue.qsize() for connection in CONNECTIONS.user_connections.values()]
+    return {"total": sum(depths), "max": max(depths, default=0)}
+
+METRICS.gauge("chatter_ws_connections", "Open WebSocket connections on this worker.", lambda: len(CONNECTIONS.user_connections))
+METRICS.gauge("chatter_ws_active_chats", "Chats with at least one connected member on this worker.", lambda: len(CONNECTIONS.chat_members))
+METRICS.gauge("chatter_send_queue_depth", "Frames waiting in client send queues.", connection_queue_depths, ("aggregate",))
+
+
+async def update_connection_username(old_username : str, new_username : str):
+    CONNECTIONS.rename_user(old_username, new_username)
 
 async def username_to_object(username: str) -> User | Dict[str, str]:
     user_node = USER_MANAGER.search_for_user(username)
@@ -37,60 +67,51 @@ async def username_to_object(username: str) -> User | Dict[str, str]:
         return {"error": "User not found."}
     return user_node.value
 
-async def add_user_to_active_connections(username: str, websocket: WebSocket):
-    active_user_connections[username] = websocket
+async def add_user_to_active_connections(username: str, connection: ClientConnection):
+    CONNECTIONS.add_user(username, connection)
 
-async def remove_user_from_active_connections(username: str):
-    active_user_connections.pop(username, None)
+async def remove_user_from_active_connections(username: str, connection: ClientConnection):
+    # Detaches the user from their chats through the reverse index, without scanning every active chat
+    CONNECTIONS.remove_user(username, connection)
 
 def attach_user_to_chat(chat_id: str, username: str):
-    user_websocket = get_user_connection(username)
-    if user_websocket is None:
-        return
-    ensure_chat_bucket(chat_id)
-    active_chat_connections[chat_id][username] = format_connection(user_websocket)
+    CONNECTIONS.attach(chat_id, username)
 
 def remove_user_from_chat(chat_id: str, username: str) -> None:
-    chat_map = active_chat_connections.get(chat_id)
-    if not chat_map:
-        return
+    CONNECTIONS.detach(chat_id, username)
 
-    chat_map.pop(username, None)
+def get_user_connection(username: str) -> ClientConnection | None:
+    return CONNECTIONS.get_user(username)
 
-    if not chat_map:
-        active_chat_connections.pop(chat_id, None)
+def update_active_chat_status(subscription_type, chat_id, username):
+    CONNECTIONS.set_subscription(chat_id, username, subscription_type)
 
-def get_user_connection(username: str) -> WebSocket | None:
-    return active_user_connections.get(username)
 
-def ensure_chat_bucket(chat_id: str):
-    if chat_id not in active_chat_connections:
-        active_chat_connections[chat_id] = {}
+# What a handler knows about the socket an operation arrived on
+class SocketSession:
 
-def format_connection(ws: WebSocket) -> Dict[str, Any]:
-    return {"websocket": ws, "subscription_type": None}
+    __slots__ = ("connection", "username", "user")
 
-def update_subscription_type(subscription_type: str, user_info: Dict[str, Any]):
-    user_info["subscription_type"] = subscription_type
+    def __init__(self, connection: ClientConnection, username: str, user: User):
+        self.connection = connection
+        self.username = username
+        self.user = user
 
-def update_active_chat_status(subscription_type, chat_id, username):
-    chat_map = active_chat_connections.get(chat_id)
-    if not chat_map: return
-    user_info = chat_map.get(username)
-    if not user_info: return
-    update_subscription_type(subscription_type, user_info)
 
-async def handle_create_chat(request_websocket : WebSocket, creator_obj : User, payload : Dict[str, str | list[str]]):
+@OPERATIONS.register("ping", lane=CONNECTION_LANE)
+async def handle_ping(session, payload):
+    await send_ws_ack(session.connection, "pong")
 
-    print(f"Payload: {payload}")
+@OPERATIONS.register("create_chat", lane=CONNECTION_LANE)
+async def handle_create_chat(session : SocketSession, payload : Dict[str, str | list[str]]):
+    request_websocket = session.connection
+    creator_obj = session.user
 
     chat_name = payload.get("chat_name")
-    print(f"Chat name: {chat_name}")
 
     chat_creator_username = creator_obj.username
 
     participants = payload.get("participants", [])
-    print(f"Participants: {participants}")
 
     participant_permissions = payload.get("permissions", {})
 
@@ -107,64 +128,54 @@ async def handle_create_chat(request_websocket : WebSocket, creator_obj : User,
 
         for participant in participant_objects:
             participant.add_chat_id(chat_id)
+            USER_MANAGER.record_added(participant, "chat_ids", chat_id)
         creator_obj.add_chat_id(chat_id)
+        USER_MANAGER.record_added(creator_obj, "chat_ids", chat_id)
 
-        chat_obj.add_system_message(f"[=== {', '.join(chat_obj.participants.keys())} ===]")
-        chat_obj.add_system_message(f"Chat created by {chat_creator_username}")
-        print(f"CHAT OBJECT CREATED: {chat_obj}")
+        log.info("chat created", extra={"chat_id": chat_id, "owner": chat_creator_username, "participants": len(chat_obj.participants)})
 
         time_created = getattr(chat_obj, "time_created", None)
         if isinstance(time_created, (datetime, date)):
             time_created = time_created.isoformat()
         else:
             time_created = datetime.now(timezone.utc).isoformat()
-        ensure_chat_bucket(chat_id)
         attach_user_to_chat(chat_id, chat_creator_username)
 
         for participant in participants:
             if participant == creator_obj.username: continue
             attach_user_to_chat(chat_id, participant)
 
-        event = {"operation": "chat_created"} | chat_obj.to_dict()
-
-        print(f"CHAT EVENT: {event}")
-
-        CHAT_MANAGER.save_chat_database()
-        USER_MANAGER.save()
+        def announce_chat(emit):
+            participants_message = chat_obj.add_system_message(f"[=== {', '.join(chat_obj.participants.keys())} ===]")
+            CHAT_MANAGER.record_message(chat_id, participants_message)
+            created_message = chat_obj.add_system_message(f"Chat created by {chat_creator_username}")
+            CHAT_MANAGER.record_message(chat_id, created_message)
+            emit({"operation": "chat_created"} | chat_obj.get_chat_overview())
 
-        print('DATABASES SAVED')
-
-        await broadcast_to_chat(chat_id, event)
+        await CHAT_ACTORS.run(chat_id, announce_chat)
         await send_ws_ack(request_websocket, "create_chat", {"chat_id": chat_id, "time_created": time_created})
 
     except Exception as e:
-        print(f"Error creating chat: {e}")
+        log.warning("chat creation failed", exc_info=True, extra={"owner": chat_creator_username})
         await send_ws_error(request_websocket, "create_chat", "error", "Error creating chat", {"detail": str(e)})
 
-async def handle_enter_chat(websocket, username, payload):
-    chat_id = payload.get("chat_id")
-    if not chat_id:
-        await send_ws_error(websocket, "enter_chat", "missing_chat_id", "Missing chat ID")
-        return
-    ensure_chat_bucket(chat_id)
-    attach_user_to_chat(chat_id, username)
-    update_active_chat_status("chat", chat_id, username)
-    await send_ws_ack(websocket, "enter_chat", {"chat_id": chat_id})
-
-async def handle_exit_chat(websocket, username, payload):
-    chat_id = payload.get("chat_id")
-    if not chat_id:
-        await send_ws_error(websocket, "exit_chat", "missing_chat_id", "Missing chat ID")
-        return
-    chat_map = active_chat_connections.get(chat_id)
-    update_active_chat_status("dashboard", chat_id, username)
-    await send_ws_ack(websocket, "exit_chat", {"chat_id": chat_id})
-
-async def handle_leave_chat(websocket, username, payload):
-    chat_id = payload.get("chat_id")
-    if not chat_id:
-        await send_ws_error(websocket, "leave_chat", "missing_chat_id", "Missing chat ID")
-        return
+@OPERATIONS.register("enter_chat")
+async def handle_enter_chat(session, payload):
+    chat_id = payload["chat_id"]
+    attach_user_to_chat(chat_id, session.username)
+    update_active_chat_status("chat", chat_id, session.username)
+    await send_ws_ack(session.connection, "enter_chat", {"chat_id": chat_id})
+
+@OPERATIONS.register("exit_chat")
+async def handle_exit_chat(session, payload):
+    chat_id = payload["chat_id"]
+    update_active_chat_status("dashboard", chat_id, session.username)
+    await send_ws_ack(session.connection, "exit_chat", {"chat_id": chat_id})
+
+@OPERATIONS.register("leave_chat")
+async def handle_leave_chat(session, payload):
+    websocket, username = session.connection, session.username
+    chat_id = payload["chat_id"]
 
     user_status, user_obj = find_user(username)
     if not user_status or user_obj is None:
@@ -174,108 +185,123 @@ async def handle_leave_chat(websocket, username, payload):
     chat_status, chat_obj = find_chat(chat_id)
     if not chat_status or chat_obj is None:
         await send_ws_error(websocket, "leave_chat", "chat_not_found", "Chat does not exist", {"chat_id": chat_id})
+        return
 
-    ensure_chat_bucket(chat_id)
-
-    is_owner = chat_obj.owner == username
-
-    chat_obj.remove_participant(user_obj)
+    # Returns whether the chat was deleted because its last participant left
+    def leave(emit):
+        is_owner = chat_obj.owner == username
 
-    if len(chat_obj.participants) == 0:
-        CHAT_MANAGER.delete_chat(chat_id)
-        active_chat_connections.pop(chat_id, None)
+        chat_obj.remove_participant(user_obj)
+        USER_MANAGER.record_removed(user_obj, "chat_ids", chat_id)
+        CHAT_MANAGER.record_participant_removed(chat_obj, username)
+
+        if len(chat_obj.participants) == 0:
+            CHAT_MANAGER.delete_chat(chat_id)
+            return True
+
+        if is_owner:
+            participant_list = list(chat_obj.participants.keys())
+            random_new_owner_index = randint(0, len(participant_list) - 1)
+            new_owner_username = participant_list[random_new_owner_index]
+            chat_obj.promote_to_owner(new_owner_username)
+            CHAT_MANAGER.record_participant(chat_obj, new_owner_username)
+            CHAT_MANAGER.record_fields(chat_obj, "owner")
+
+        leave_chat_message = chat_obj.send_user_leave_message(username)
+        CHAT_MANAGER.record_message(chat_id, leave_chat_message)
+        if leave_chat_message:
+            emit({"operation": "message"} | {'chat_id': chat_id} | leave_chat_message)
+        emit({"operation": "update_chat"} | chat_obj.get_chat_overview())
+        return False
+
+    if await CHAT_ACTORS.run(chat_id, leave):
+        CONNECTIONS.drop_chat(chat_id)
         await send_ws_ack(websocket, "leave_chat", {"chat_id": chat_id, "message": "Chat deleted due to no participants."})
         return
 
-    if is_owner:
-        participant_list = list(chat_obj.participants.keys())
-        random_new_owner_index = randint(0, len(participant_list) - 1)
-        new_owner_username = participant_list[random_new_owner_index]
-        chat_obj.promote_to_owner(new_owner_username)
-
-    leave_chat_message = chat_obj.send_user_leave_message(username)
-    if leave_chat_message:
-        await broadcast_to_chat(chat_id, {"operation": "message"} | {'chat_id': chat_id} | leave_chat_message | {"unread_messages_by": list(chat_obj.unread_messages_by)})
-
-    await broadcast_to_chat(chat_id, {"operation": "update_chat"} | chat_obj.to_dict())
     remove_user_from_chat(chat_id, username)
 
-    CHAT_MANAGER.save_chat_database()
-    USER_MANAGER.save()
-
     await send_ws_ack(websocket, "leave_chat", {"chat_id": chat_id})
 
-async def handle_send_message(websocket, username, payload):
-    chat_id = payload.get("chat_id")
-    message_text = payload.get("message")
-    if not chat_id:
-        await send_ws_error(websocket, "send_message", "missing_chat_id", "Missing chat ID")
-        return
-    if not message_text:
-        await send_ws_error(websocket, "send_message", "missing_message", "Missing message")
-        return
+@OPERATIONS.register("send_message", {"message": str})
+async def handle_send_message(session, payload):
+    websocket, username = session.connection, session.username
+    chat_id = payload["chat_id"]
+    message_text = payload["message"]
 
     chat_status, chat_obj = find_chat(chat_id)
     if not chat_status or chat_obj is None:
         await send_ws_error(websocket, "send_message", "chat_not_found","Chat does not exist",{"chat_id": chat_id})
+        return
 
-    ensure_chat_bucket(chat_id)
     new_message = format_chat_dict(chat_id, username, message_text)
 
-    print(f"New message: {new_message}")
-    chat_obj.add_message(new_message)
+    def append_message(emit):
+        chat_obj.add_message(new_message)
+        CHAT_MANAGER.record_message(chat_id, new_message)
 
-    print(f"UNREAD BY: {chat_obj.unread_messages_by}")
+        chat_map = CONNECTIONS.members(chat_id)
+        if log.isEnabledFor(logging.DEBUG) and MESSAGE_LOG_SAMPLER():
+            log.debug("message sent", extra={"chat_id": chat_id, "sender": username, "seq": new_message["seq"], "local_members": len(chat_map)})
 
-    chat_map = active_chat_connections.get(chat_id)
+        # The sender and anyone viewing the chat have read the message; their read cursors move now and are persisted with the next batch
+        chat_obj.mark_as_read_by(username)
+        READ_RECEIPTS.add(chat_id, username, announce=False)
+        for active_participant_username, active_participant_connection_info in chat_map.items():
+            subscription_type = active_participant_connection_info["subscription_type"]
+            if subscription_type == "chat":
+                chat_obj.mark_as_read_by(active_participant_username)
+                READ_RECEIPTS.add(chat_id, active_participant_username, announce=False)
 
-    print(f"Active chat connections for {chat_id}: {chat_map}")
+        emit({"operation": "message"} | new_message)
 
-    for active_participant_username, active_participant_connection_info in chat_map.items():
-        subscription_type = active_participant_connection_info["subscription_type"]
-        if subscription_type == "chat":
-            chat_obj.mark_as_read_by(active_participant_username)
-
-    CHAT_MANAGER.save_chat_database()
-    USER_MANAGER.save()
-
-    await broadcast_to_chat(chat_id, {"operation": "message"} | new_message | {"unread_messages_by": list(chat_obj.unread_messages_by)})
+    await CHAT_ACTORS.run(chat_id, append_message)
 
     message_id = new_message.get('message_id')
     message_timestamp = new_message.get('time_sent')
 
-    await send_ws_ack(websocket, "send_message", format_chat_dict_for_json(message_id, "message", chat_id, username, message_text, message_timestamp))
-
-async def handle_read_receipt(websocket, payload):
-    chat_id = payload.get("chat_id")
-    if not chat_id:
-        await send_ws_error(websocket, "read_receipt", "missing_chat_id", "Missing chat ID")
-        return
+    await send_ws_ack(websocket, "send_message", format_chat_dict_for_json(message_id, "message", chat_id, username, message_text, message_timestamp) | {"seq": new_message["seq"]})
 
+@OPERATIONS.register("read_receipt")
+async def handle_read_receipt(session, payload):
+    chat_id = payload["chat_id"]
     chat_status, chat_obj = find_chat(chat_id)
     if not chat_status or chat_obj is None:
-        await send_ws_error(websocket, "read_receipt", "chat_not_found", "Chat does not exist", {"chat_id": chat_id})
+        await send_ws_error(session.connection, "read_receipt", "chat_not_found", "Chat does not exist", {"chat_id": chat_id})
         return
 
-    username = payload.get("username")
-    if not username:
-        await send_ws_error(websocket, "read_receipt", "missing_username", "Missing username")
+    # Reads are recorded for the session's user; the username a client puts in the payload is not trusted
+    username = session.username
+
+    def mark_read(emit):
+        chat_obj.mark_as_read_by(username)
+        READ_RECEIPTS.add(chat_id, username)
+
+    await CHAT_ACTORS.run(chat_id, mark_read)
+
+async def flush_read_receipts(chat_id: str, usernames: List[str], announced_usernames: List[str]):
+    chat_status, chat_obj = find_chat(chat_id)
+    if not chat_status or chat_obj is None:
         return
 
-    chat_obj.mark_as_read_by(username)
-    chat_unread_list = list(chat_obj.unread_messages_by)
+    def record_reads(emit):
+        CHAT_MANAGER.record_read_seqs(chat_obj, usernames)
 
-    CHAT_MANAGER.save_chat_database()
+        # A message that arrived during the window may have made some of them unread again
+        latest_seq = chat_obj.latest_seq
+        read_seqs = {username: chat_obj.read_seqs[username] for username in announced_usernames if username in chat_obj.read_seqs and chat_obj.read_seqs[username] >= latest_seq}
+        if read_seqs:
+            emit({"operation": "read_receipt", "chat_id": chat_id, "read_by": list(read_seqs), "read_seqs": read_seqs})
 
-    read_receipt_payload = {"operation": "read_receipt", "chat_id": chat_id, "username": username, "unread_messages_by": chat_unread_list}
+    await CHAT_ACTORS.run(chat_id, record_reads)
 
-    await broadcast_to_chat(chat_id, read_receipt_payload)
+READ_RECEIPTS = ReadReceiptBatcher(flush_read_receipts, READ_RECEIPT_WINDOW_SECONDS)
+METRICS.gauge("chatter_read_receipts_pending_chats", "Chats with read receipts waiting for the next batch.", lambda: len(READ_RECEIPTS.pending))
 
-async def handle_update_chat(websocket, username, payload):
-    chat_id = payload.get("chat_id")
-    if not chat_id:
-        await send_ws_error(websocket, "update_chat", "missing_chat_id", "Missing chat ID")
-        return
+@OPERATIONS.register("update_chat")
+async def handle_update_chat(session, payload):
+    websocket, username = session.connection, session.username
+    chat_id = payload["chat_id"]
     chat_status, chat_obj = find_chat(chat_id)
     if not chat_status or chat_obj is None:
         await send_ws_error(websocket, "update_chat", "chat_not_found", "Chat does not exist", {"chat_id": chat_id})
@@ -286,101 +312,148 @@ async def handle_update_chat(websocket, username, payload):
     updated_permissions = payload.get("updated_permissions", {})
     updated_chat_name = payload.get("chat_name", None)
 
-    ensure_chat_bucket(chat_id)
-
-    for participant_username in updated_permissions:
-        if participant_username in removed_participant_list or participant_username in added_participant_list: continue
-        chat_obj.update_permissions(participant_username, updated_permissions[participant_username])
-
-    for participant_to_be_removed in removed_participant_list:
-        user_status, user_obj = find_user(participant_to_be_removed)
-        if not user_status or user_obj is None: continue
-        chat_obj.remove_participant(user_obj)
-        user_obj.chat_ids.remove(chat_id)
-
-        kick_message = chat_obj.send_user_kick_message(participant_to_be_removed, username)
-        if kick_message:
-            await broadcast_to_chat(chat_id, {"operation": "message"} | {'chat_id': chat_id} | kick_message | {"unread_messages_by": list(chat_obj.unread_messages_by)})
-
-    for participant_to_be_added in added_participant_list:
-        user_status, user_obj = find_user(participant_to_be_added)
-        if not user_status or user_obj is None: continue
-
-        can_edit = updated_permissions.get(participant_to_be_added, {}).get("can_edit", False)
-        chat_obj.add_participant(user_obj, can_edit)
-        user_obj.add_chat_id(chat_id)
-
-        attach_user_to_chat(chat_id, participant_to_be_added)
-
-        join_message = chat_obj.send_user_join_message(participant_to_be_added, username)
-        if join_message:
-            await broadcast_to_chat(chat_id, {"operation": "message"} | {'chat_id': chat_id} | join_message | {"unread_messages_by": list(chat_obj.unread_messages_by)})
-
-    if updated_chat_name is not None:
-        chat_obj.chat_name = updated_chat_name
-
-
-    CHAT_MANAGER.save_chat_database()
-    USER_MANAGER.save()
-
-    await broadcast_to_chat(chat_id, {'operation': "update_chat"} | chat_obj.to_dict())
+    # The whole edit is applied in one step, so no message or other edit lands between its parts
+    def apply_update(emit):
+        for participant_username in updated_permissions:
+            if participant_username in removed_participant_list or participant_username in added_participant_list: continue
+            chat_obj.update_permissions(participant_username, updated_permissions[participant_username])
+            if participant_username in chat_obj.participants:
+                CHAT_MANAGER.record_participant(chat_obj, participant_username)
+
+        for participant_to_be_removed in removed_participant_list:
+            user_status, user_obj = find_user(participant_to_be_removed)
+            if not user_status or user_obj is None: continue
+            # remove_participant also drops the chat from the user's chat_ids
+            chat_obj.remove_participant(user_obj)
+            USER_MANAGER.record_removed(user_obj, "chat_ids", chat_id)
+            CHAT_MANAGER.record_participant_removed(chat_obj, participant_to_be_removed)
+
+            kick_message = chat_obj.send_user_kick_message(participant_to_be_removed, username)
+            CHAT_MANAGER.record_message(chat_id, kick_message)
+            if kick_message:
+                emit({"operation": "message"} | {'chat_id': chat_id} | kick_message)
+
+        for participant_to_be_added in added_participant_list:
+            user_status, user_obj = find_user(participant_to_be_added)
+            if not user_status or user_obj is None: continue
+
+            can_edit = updated_permissions.get(participant_to_be_added, {}).get("can_edit", False)
+            chat_obj.add_participant(user_obj, can_edit)
+            user_obj.add_chat_id(chat_id)
+            CHAT_MANAGER.record_participant(chat_obj, participant_to_be_added)
+            USER_MANAGER.record_added(user_obj, "chat_ids", chat_id)
+
+            attach_user_to_chat(chat_id, participant_to_be_added)
+
+            join_message = chat_obj.send_user_join_message(participant_to_be_added, username)
+            CHAT_MANAGER.record_message(chat_id, join_message)
+            if join_message:
+                emit({"operation": "message"} | {'chat_id': chat_id} | join_message)
+
+        if updated_chat_name is not None:
+            chat_obj.chat_name = updated_chat_name
+            CHAT_MANAGER.record_fields(chat_obj, "chat_name")
+
+        emit({'operation': "update_chat"} | chat_obj.get_chat_overview())
+
+        edit_message = chat_obj.send_user_edit_message(username)
+        CHAT_MANAGER.record_message(chat_id, edit_message)
+        if edit_message:
+            emit({"operation": "message"} | {'chat_id': chat_id} | edit_message)
+
+    await CHAT_ACTORS.run(chat_id, apply_update)
+    # Removed users still get the batch above, including their own kick, before they are detached
     for removed_participant_username in removed_participant_list:
         remove_user_from_chat(chat_id, removed_participant_username)
 
-    edit_message = chat_obj.send_user_edit_message(username)
-    if edit_message:
-        await broadcast_to_chat(chat_id, {"operation": "message"} | {'chat_id': chat_id} | edit_message | {"unread_messages_by": list(chat_obj.unread_messages_by)})
+@OPERATIONS.register("join_chat")
+async def handle_join_chat(session, payload):
+    chat_id = payload["chat_id"]
+    attach_user_to_chat(chat_id, session.username)
+    await send_ws_ack(session.connection, "join_chat", {"chat_id": chat_id})
 
-async def handle_join_chat(websocket, username, payload):
-    chat_id = payload.get("chat_id")
-    if not chat_id:
-        await send_ws_error(websocket, "join_chat", "missing_chat_id", "Missing chat ID")
+@OPERATIONS.register("resume", lane=CONNECTION_LANE)
+async def handle_resume(session, payload):
+    # payload maps chat_id -> the last sequence number the client saw; only the gap after it is replayed
+    websocket, username = session.connection, session.username
+    user_status, user_obj = find_user(username)
+    if not user_status or user_obj is None:
+        await send_ws_error(websocket, "resume", "user_not_found", "User does not exist", {"username": username})
         return
-    ensure_chat_bucket(chat_id)
-    attach_user_to_chat(chat_id, username)
-    await send_ws_ack(websocket, "join_chat", {"chat_id": chat_id})
 
-async def handle_username_update(websocket, username, payload):
-    new_username = payload.get("new_username")
-    if not new_username:
-        await send_ws_error(websocket, "username_update", "missing_new_username", "Missing new username")
+    for chat_id, last_seq in payload.items():
+        if chat_id not in user_obj.chat_ids or not isinstance(last_seq, int):
+            await send_ws_error(websocket, "resume", "invalid_chat", "Cannot resume this chat", {"chat_id": chat_id})
+            continue
+        chat_status, chat_obj = find_chat(chat_id)
+        if not chat_status or chat_obj is None:
+            await send_ws_error(websocket, "resume", "chat_not_found", "Chat does not exist", {"chat_id": chat_id})
+            continue
+
+        messages, has_more = chat_obj.get_messages_after(last_seq, RESUME_PAGE_SIZE)
+        await websocket.send_json({
+            "operation": "resume",
+            "chat_id": chat_id,
+            "messages": messages,
+            "latest_seq": chat_obj.latest_seq,
+            "complete": not has_more
+        })
+
+# Every later operation must see the new name, so nothing else from this connection runs alongside it
+@OPERATIONS.register("update_username", {"new_username": str}, lane=EXCLUSIVE)
+async def handle_username_update(session, payload):
+    websocket, username = session.connection, session.username
+    new_username = payload["new_username"]
 
     user_status, user_obj = find_user(new_username)
     if not user_status or user_obj is None:
         await send_ws_error(websocket, "username_update", "user_not_found", "User does not exist", {"username": username})
         return
+    # The REST route renames the account in place; a socket only picks up its own new name, never another user's
+    if user_obj.id != session.user.id:
+        await send_ws_error(websocket, "username_update", "forbidden", "Cannot take another user's name", {"username": username})
+        return
 
     user_chats = list(user_obj.chat_ids)
 
-    await update_active_connection_username(username, new_username)
-    await update_chat_connection_username(username, new_username, user_chats)
+    await update_connection_username(username, new_username)
+    session.username = new_username
+    session.user = user_obj
 
     for chat_id in user_chats:
         await broadcast_to_chat(chat_id, {"operation": "update_user", "chat_id": chat_id} | {"old_username": username} | user_obj.to_dict())
 
 async def broadcast_to_chat(chat_id: str, payload: dict):
-    payload = json_sanitize(payload)
-    chat_map = active_chat_connections.get(chat_id) or {}
-    for info in list(chat_map.values()):
-        ws = info.get("websocket")
-        if ws:
-            try:
-                await ws.send_json(payload)
-            except Exception:
-                pass
-
-def json_sanitize(x):
-    if isinstance(x, (datetime, date)):
-        return x.isoformat()
-    if isinstance(x, UUID):
-        return str(x)
-    if isinstance(x, dict):
-        return {k: json_sanitize(v) for k, v in x.items()}
-    if isinstance(x, (list, tuple, set)):
-        return [json_sanitize(v) for v in x]
-    return x
+    # Encoded once for every member; the backplane hands the frame to their sockets
+    with BROADCAST_SECONDS.time():
+        BACKPLANE.publish(chat_id, encode_json(payload))
+
+def deliver_to_local_members(chat_id: str, frame: str):
+    members = list(CONNECTIONS.members(chat_id).values())
+    BROADCAST_FANOUT.observe(len(members))
+    compact = None
+    for info in members:
+        connection = info.get("connection")
+        if not connection:
+            continue
+        if connection.compact:
+            if compact is None:
+                compact = compact_frame(frame)
+            connection.enqueue(compact)
+        else:
+            connection.enqueue(frame)
+
+BACKPLANE.set_handler(deliver_to_local_members)
+
+async def publish_chat_events(chat_id: str, events: List[dict]):
+    for event in events:
+        await broadcast_to_chat(chat_id, event)
+
+CHAT_ACTORS.set_publisher(publish_chat_events)
 
 async def send_ws_error(ws: WebSocket, op: str, code: str, message: str, extra: dict | None = None):
+    # Unsupported operation names come straight from the client; folding them keeps the series count bounded
+    WS_ERRORS.inc("unsupported" if code == "unsupported_operation" else op, code)
     payload = {"type": "error", "operation": op, "code": code, "message": message}
     if extra:
         payload["data"] = extra
@@ -400,84 +473,59 @@ async def websocket_endpoint(websocket: WebSocket, username: str):
         await websocket.close(1008, "User does not exist.")
         return
 
+    if authenticate(websocket) != username:
+        await websocket.close(1008, "Not authenticated.")
+        return
+
+    requested_capabilities = websocket.query_params.get("capabilities", "").split(",")
+    capabilities = [capability for capability in SUPPORTED_CAPABILITIES if capability in requested_capabilities]
+
     await websocket.accept()
-    await add_user_to_active_connections(username, websocket)
+    batch_window = BATCH_WINDOW_SECONDS if BATCH in capabilities else None
+    connection = ClientConnection(websocket, SEND_QUEUE_SIZE, SEND_QUEUE_OVERFLOW_POLICY, batch_window, compact=COMPACT in capabilities)
+    connection.start()
+    if requested_capabilities != [""]:
+        # Only clients that asked get told what was granted; older clients see the protocol they always had.
+        # This one frame is always in the full form, since it carries the code table a compact client needs
+        granted = {"capabilities": capabilities}
+        if COMPACT in capabilities:
+            granted |= {"field_codes": FIELD_CODES, "keyed_fields": KEYED_FIELDS}
+        connection.enqueue(encode_json({"type": "ack", "operation": "connect", "data": granted}))
+    await add_user_to_active_connections(username, connection)
     user_chat_ids = getattr(user, "chat_ids", [])
 
     for chat_id in user_chat_ids:
         attach_user_to_chat(chat_id, username)
 
+    session = SocketSession(connection, username, user)
+    pipeline = OperationPipeline(OPERATIONS, session, send_ws_error, WS_OPERATION_SECONDS)
+
     try:
         while True:
             try:
-                incoming_json = await websocket.receive_json()
+                frame = await websocket.receive_text()
             except WebSocketDisconnect:
                 break
             except Exception as e:
-                await send_ws_error(websocket, "unknown", "bad_json", "Invalid JSON", {"detail": str(e)})
+                if connection.closed: break
+                await send_ws_error(connection, "unknown", "bad_frame", "Expected a text frame", {"detail": str(e)})
+                continue
+            try:
+                incoming_json = decode_json(frame)
+            except ValueError as e:
+                await send_ws_error(connection, "unknown", "bad_json", "Invalid JSON", {"detail": str(e)})
+                continue
+            if not isinstance(incoming_json, dict):
+                await send_ws_error(connection, "unknown", "bad_json", "Expected a JSON object")
                 continue
 
-            operation = (incoming_json or {}).get("operation")
-            data = (incoming_json or {}).get("data") or {}
-
-            if operation == "ping":
-
-                print(f"Received ping from {username}")
-                await send_ws_ack(websocket, "pong")
-
-            elif operation == "create_chat":
-
-                print(f"Creating chat: {data}")
-                await handle_create_chat(websocket, user, data)
-
-            elif operation == "enter_chat":
-
-                print(f"Entering chat: {data}")
-                await handle_enter_chat(websocket, username, data)
-
-            elif operation == "exit_chat":
-
-                print(f"Exiting chat: {data}")
-                await handle_exit_chat(websocket, username, data)
-
-            elif operation == "send_message":
-
-                print(f"Sending message: {data}")
-                await handle_send_message(websocket, username, data)
-
-            elif operation == "join_chat":
-
-                print(f"Joining chat: {data}")
-                await handle_join_chat(websocket, username, data)
-
-            elif operation == "leave_chat":
-
-                print(f"Leaving chat: {data}")
-                await handle_leave_chat(websocket, username, data)
-
-            elif operation == "read_receipt":
-
-                print(f"Received read receipt: {data}")
-                await handle_read_receipt(websocket, data)
-
-            elif operation == "update_chat":
-
-                print(f"Updating chat: {data}")
-                await handle_update_chat(websocket, username, data)
-
-            elif operation == "update_username":
-
-                print(f"UPDATING USERNAME: {data}")
-                await handle_username_update(websocket, username, data)
-                username = data.get("new_username")
-
-            else:
-                await send_ws_error(websocket, operation or "unknown", "unsupported_operation", "Unsupported operation")
+            operation = incoming_json.get("operation")
+            if log.isEnabledFor(logging.DEBUG) and OPERATION_LOG_SAMPLER():
+                log.debug("ws operation", extra={"username": session.username, "operation": operation})
+            # Decoded once here; the pipeline validates declared fields and runs the handler in its lane
+            await pipeline.submit(operation, incoming_json.get("data") or {})
 
     finally:
-        await remove_user_from_active_connections(username)
-        for chat_id, chat_map in list(active_chat_connections.items()):
-            if username in chat_map:
-                chat_map.pop(username, None)
-                if not chat_map:
-                    active_chat_connections.pop(chat_id, None)
+        await pipeline.stop()
+        await connection.stop()
+        await remove_user_from_active_connections(session.username, connection)
@@ -0,0 +1,37 @@
+from fastapi import HTTPException
+from starlette.requests import HTTPConnection
+
+from backend.instances import USER_MANAGER, SESSIONS
+
+
+def get_session_token(connection : HTTPConnection) -> str | None:
+    authorization = connection.headers.get("authorization", "")
+    if authorization.lower().startswith("bearer "):
+        return authorization[7:].strip()
+    # Browsers cannot set headers on a WebSocket handshake, so sockets pass the token in the query string
+    return connection.query_params.get("token")
+
+
+def authenticate(connection : HTTPConnection) -> str | None:
+    claims = SESSIONS.verify(get_session_token(connection))
+    if claims is None:
+        return None
+    # Usernames can change or be re-registered; the session only holds for the account it was issued to
+    user_node = USER_MANAGER.search_for_user(claims["usr"])
+    if user_node is None or user_node.value.id != claims["sub"]:
+        return None
+    return claims["usr"]
+
+
+def require_session(connection : HTTPConnection) -> str:
+    username = authenticate(connection)
+    if username is None:
+        raise HTTPException(status_code=401, detail="Not authenticated.")
+    return username
+
+
+def require_user_session(connection : HTTPConnection) -> str:
+    username = require_session(connection)
+    if username != connection.path_params.get("username"):
+        raise HTTPException(status_code=403, detail="Session does not belong to this user.")
+    return username
@@ -0,0 +1,59 @@
+from backend.utils.json_encoding import encode_json, decode_json
+
+# Field names that recur in nearly every server -> client frame, and the short codes a compact client receives
+# instead. Values are never touched. The table is sent to the client in its connect ack, so it can change freely
+FIELD_CODES = {
+    "operation": "o",
+    "type": "y",
+    "data": "d",
+    "chat_id": "c",
+    "message_id": "i",
+    "sender": "s",
+    "message": "m",
+    "time_sent": "t",
+    "seq": "q",
+    "chat_name": "n",
+    "participants": "p",
+    "participant_permissions": "pp",
+    "username": "u",
+    "can_edit": "ce",
+    "can_delete": "cd",
+    "time_created": "tc",
+    "latest_seq": "ls",
+    "last_message": "lm",
+    "last_message_time": "lt",
+    "last_read_seq": "lr",
+    "unread_count": "uc",
+    "read_seqs": "rs",
+    "read_by": "rb",
+    "messages": "ms",
+    "complete": "cp",
+    "code": "cc",
+    "old_username": "ou",
+}
+
+# Fields whose own keys are usernames, not field names, so only their values are compacted
+KEYED_FIELDS = ("read_seqs", "participant_permissions")
+
+
+def compact_payload(value):
+    if isinstance(value, dict):
+        return {FIELD_CODES.get(key, key): _compact_field(key, item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [compact_payload(item) for item in value]
+    return value
+
+
+def _compact_field(key, value):
+    if key in KEYED_FIELDS and isinstance(value, dict):
+        return {name: compact_payload(item) for name, item in value.items()}
+    return compact_payload(value)
+
+
+def encode_compact(payload) -> str:
+    return encode_json(compact_payload(payload))
+
+
+def compact_frame(frame: str) -> str:
+    # Broadcasts are encoded once in the full form; a worker re-keys each one at most once for all its compact members
+    return encode_compact(decode_json(frame))
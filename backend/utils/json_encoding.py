@@ -0,0 +1,32 @@
+import json
+from datetime import datetime, date
+from uuid import UUID
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def _encode_default(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, UUID):
+        return str(value)
+    if isinstance(value, (set, frozenset, tuple)):
+        return list(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def encode_json(payload) -> str:
+    # Frames are sent as websocket text, so both encoders return str
+    if orjson is not None:
+        return orjson.dumps(payload, default=_encode_default, option=orjson.OPT_NON_STR_KEYS).decode("utf-8")
+    return json.dumps(payload, default=_encode_default, ensure_ascii=False, separators=(",", ":"))
+
+
+def decode_json(frame):
+    # Raises ValueError on malformed input with either decoder (orjson.JSONDecodeError subclasses it)
+    if orjson is not None:
+        return orjson.loads(frame)
+    return json.loads(frame)
@@ -0,0 +1,99 @@
+import itertools
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import time
+
+from backend.utils.json_encoding import encode_json
+
+LOGGER_NAMESPACE = "chatter"
+DEFAULT_SAMPLE_EVERY = 100
+
+# Attributes every LogRecord has; anything else on a record came in through extra= and is a structured field
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "taskName"}
+
+_listener = None
+
+
+def get_logger(component):
+    return logging.getLogger(f"{LOGGER_NAMESPACE}.{component}")
+
+
+class StructuredFormatter(logging.Formatter):
+
+    # "<time> <LEVEL> <logger> <message> key=value ..." by default, or one JSON object per line
+    def __init__(self, json_lines=False):
+        super().__init__()
+        self.json_lines = json_lines
+
+    def format(self, record):
+        fields = {key: value for key, value in vars(record).items() if key not in _RECORD_ATTRIBUTES}
+        timestamp = time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(record.created)) + f".{int(record.msecs):03d}"
+        exception = record.exc_text or (self.formatException(record.exc_info) if record.exc_info else None)
+        if self.json_lines:
+            entry = {"time": timestamp, "level": record.levelname, "logger": record.name, "message": record.getMessage()} | fields
+            if exception:
+                entry["exception"] = exception
+            return encode_json(entry)
+        line = f"{timestamp} {record.levelname} {record.name} {record.getMessage()}"
+        if fields:
+            line += " " + " ".join(f"{key}={value}" for key, value in fields.items())
+        return f"{line}\n{exception}" if exception else line
+
+
+class Sampler:
+
+    # Lets one call in every `every` through, so per-message events cost a counter bump when sampled out
+    def __init__(self, every=DEFAULT_SAMPLE_EVERY):
+        self.every = max(1, every)
+        self._counter = itertools.count()
+
+    def __call__(self):
+        return next(self._counter) % self.every == 0
+
+
+def configure_logging(level=None, json_lines=None):
+    # Callers only pay for putting a record on a queue; formatting and the stdout write happen on the listener thread
+    global _listener
+    if _listener is not None:
+        return
+    level = level or os.environ.get("CHATTER_LOG_LEVEL", "INFO").upper()
+    if json_lines is None:
+        json_lines = os.environ.get("CHATTER_LOG_FORMAT", "").lower() == "json"
+
+    stream_handler = logging.StreamHandler(sys.stderr)
+    stream_handler.setFormatter(StructuredFormatter(json_lines))
+    log_queue = queue.SimpleQueue()
+    _listener = logging.handlers.QueueListener(log_queue, stream_handler)
+    _listener.start()
+
+    logger = logging.getLogger(LOGGER_NAMESPACE)
+    logger.setLevel(level)
+    logger.addHandler(_QueueHandler(log_queue))
+    logger.propagate = False
+
+
+def shutdown_logging():
+    global _listener
+    if _listener is None:
+        return
+    _listener.stop()
+    _listener = None
+    logger = logging.getLogger(LOGGER_NAMESPACE)
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+
+    # The stock handler formats the message on the calling thread; here the record is only frozen
+    # (args merged, exception captured) and the listener's formatter does the rest
+    def prepare(self, record):
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
@@ -0,0 +1,149 @@
+import threading
+import time
+from bisect import bisect_left
+
+# Seconds; wide enough to cover a cached lookup through a full snapshot write
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+def _format_labels(label_names, label_values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(label_names, label_values)]
+    pairs.extend(f'{name}="{value}"' for name, value in extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+
+    def __init__(self, name, description, label_names=()):
+        self.name = name
+        self.description = description
+        self.label_names = tuple(label_names)
+        self.values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            values = list(self.values.items())
+        for label_values, value in values:
+            lines.append(f"{self.name}{_format_labels(self.label_names, label_values)} {_format_value(value)}")
+        return lines
+
+
+class Gauge:
+
+    # Gauges are read from a callback at scrape time, so the hot path never pays for keeping them current
+    def __init__(self, name, description, read, label_names=()):
+        self.name = name
+        self.description = description
+        self.read = read
+        self.label_names = tuple(label_names)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} gauge"]
+        value = self.read()
+        samples = value.items() if isinstance(value, dict) else [((), value)]
+        for label_values, sample in samples:
+            if not isinstance(label_values, tuple):
+                label_values = (label_values,)
+            lines.append(f"{self.name}{_format_labels(self.label_names, label_values)} {_format_value(sample)}")
+        return lines
+
+
+class Histogram:
+
+    def __init__(self, name, description, label_names=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.description = description
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(buckets)
+        # label values -> [per-bucket counts (last one is +Inf), sum]
+        self.values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        bucket = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self.values.get(label_values)
+            if series is None:
+                series = self.values[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][bucket] += 1
+            series[1] += value
+
+    def time(self, *label_values):
+        return _Timer(self, label_values)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            values = [(label_values, list(series[0]), series[1]) for label_values, series in self.values.items()]
+        for label_values, bucket_counts, total in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), bucket_counts):
+                cumulative += count
+                labels = _format_labels(self.label_names, label_values, (("le", bound),))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.label_names, label_values)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class _Timer:
+
+    __slots__ = ("histogram", "label_values", "started")
+
+    def __init__(self, histogram, label_values):
+        self.histogram = histogram
+        self.label_values = label_values
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.started, *self.label_values)
+
+
+class MetricsRegistry:
+
+    def __init__(self):
+        self.metrics = {}
+
+    def counter(self, name, description, label_names=()):
+        return self._register(Counter(name, description, label_names))
+
+    def gauge(self, name, description, read, label_names=()):
+        return self._register(Gauge(name, description, read, label_names))
+
+    def histogram(self, name, description, label_names=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, description, label_names, buckets))
+
+    def _register(self, metric):
+        if metric.name in self.metrics:
+            raise ValueError(f"Metric {metric.name} is already registered.")
+        self.metrics[metric.name] = metric
+        return metric
+
+    def render(self):
+        # Prometheus text exposition format; each metric copies its series under its own lock, so a scrape
+        # never blocks the hot path for longer than a dict copy
+        lines = []
+        for metric in self.metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+METRICS = MetricsRegistry()
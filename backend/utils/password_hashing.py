@@ -0,0 +1,91 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import bcrypt
+
+
+def hash_password(plain_text : str) -> bytes:
+    return bcrypt.hashpw(plain_text.encode('utf-8'), bcrypt.gensalt())
+
+
+def verify_password(plain_text : str, hashed : bytes) -> bool:
+    return bcrypt.checkpw(plain_text.encode('utf-8'), hashed)
+
+
+class PasswordHasherBusy(Exception):
+    pass
+
+
+# Runs bcrypt on a bounded thread pool (bcrypt releases the GIL) so password checks never block the event loop
+class PasswordHasher:
+
+    def __init__(self, max_workers=4, max_queued=64):
+        self.max_workers = max_workers
+        self.max_queued = max_queued
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="password-hasher")
+        self._lock = threading.Lock()
+        self._queued = 0
+        self._running = 0
+        self._completed = 0
+        self._rejected = 0
+        self._total_wait_seconds = 0.0
+        self._max_wait_seconds = 0.0
+        self._total_run_seconds = 0.0
+
+    async def hash_password(self, plain_text : str) -> bytes:
+        return await self._submit(hash_password, plain_text)
+
+    async def check_password(self, plain_text : str, hashed : bytes) -> bool:
+        return await self._submit(verify_password, plain_text, hashed)
+
+    def metrics(self):
+        with self._lock:
+            return {
+                "max_workers": self.max_workers,
+                "max_queued": self.max_queued,
+                "queued": self._queued,
+                "running": self._running,
+                "completed": self._completed,
+                "rejected": self._rejected,
+                "average_wait_ms": self._total_wait_seconds / self._completed * 1000 if self._completed else 0.0,
+                "max_wait_ms": self._max_wait_seconds * 1000,
+                "average_run_ms": self._total_run_seconds / self._completed * 1000 if self._completed else 0.0,
+            }
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
+
+    async def _submit(self, function, *args):
+        with self._lock:
+            if self._queued >= self.max_queued:
+                self._rejected += 1
+                raise PasswordHasherBusy("Too many password operations in progress.")
+            self._queued += 1
+        future = self._executor.submit(self._run, function, args, time.perf_counter())
+        future.add_done_callback(self._forget_if_cancelled)
+        return await asyncio.wrap_future(future)
+
+    def _forget_if_cancelled(self, future):
+        # A request abandoned before its turn never reaches _run
+        if future.cancelled():
+            with self._lock:
+                self._queued -= 1
+
+    def _run(self, function, args, submitted_at):
+        started_at = time.perf_counter()
+        with self._lock:
+            self._queued -= 1
+            self._running += 1
+        try:
+            return function(*args)
+        finally:
+            finished_at = time.perf_counter()
+            with self._lock:
+                self._running -= 1
+                self._completed += 1
+                wait_seconds = started_at - submitted_at
+                self._total_wait_seconds += wait_seconds
+                self._max_wait_seconds = max(self._max_wait_seconds, wait_seconds)
+                self._total_run_seconds += finished_at - started_at
@@ -0,0 +1,83 @@
+import base64
+import hashlib
+import hmac
+import json
+import secrets
+import threading
+import time
+from collections import OrderedDict
+
+
+def _encode(data : bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode("ascii")
+
+
+def _decode(text : str) -> bytes:
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+
+# Signed session tokens: <claims>.<HMAC-SHA256(claims)>. Verified tokens are kept in an LRU so repeat
+# requests skip decoding; nothing here ever touches bcrypt
+class SessionManager:
+
+    def __init__(self, secret=None, ttl_seconds=7 * 24 * 3600, cache_size=10000):
+        # Without a configured secret, sessions only live as long as this process
+        self.secret = secret.encode("utf-8") if isinstance(secret, str) else (secret or secrets.token_bytes(32))
+        self.ttl_seconds = ttl_seconds
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._revoked = {}
+        self._lock = threading.Lock()
+
+    def issue(self, user) -> str:
+        claims = {"sub": user.id, "usr": user.username, "sid": secrets.token_urlsafe(12), "exp": int(time.time()) + self.ttl_seconds}
+        encoded_claims = _encode(json.dumps(claims, separators=(",", ":")).encode("utf-8"))
+        return f"{encoded_claims}.{self._sign(encoded_claims)}"
+
+    def verify(self, token : str | None) -> dict | None:
+        if not token:
+            return None
+        now = time.time()
+        with self._lock:
+            claims = self._cache.get(token)
+            if claims is not None:
+                if claims["exp"] > now:
+                    self._cache.move_to_end(token)
+                    return claims
+                del self._cache[token]
+                return None
+
+        claims = self._decode_token(token)
+        if claims is None or claims["exp"] <= now:
+            return None
+        with self._lock:
+            if claims["sid"] in self._revoked:
+                return None
+            self._cache[token] = claims
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return claims
+
+    def revoke(self, token : str | None) -> None:
+        claims = self._decode_token(token) if token else None
+        if claims is None:
+            return
+        with self._lock:
+            self._cache.pop(token, None)
+            self._revoked[claims["sid"]] = claims["exp"]
+            now = time.time()
+            for session_id, expires_at in list(self._revoked.items()):
+                if expires_at <= now:
+                    del self._revoked[session_id]
+
+    def _sign(self, encoded_claims : str) -> str:
+        return _encode(hmac.new(self.secret, encoded_claims.encode("ascii"), hashlib.sha256).digest())
+
+    def _decode_token(self, token : str) -> dict | None:
+        encoded_claims, _, signature = token.partition(".")
+        try:
+            if not signature or not hmac.compare_digest(signature.encode("ascii"), self._sign(encoded_claims).encode("ascii")):
+                return None
+            return json.loads(_decode(encoded_claims))
+        except ValueError:
+            return None
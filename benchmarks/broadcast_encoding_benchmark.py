@@ -0,0 +1,71 @@
+import json
+import os
+import sys
+import time
+from datetime import date, datetime
+from uuid import UUID, uuid4
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from backend.utils.formatting import format_chat_dict
+from backend.utils.json_encoding import encode_json, orjson
+
+
+class NullConnection:
+
+    def __init__(self):
+        self.frames = 0
+
+    def enqueue(self, frame):
+        self.frames += 1
+
+
+def json_sanitize(x):
+    if isinstance(x, (datetime, date)):
+        return x.isoformat()
+    if isinstance(x, UUID):
+        return str(x)
+    if isinstance(x, dict):
+        return {k: json_sanitize(v) for k, v in x.items()}
+    if isinstance(x, (list, tuple, set)):
+        return [json_sanitize(v) for v in x]
+    return x
+
+
+def make_payload(member_count):
+    message = format_chat_dict(str(uuid4()), "member_0", "hey everyone, are we still on for tonight?")
+    return {"operation": "message"} | message | {"unread_messages_by": [f"member_{index}" for index in range(member_count)]}
+
+
+def broadcast_per_recipient(payload, connections):
+    # Previous path: sanitize, then WebSocket.send_json re-encodes the payload for every recipient
+    payload = json_sanitize(payload)
+    for connection in connections:
+        connection.enqueue(json.dumps(payload, separators=(",", ":"), ensure_ascii=False))
+
+
+def broadcast_encoded_once(payload, connections):
+    frame = encode_json(payload)
+    for connection in connections:
+        connection.enqueue(frame)
+
+
+def cpu_per_message(broadcast, member_count, message_count):
+    payload = make_payload(member_count)
+    connections = [NullConnection() for _ in range(member_count)]
+    start = time.process_time()
+    for _ in range(message_count):
+        broadcast(payload, connections)
+    return (time.process_time() - start) / message_count
+
+
+def main(message_count=200):
+    print(f"encoder: {'orjson' if orjson is not None else 'json'}")
+    for member_count in (10, 100, 1000):
+        before = cpu_per_message(broadcast_per_recipient, member_count, message_count)
+        after = cpu_per_message(broadcast_encoded_once, member_count, message_count)
+        print(f"{member_count:>5} members  per-recipient {before * 1e6:>10,.1f} us/message  encode-once {after * 1e6:>8,.1f} us/message  {before / after:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main(*(int(argument) for argument in sys.argv[1:2]))
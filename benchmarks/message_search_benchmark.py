@@ -0,0 +1,71 @@
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from backend.models.search.message_index import MessageIndex, tokenize
+
+
+def build_vocabulary(size):
+    # Zipf-like word frequencies, so common words have long postings lists like real chat text
+    words = [f"w{index}" for index in range(size)]
+    cumulative_weights = []
+    total = 0.0
+    for rank in range(1, size + 1):
+        total += 1.0 / rank
+        cumulative_weights.append(total)
+    return words, cumulative_weights
+
+
+def build_index(message_count, chat_count, words, cumulative_weights, words_per_message=8):
+    index = MessageIndex()
+    chat_texts = {f"chat_{chat:05d}": [] for chat in range(chat_count)}
+    chat_ids = list(chat_texts)
+    for message in range(message_count):
+        chat_id = chat_ids[message % chat_count]
+        text = " ".join(random.choices(words, cum_weights=cumulative_weights, k=words_per_message))
+        texts = chat_texts[chat_id]
+        texts.append(text)
+        index.add(chat_id, len(texts), text)
+    return index, chat_texts
+
+
+def scan_search(chat_ids, chat_texts, query):
+    # What a search costs without an index: tokenize every message of every chat the user is in
+    terms = set(tokenize(query))
+    return [(chat_id, seq) for chat_id in chat_ids for seq, text in enumerate(chat_texts[chat_id], 1) if terms.issubset(tokenize(text))]
+
+
+def time_queries(search, queries):
+    start = time.perf_counter()
+    for query in queries:
+        search(query)
+    return (time.perf_counter() - start) / len(queries)
+
+
+def main(message_count=10_000_000, chat_count=20_000, user_chat_count=50, query_count=200):
+    words, cumulative_weights = build_vocabulary(50_000)
+    start = time.perf_counter()
+    index, chat_texts = build_index(message_count, chat_count, words, cumulative_weights)
+    build_seconds = time.perf_counter() - start
+
+    user_chat_ids = random.sample(list(chat_texts), user_chat_count)
+    queries = {
+        "rare term": [random.choice(words[1000:]) for _ in range(query_count)],
+        "common term": [random.choice(words[:10]) for _ in range(query_count)],
+        "two terms": [f"{random.choice(words[:100])} {random.choice(words[100:5000])}" for _ in range(query_count)],
+    }
+    user_message_count = sum(len(chat_texts[chat_id]) for chat_id in user_chat_ids)
+
+    print(f"{message_count:,} messages in {chat_count:,} chats indexed in {build_seconds:.1f}s ({message_count / build_seconds:,.0f} messages/s)")
+    print(f"Searching a user's {user_chat_count} chats ({user_message_count:,} messages), top 20 hits")
+    for label, query_list in queries.items():
+        index_seconds = time_queries(lambda query: index.search(user_chat_ids, query, 0, 20), query_list)
+        scan_seconds = time_queries(lambda query: scan_search(user_chat_ids, chat_texts, query), query_list[:5])
+        print(f"{label:<12}: index {index_seconds * 1e3:>8.3f} ms/query, scan {scan_seconds * 1e3:>9.1f} ms/query")
+
+
+if __name__ == "__main__":
+    main(*(int(argument) for argument in sys.argv[1:5]))
@@ -0,0 +1,58 @@
+import gc
+import os
+import sys
+import time
+import tracemalloc
+import uuid
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from backend.models.linked_list.linked_list import LinkedList
+from backend.models.message_store.message_store import MessageStore
+
+CHAT_ID = str(uuid.uuid4())
+START = datetime(2025, 1, 1, tzinfo=timezone.utc)
+
+
+def make_message(index):
+    return {
+        "message_id": str(uuid.uuid4()),
+        "type": "message",
+        # Fresh string objects, as json.loads produces for every incoming payload
+        "chat_id": CHAT_ID.encode().decode(),
+        "sender": f"user_{index % 50}",
+        "message": f"message number {index}",
+        "time_sent": (START + timedelta(seconds=index)).isoformat(),
+    }
+
+
+def measure(container, message_count):
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    for index in range(message_count):
+        container.append(make_message(index))
+    elapsed = time.perf_counter() - start
+    gc.collect()
+    allocated, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return allocated, elapsed
+
+
+def report(name, message_count, allocated, elapsed):
+    print(f"{name:<12} {message_count:>12,} messages  {allocated / 2 ** 20:>10,.1f} MiB  {allocated / message_count:>7,.0f} B/message  {elapsed:>7.1f} s")
+
+
+def main(message_count=10_000_000, baseline_count=1_000_000):
+    store = MessageStore(CHAT_ID)
+    report("MessageStore", message_count, *measure(store, message_count))
+    del store
+
+    # The LinkedList of dicts is measured on a smaller sample; its cost per message is constant
+    linked_list = LinkedList()
+    report("LinkedList", baseline_count, *measure(linked_list, baseline_count))
+
+
+if __name__ == "__main__":
+    main(*(int(argument) for argument in sys.argv[1:3]))
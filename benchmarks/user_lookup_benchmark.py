@@ -0,0 +1,41 @@
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from backend.models.databases.user_database import UserDatabase
+
+
+def build_database(directory, user_count):
+    database = UserDatabase(os.path.join(directory, "bench_users.pkl"))
+    usernames = sorted(f"user_{index:07d}" for index in range(user_count))
+    database.users.bulk_load((username, {"username": username}) for username in usernames)
+    database.user_index = {node.key: node for node in database.users.nodes()}
+    return database, usernames
+
+
+def time_lookups(lookup, keys):
+    start = time.perf_counter()
+    for key in keys:
+        lookup(key)
+    return time.perf_counter() - start
+
+
+def main(user_count=1_000_000, lookup_count=1_000_000):
+    with tempfile.TemporaryDirectory() as directory:
+        database, usernames = build_database(directory, user_count)
+        keys = [random.choice(usernames) for _ in range(lookup_count)]
+
+        tree_seconds = time_lookups(database.users.search, keys)
+        index_seconds = time_lookups(database.search_for_user, keys)
+
+        print(f"{user_count:,} users, {lookup_count:,} random lookups (tree height {database.users.root.height})")
+        print(f"AVL tree search : {lookup_count / tree_seconds:>12,.0f} lookups/s")
+        print(f"Hash index      : {lookup_count / index_seconds:>12,.0f} lookups/s")
+
+
+if __name__ == "__main__":
+    main(*(int(argument) for argument in sys.argv[1:3]))
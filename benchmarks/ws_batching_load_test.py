@@ -0,0 +1,72 @@
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from backend.models.connections.client_connection import ClientConnection
+from backend.utils.formatting import format_chat_dict
+from backend.utils.json_encoding import encode_json, decode_json
+
+SEND_SECONDS = 0.00005  # Rough cost of one socket write, so frame count shows up in the writer's time
+
+
+class CountingSocket:
+
+    def __init__(self):
+        self.frames = 0
+        self.events = 0
+        self.latencies = []
+
+    async def send_text(self, frame):
+        await asyncio.sleep(SEND_SECONDS)
+        received = time.perf_counter()
+        events = decode_json(frame)
+        if not isinstance(events, list):
+            events = [events]
+        self.frames += 1
+        self.events += len(events)
+        self.latencies.extend(received - event["sent_at"] for event in events)
+
+
+async def run(batch_window, member_count, burst_count, burst_size, message_gap, burst_gap):
+    # A bot pastes burst_size messages message_gap apart, burst_count times, into a chat with member_count sockets open
+    sockets = [CountingSocket() for _ in range(member_count)]
+    connections = [ClientConnection(socket, 1024, batch_window=batch_window) for socket in sockets]
+    for connection in connections:
+        connection.start()
+
+    started = time.perf_counter()
+    for _ in range(burst_count):
+        for _ in range(burst_size):
+            message = format_chat_dict("chat", "bot", "build #4821 finished: 312 passed, 0 failed")
+            frame = encode_json({"operation": "message", "sent_at": time.perf_counter()} | message)
+            for connection in connections:
+                connection.enqueue(frame)
+            await asyncio.sleep(message_gap)
+        await asyncio.sleep(burst_gap)
+    while any(socket.events < burst_count * burst_size for socket in sockets):
+        await asyncio.sleep(0.001)
+    elapsed = time.perf_counter() - started
+
+    for connection in connections:
+        await connection.stop()
+    frames = sum(socket.frames for socket in sockets)
+    events = sum(socket.events for socket in sockets)
+    latencies = sorted(latency for socket in sockets for latency in socket.latencies)
+    return frames, events, elapsed, latencies[len(latencies) // 2], latencies[int(len(latencies) * 0.99)]
+
+
+def main(member_count=50, burst_count=10, burst_size=50):
+    print(f"{member_count} members, {burst_count} bursts of {burst_size} messages")
+    baseline = None
+    for label, batch_window in (("unbatched", None), ("batch 5ms", 0.005), ("batch 10ms", 0.01), ("batch 20ms", 0.02)):
+        frames, events, elapsed, p50, p99 = asyncio.run(run(batch_window, member_count, burst_count, burst_size, 0.001, 0.05))
+        baseline = baseline or frames
+        print(f"{label:>11}  {frames:>7,} frames  {frames / elapsed:>9,.0f} frames/s  {events / frames:>5.1f} events/frame"
+              f"  {baseline / frames:>5.1f}x fewer  p50 {p50 * 1e3:>6.1f} ms  p99 {p99 * 1e3:>6.1f} ms")
+
+
+if __name__ == "__main__":
+    main(*(int(argument) for argument in sys.argv[1:4]))
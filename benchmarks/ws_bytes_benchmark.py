@@ -0,0 +1,87 @@
+import os
+import random
+import sys
+import zlib
+from uuid import uuid4
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from backend.models.chat import Chat
+from backend.models.user import User
+from backend.utils.compact_encoding import encode_compact
+from backend.utils.formatting import format_chat_dict, format_chat_dict_for_json
+from backend.utils.json_encoding import encode_json
+
+LINES = ["lol", "ok see you there", "did anyone push the fix for the login page yet?", "brb",
+         "I think the deploy went out at 3 but the cache is still stale on my end", "nice", "haha yes", "on my way"]
+
+
+def session_events(member_count=8, message_count=300, own_message_count=30, edit_count=3, resume_size=50):
+    # What one member of a busy group chat receives over a session, built with the same models the server uses
+    users = [User(str(uuid4()), f"member_{index}", b"", True, is_hashed=True) for index in range(member_count)]
+    viewer = users[1].username
+    permissions = {user.username: {"username": user.username, "can_edit": False, "can_delete": False} for user in users[1:]}
+    chat = Chat(str(uuid4()), users[0], [], permissions, "weekend plans")
+    chat_id = chat.chat_id
+
+    events = [{"operation": "chat_created"} | chat.get_chat_overview()]
+    for index in range(message_count):
+        sender = viewer if index % (message_count // own_message_count) == 0 else random.choice(users).username
+        message = format_chat_dict(chat_id, sender, random.choice(LINES))
+        chat.add_message(message)
+        events.append({"operation": "message"} | message)
+        if sender == viewer:
+            ack = format_chat_dict_for_json(message["message_id"], "message", chat_id, sender, message["message"], message["time_sent"])
+            events.append({"type": "ack", "operation": "send_message", "data": ack | {"seq": message["seq"]}})
+        if index % 10 == 0:
+            reader = random.choice(users).username
+            chat.mark_as_read_by(reader)
+            events.append({"operation": "read_receipt", "chat_id": chat_id, "read_by": [reader], "read_seqs": {reader: chat.read_seqs[reader]}})
+        if index % (message_count // edit_count) == 0:
+            events.append({"operation": "update_chat"} | chat.get_chat_overview())
+
+    messages, _ = chat.get_messages_after(chat.latest_seq - resume_size, resume_size)
+    events.append({"operation": "resume", "chat_id": chat_id, "messages": messages, "latest_seq": chat.latest_seq, "complete": True})
+    return events
+
+
+def frame_header_bytes(payload_length):
+    # Server frames are unmasked: 2 bytes, plus 2 or 8 for the extended length
+    return 2 if payload_length < 126 else 4 if payload_length < 65536 else 10
+
+
+def wire_bytes(frames, deflate):
+    # permessage-deflate as uvicorn's websockets backend negotiates it: context takeover, 12 window bits, memLevel 5
+    compressor = zlib.compressobj(wbits=-12, memLevel=5)
+    total = 0
+    for frame in frames:
+        payload = frame.encode("utf-8")
+        if deflate:
+            payload = (compressor.compress(payload) + compressor.flush(zlib.Z_SYNC_FLUSH))[:-4]
+        total += len(payload) + frame_header_bytes(len(payload))
+    return total
+
+
+def batched(frames, batch_size):
+    # The batch capability coalesces whatever is queued within its window; a fixed group size stands in for that here
+    return ["[" + ",".join(frames[index:index + batch_size]) + "]" if batch_size > 1 else frames[index]
+            for index in range(0, len(frames), batch_size)]
+
+
+def main(message_count=300):
+    random.seed(7)
+    events = session_events(message_count=message_count)
+    encodings = {"json": [encode_json(event) for event in events], "compact": [encode_compact(event) for event in events]}
+    baseline = wire_bytes(encodings["json"], deflate=False)
+    print(f"{len(events)} events in one session")
+    for batch_size in (1, 5):
+        for name, frames in encodings.items():
+            frames = batched(frames, batch_size)
+            for deflate in (False, True):
+                size = wire_bytes(frames, deflate)
+                label = f"{name}{' batch' + str(batch_size) if batch_size > 1 else ''}{' +deflate' if deflate else ''}"
+                print(f"{label:>24}  {len(frames):>5} frames  {size:>9,} bytes  {size / len(events):>7.1f} bytes/event  {baseline / size:>5.1f}x smaller")
+
+
+if __name__ == "__main__":
+    main(*(int(argument) for argument in sys.argv[1:2]))
@@ -6,25 +6,28 @@ export const useUserStore = defineStore(
   () => {
     const username = ref('')
     const isLoggedIn = ref(false)
+    const token = ref('')
 
-    function login(user) {
+    function login(user, sessionToken) {
       username.value = user
+      token.value = sessionToken
       isLoggedIn.value = true
     }
 
     function logout() {
       username.value = ''
+      token.value = ''
       isLoggedIn.value = false
     }
 
-    return { username, isLoggedIn, login, logout }
+    return { username, isLoggedIn, token, login, logout }
   },
   {
     // pinia-plugin-persistedstate config
     persist: {
       key: 'bruinsma-user',
       storage: localStorage,        // use sessionStorage if you prefer tab-only
-      paths: ['username', 'isLoggedIn'],
+      paths: ['username', 'isLoggedIn', 'token'],
     },
   }
 )
@@ -2,6 +2,7 @@ import {defineStore} from 'pinia'
 import {ref} from 'vue'
 import {fetchAPI, getWebSocketUrl} from '@/utils/api.js'
 import {
+  expandCompactFields,
   formatChatUpdate,
   formatMessage,
   formatNewDashboardChat,
@@ -9,6 +10,9 @@ import {
   formatWebSocketPayload
 } from '@/utils/formatting.js'
 import {BASE_API_LINK} from '@/stores/variables.js'
+import {useUserStore} from '@/stores/userStore.js'
+
+const DASHBOARD_PAGE_SIZE = 30
 
 export const useChatStore = defineStore('chat', () => {
   const webSocket = ref(null)
@@ -17,22 +21,51 @@ export const useChatStore = defineStore('chat', () => {
 
   const dashboardChats = ref([])
   const activeChatMessageStore = ref({})
+  const olderMessagesCursor = ref(null)
+  // Offset of the next dashboard page, or null once every chat is listed
+  const dashboardCursor = ref(null)
+  let loadingDashboardPage = false
 
   const activeChatID = ref(null)
   const activeChatIndex = ref(-1)
   const showChatInfo = ref(false)
 
+  let shouldReconnect = false
+  let reconnectAttempts = 0
+  let reconnectTimer = null
+  // Set from the connect ack when the server grants the compact capability
+  let fieldNames = null
+  let keyedFields = null
+
   function connect(username) {
     if (!username) return
     if (webSocket.value && isOpen.value) return
 
     user.value = username
-    const wsUrl = getWebSocketUrl(`/ws/${username}`)
+    shouldReconnect = true
+    const resuming = reconnectAttempts > 0
+    // Browsers cannot send headers on the handshake, so the session token rides in the query string
+    const wsUrl = getWebSocketUrl(`/ws/${username}?token=${encodeURIComponent(useUserStore().token)}&capabilities=batch,compact`)
     webSocket.value = new WebSocket(wsUrl)
+    fieldNames = null
 
     webSocket.value.onopen = function () {
       isOpen.value = true
       // console.log('WebSocket connection opened')
+      if (resuming) {
+        // After a network blip only the messages missed while disconnected are replayed
+        if (activeChatID.value !== null) webSocket.value.send(formatWebSocketPayload('enter_chat', { chat_id: activeChatID.value }))
+        resumeChats()
+      }
+      reconnectAttempts = 0
+    }
+
+    webSocket.value.onclose = function () {
+      isOpen.value = false
+      if (!shouldReconnect) return
+      const delay = Math.min(1000 * 2 ** reconnectAttempts, 30000)
+      reconnectAttempts += 1
+      reconnectTimer = setTimeout(() => connect(user.value), delay)
     }
 
     webSocket.value.onmessage = async (event) => {
@@ -50,102 +83,129 @@ export const useChatStore = defineStore('chat', () => {
         return
       }
 
-      const operation = incomingJSON.operation
+      // With the batch capability one frame may carry several events, oldest first
+      const events = Array.isArray(incomingJSON) ? incomingJSON : [incomingJSON]
+      events.forEach(event => handleEvent(fieldNames ? expandCompactFields(event, fieldNames, keyedFields) : event))
+    }
+  }
 
-      if (operation === 'enter_chat') {
+  function handleEvent(incomingJSON) {
+    const operation = incomingJSON.operation
 
-        const chatID = incomingJSON.data.chat_id
-        if (chatID !== activeChatID.value) { exitChat(activeChatID.value) }
+    if (operation === 'connect') {
 
-      } else if (operation === 'message') {
+      // Always sent in full form; everything after it uses the codes it lists
+      const fieldCodes = incomingJSON.data.field_codes
+      if (!fieldCodes) return
+      fieldNames = Object.fromEntries(Object.entries(fieldCodes).map(([field, code]) => [code, field]))
+      keyedFields = new Set(incomingJSON.data.keyed_fields)
 
-        if (activeChatID.value !== null && activeChatID.value === incomingJSON.chat_id) activeChatMessageStore.value.push(incomingJSON)
-        const unreadMessagesBy = incomingJSON.unread_messages_by
-        updateDashboardChatPreviews(incomingJSON, unreadMessagesBy)
+    } else if (operation === 'enter_chat') {
 
-      } else if (operation === 'chat_created') {
+      const chatID = incomingJSON.data.chat_id
+      if (chatID !== activeChatID.value) { exitChat(activeChatID.value) }
 
-        const newDashboardChat = formatNewDashboardChat(
-          incomingJSON.chat_id,
-          incomingJSON.chat_name,
-          incomingJSON.last_message,
-          incomingJSON.last_message_time,
-          incomingJSON.participants,
-          incomingJSON.time_created,
-          incomingJSON.unread_messages_by,
-          incomingJSON.participant_permissions,
-        )
-        dashboardChats.value.unshift(newDashboardChat)
+    } else if (operation === 'message') {
 
-      } else if (operation === 'read_receipt') {
+      receiveMessage(incomingJSON)
 
-        const chatId = incomingJSON.chat_id
-        const chatIndex = findChatIndex(chatId)
-        if (chatIndex === -1) return
-        dashboardChats.value[chatIndex].unread_messages_by = incomingJSON.unread_messages_by
+    } else if (operation === 'resume') {
 
-      } else if (operation === 'update_chat') {
+      // Missed messages arrive oldest first, one page per chat; ask for the next page until caught up
+      const chatID = incomingJSON.chat_id
+      incomingJSON.messages.forEach(message => receiveMessage(message))
+      if (chatID === activeChatID.value && incomingJSON.messages.length > 0) sendReadReceipt()
 
-        const chatID = incomingJSON.chat_id
-        const newChatName = incomingJSON.chat_name
-        const updatedParticipantList = incomingJSON.participants
-        const updatedPermissionsList = incomingJSON.participant_permissions
+      const chatIndex = findChatIndex(chatID)
+      if (!incomingJSON.complete && chatIndex !== -1) resumeChats([dashboardChats.value[chatIndex]])
 
-        const chatIndex = findChatIndex(chatID)
-        if (chatIndex === -1) {
-          const newChat = formatNewDashboardChat(chatID, newChatName, incomingJSON.last_message, incomingJSON.last_message_time, updatedParticipantList, incomingJSON.time_created, incomingJSON.unread_messages_by, updatedPermissionsList,)
-          dashboardChats.value.unshift(newChat)
-          return
-        }
+    } else if (operation === 'chat_created') {
 
-        dashboardChats.value[chatIndex].chat_name = newChatName
-        dashboardChats.value[chatIndex].participants = updatedParticipantList
-        dashboardChats.value[chatIndex].participant_permissions = updatedPermissionsList
+      const newDashboardChat = formatNewDashboardChat(
+        incomingJSON.chat_id,
+        incomingJSON.chat_name,
+        incomingJSON.last_message,
+        incomingJSON.last_message_time,
+        incomingJSON.participants,
+        incomingJSON.time_created,
+        incomingJSON.latest_seq,
+        incomingJSON.read_seqs?.[user.value] ?? 0,
+        incomingJSON.participant_permissions,
+      )
+      dashboardChats.value.unshift(newDashboardChat)
 
-        if (!updatedParticipantList.includes(user.value)){
-          dashboardChats.value.splice(chatIndex, 1)
-          activeChatID.value = null
-          activeChatMessageStore.value = []
-        }
+    } else if (operation === 'read_receipt') {
 
-      } else if (operation === 'leave_chat') {
+      // Receipts arrive batched per chat with the read cursor of each user who just caught up
+      const chatId = incomingJSON.chat_id
+      const chatIndex = findChatIndex(chatId)
+      if (chatIndex === -1) return
+      const readSeq = incomingJSON.read_seqs?.[user.value]
+      if (readSeq === undefined) return
+      const chat = dashboardChats.value[chatIndex]
+      chat.last_read_seq = Math.max(chat.last_read_seq, readSeq)
+      chat.unread_count = Math.max(0, chat.latest_seq - chat.last_read_seq)
 
-        const chatID = incomingJSON.data.chat_id
-        const chatIndex = findChatIndex(chatID)
-        if (chatIndex === -1) return
+    } else if (operation === 'update_chat') {
 
+      const chatID = incomingJSON.chat_id
+      const newChatName = incomingJSON.chat_name
+      const updatedParticipantList = incomingJSON.participants
+      const updatedPermissionsList = incomingJSON.participant_permissions
+
+      const chatIndex = findChatIndex(chatID)
+      if (chatIndex === -1) {
+        const newChat = formatNewDashboardChat(chatID, newChatName, incomingJSON.last_message, incomingJSON.last_message_time, updatedParticipantList, incomingJSON.time_created, incomingJSON.latest_seq, incomingJSON.read_seqs?.[user.value] ?? 0, updatedPermissionsList,)
+        dashboardChats.value.unshift(newChat)
+        return
+      }
+
+      dashboardChats.value[chatIndex].chat_name = newChatName
+      dashboardChats.value[chatIndex].participants = updatedParticipantList
+      dashboardChats.value[chatIndex].participant_permissions = updatedPermissionsList
+
+      if (!updatedParticipantList.includes(user.value)){
         dashboardChats.value.splice(chatIndex, 1)
-        if (activeChatID.value === chatID) {
-          activeChatID.value = null
-          activeChatMessageStore.value = []
-        }
+        activeChatID.value = null
+        activeChatMessageStore.value = []
+      }
 
-      } else if (operation === 'update_user') {
+    } else if (operation === 'leave_chat') {
 
-        const chatID = incomingJSON.data.chat_id
-        const oldUsername = incomingJSON.old_username
-        const newUsername = incomingJSON.username
+      const chatID = incomingJSON.data.chat_id
+      const chatIndex = findChatIndex(chatID)
+      if (chatIndex === -1) return
 
-        if (chatID === null || chatID === undefined) return
-        if (oldUsername === null || oldUsername === undefined) return
-        if (newUsername === null || newUsername === undefined) return
-        if (newUsername === user.value) return
+      dashboardChats.value.splice(chatIndex, 1)
+      if (activeChatID.value === chatID) {
+        activeChatID.value = null
+        activeChatMessageStore.value = []
+      }
 
-        const chatIndex = findChatIndex(chatID)
-        if (chatIndex === -1) return
+    } else if (operation === 'update_user') {
 
-        const oldParticipantUsernameIndex = dashboardChats.value[chatIndex].participants.indexOf(oldUsername)
-        if (oldParticipantUsernameIndex !== -1)  dashboardChats.value[chatIndex].participants.splice(oldParticipantUsernameIndex, 1, newUsername)
+      const chatID = incomingJSON.data.chat_id
+      const oldUsername = incomingJSON.old_username
+      const newUsername = incomingJSON.username
 
-        const oldReadReceiptUsernameIndex = dashboardChats.value[chatIndex].unread_messages_by.indexOf(oldUsername)
-        if (oldReadReceiptUsernameIndex !== -1)  dashboardChats.value[chatIndex].unread_messages_by.splice(oldReadReceiptUsernameIndex, 1, newUsername)
+      if (chatID === null || chatID === undefined) return
+      if (oldUsername === null || oldUsername === undefined) return
+      if (newUsername === null || newUsername === undefined) return
+      if (newUsername === user.value) return
 
-      }
+      const chatIndex = findChatIndex(chatID)
+      if (chatIndex === -1) return
+
+      const oldParticipantUsernameIndex = dashboardChats.value[chatIndex].participants.indexOf(oldUsername)
+      if (oldParticipantUsernameIndex !== -1)  dashboardChats.value[chatIndex].participants.splice(oldParticipantUsernameIndex, 1, newUsername)
 
     }
   }
 
   function disconnect() {
+    shouldReconnect = false
+    reconnectAttempts = 0
+    clearTimeout(reconnectTimer)
     if (webSocket.value && isOpen.value) {
       webSocket.value.close()
       isOpen.value = false
@@ -198,6 +258,20 @@ export const useChatStore = defineStore('chat', () => {
     return dashboardChats.value.findIndex(chat => chat.chat_id === chatID)
   }
 
+  function receiveMessage(message) {
+    const chatIndex = findChatIndex(message.chat_id)
+    // A message delivered live while a resume was in flight can be replayed again; sequence numbers spot the repeat
+    if (chatIndex !== -1 && message.seq <= dashboardChats.value[chatIndex].latest_seq) return
+    if (activeChatID.value !== null && activeChatID.value === message.chat_id) activeChatMessageStore.value.push(message)
+    updateDashboardChatPreviews(message)
+  }
+
+  function resumeChats(chats = dashboardChats.value) {
+    if (!verifyWebSocket() || chats.length === 0) return
+    const lastSeqs = Object.fromEntries(chats.map(chat => [chat.chat_id, chat.latest_seq ?? 0]))
+    webSocket.value.send(formatWebSocketPayload('resume', lastSeqs))
+  }
+
   function sendMessage(chatID, senderUsername, message) {
     if (message.trim() === '') return
     if (verifyWebSocket()) {
@@ -215,11 +289,27 @@ export const useChatStore = defineStore('chat', () => {
       const url = `${BASE_API_LINK}/chats/user/${user.value}/chats/${chatID}`
       const response = await fetchAPI(url)
       activeChatMessageStore.value = response.messages || []
+      olderMessagesCursor.value = response.next_before_message_id ?? null
     } catch (error) {
       console.error('Error fetching messages:', error)
     }
   }
 
+  async function fetchOlderMessages() {
+    const chatID = activeChatID.value
+    const cursor = olderMessagesCursor.value
+    if (chatID === null || chatID === undefined || cursor === null) return
+    try {
+      const url = `${BASE_API_LINK}/chats/user/${user.value}/chats/${chatID}?before_message_id=${encodeURIComponent(cursor)}`
+      const response = await fetchAPI(url)
+      if (chatID !== activeChatID.value) return
+      activeChatMessageStore.value = [...(response.messages || []), ...activeChatMessageStore.value]
+      olderMessagesCursor.value = response.next_before_message_id ?? null
+    } catch (error) {
+      console.error('Error fetching older messages:', error)
+    }
+  }
+
   async function sendReadReceipt(){
     const chatID = activeChatID.value
     if (chatID === null || chatID === undefined) return
@@ -235,20 +325,35 @@ export const useChatStore = defineStore('chat', () => {
   async function fetchDashboardChatPreviews() {
     if (user.value === null || user.value === undefined) return
     try {
-      const url = `${BASE_API_LINK}/chats/user/${user.value}/chats`
+      // The server returns chats most recently active first; later pages load as the list is scrolled
+      const url = `${BASE_API_LINK}/chats/user/${user.value}/chats?offset=0&limit=${DASHBOARD_PAGE_SIZE}`
       const response = await fetchAPI(url)
-      dashboardChats.value = [...(response.chats ?? [])].sort((a, b) => {
-        const ta = Date.parse(a.last_message_time ?? a.time_created ?? 0) || 0
-        const tb = Date.parse(b.last_message_time ?? b.time_created ?? 0) || 0
-        if (tb !== ta) return tb - ta
-        return (a.chat_name || '').localeCompare(b.chat_name || '')
-      })
+      dashboardChats.value = response.chats ?? []
+      dashboardCursor.value = response.next_offset ?? null
+    } catch (error) {
+      console.log(error)
+    }
+  }
+
+  async function fetchMoreDashboardChats() {
+    const offset = dashboardCursor.value
+    if (user.value === null || user.value === undefined || offset === null || loadingDashboardPage) return
+    loadingDashboardPage = true
+    try {
+      const url = `${BASE_API_LINK}/chats/user/${user.value}/chats?offset=${offset}&limit=${DASHBOARD_PAGE_SIZE}`
+      const response = await fetchAPI(url)
+      // Activity since the previous page can move a chat across the page boundary, so skip ones already listed
+      const listedChatIDs = new Set(dashboardChats.value.map(chat => chat.chat_id))
+      dashboardChats.value.push(...(response.chats ?? []).filter(chat => !listedChatIDs.has(chat.chat_id)))
+      dashboardCursor.value = response.next_offset ?? null
     } catch (error) {
       console.log(error)
+    } finally {
+      loadingDashboardPage = false
     }
   }
 
-  function updateDashboardChatPreviews(newMessageInfo, unreadMessagesBy) {
+  function updateDashboardChatPreviews(newMessageInfo) {
     const newMessageChatID = newMessageInfo.chat_id
 
     const chatIndex = findChatIndex(newMessageChatID)
@@ -257,7 +362,12 @@ export const useChatStore = defineStore('chat', () => {
     if (chatIndex !== 0) pushChatToTop(chatIndex)
     dashboardChats.value[0].last_message = newMessageInfo.message
     dashboardChats.value[0].last_message_time = newMessageInfo.time_sent
-    dashboardChats.value[0].unread_messages_by = unreadMessagesBy
+
+    // The server marks the sender and anyone viewing the chat as read when the message lands
+    const chat = dashboardChats.value[0]
+    chat.latest_seq = newMessageInfo.seq ?? chat.latest_seq + 1
+    if (newMessageInfo.sender === user.value || activeChatID.value === newMessageChatID) chat.last_read_seq = chat.latest_seq
+    chat.unread_count = Math.max(0, chat.latest_seq - chat.last_read_seq)
   }
 
   function pushChatToTop(chatIndex) {
@@ -305,13 +415,15 @@ export const useChatStore = defineStore('chat', () => {
   }
 
   function resetChatStore() {
-    if (verifyWebSocket()) disconnect()
+    disconnect()
     webSocket.value = null
     isOpen.value = false
     user.value = null
     activeChatID.value = null
     dashboardChats.value = []
     activeChatMessageStore.value = {}
+    olderMessagesCursor.value = null
+    dashboardCursor.value = null
   }
 
   return {
@@ -320,6 +432,8 @@ export const useChatStore = defineStore('chat', () => {
     user,
     dashboardChats,
     activeChatMessageStore,
+    olderMessagesCursor,
+    dashboardCursor,
     activeChatID,
     activeChatIndex,
     showChatInfo,
@@ -332,9 +446,12 @@ export const useChatStore = defineStore('chat', () => {
     updateActiveChatID,
     findChatIndex,
     sendMessage,
+    resumeChats,
     fetchChatMessages,
+    fetchOlderMessages,
     sendReadReceipt,
     fetchDashboardChatPreviews,
+    fetchMoreDashboardChats,
     updateDashboardChatPreviews,
     pushChatToTop,
     toggleShowChatInfo,
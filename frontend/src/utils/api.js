@@ -1,4 +1,17 @@
 import {BASE_API_LINK} from "@/stores/variables.js";
+import {useUserStore} from "@/stores/userStore.js";
+import router from "@/router/index.js";
+
+function authHeaders() {
+  const token = useUserStore().token
+  return token ? { 'Authorization': `Bearer ${token}` } : {}
+}
+
+async function handleUnauthorized(response) {
+  if (response.status !== 401) return
+  useUserStore().logout()
+  await router.push('/')
+}
 
 export async function postToAPI(endpoint, payload) {
   try {
@@ -6,6 +19,7 @@ export async function postToAPI(endpoint, payload) {
       method: 'POST',
       headers: {
         'Content-Type': 'application/json',
+        ...authHeaders(),
       },
       body: JSON.stringify(payload),
     })
@@ -13,7 +27,8 @@ export async function postToAPI(endpoint, payload) {
     const data = await response.json()
 
     if (!response.ok) {
-      throw new Error(data.error || 'API POST request failed')
+      await handleUnauthorized(response)
+      throw new Error(data.error || data.detail || 'API POST request failed')
     }
 
     return data
@@ -25,12 +40,13 @@ export async function postToAPI(endpoint, payload) {
 
 export async function fetchAPI(endpoint) {
   try {
-    const response = await fetch(endpoint)
+    const response = await fetch(endpoint, { headers: authHeaders() })
 
     const data = await response.json()
 
     if (!response.ok) {
-      throw new Error(data.error || 'API GET request failed')
+      await handleUnauthorized(response)
+      throw new Error(data.error || data.detail || 'API GET request failed')
     }
 
     return data
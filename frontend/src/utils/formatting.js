@@ -34,13 +34,12 @@ export function formatNewChatJSON(newChatName, participantList, currentUser){
     chat_name: newChatName,
     participants: participantList,
     time_created: new Date().toISOString(),
-    unread_messages_by: [currentUser],
     last_message: null,
     last_message_time: null
   };
 }
 
-export function formatNewDashboardChat(chatID, chatName, lastMessage, lastMessageTime, participants, timeCreated, unreadMessagesBy, permissionsList){
+export function formatNewDashboardChat(chatID, chatName, lastMessage, lastMessageTime, participants, timeCreated, latestSeq, lastReadSeq, permissionsList){
   return {
     chat_id: chatID,
     chat_name: chatName,
@@ -48,7 +47,9 @@ export function formatNewDashboardChat(chatID, chatName, lastMessage, lastMessag
     last_message_time: lastMessageTime,
     participants: participants,
     time_created: timeCreated,
-    unread_messages_by: unreadMessagesBy,
+    latest_seq: latestSeq,
+    last_read_seq: lastReadSeq,
+    unread_count: Math.max(0, latestSeq - lastReadSeq),
     participant_permissions: permissionsList,
   };
 }
@@ -70,3 +71,20 @@ export function formatChatUpdate(chatID, editor,chatName, addedParticipants, rem
     updated_permissions: updatedPermissions,
   }
 }
+
+// Restores full field names on a frame sent with the compact capability; keys of keyed fields are usernames and stay as they are
+export function expandCompactFields(value, fieldNames, keyedFields){
+  if (Array.isArray(value)) return value.map(item => expandCompactFields(item, fieldNames, keyedFields))
+  if (value === null || typeof value !== 'object') return value
+
+  const expanded = {}
+  for (const [code, item] of Object.entries(value)) {
+    const field = fieldNames[code] ?? code
+    if (keyedFields.has(field) && item !== null && typeof item === 'object') {
+      expanded[field] = Object.fromEntries(Object.entries(item).map(([name, entry]) => [name, expandCompactFields(entry, fieldNames, keyedFields)]))
+    } else {
+      expanded[field] = expandCompactFields(item, fieldNames, keyedFields)
+    }
+  }
+  return expanded
+}
@@ -18,3 +18,10 @@ export async function verifyUserExistence(username){
   const exists = !response.error
   return {exists: exists, data: response}
 }
+
+export async function searchUsernames(prefix, limit = 8){
+  if (!prefix) return []
+  const url = `${BASE_API_LINK}/users/search?prefix=${encodeURIComponent(prefix)}&limit=${limit}`
+  const response = await fetchAPI(url)
+  return (response.users ?? []).map(user => user.username)
+}
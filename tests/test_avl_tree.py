@@ -0,0 +1,78 @@
+import random
+
+import pytest
+
+from backend.models.databases.avl_tree.avl_tree import AVLTree
+
+
+def check_invariants(node, lower=None, upper=None):
+    # Returns the subtree height after checking order, stored heights and balance at every node
+    if node is None:
+        return 0
+    assert lower is None or node.key > lower
+    assert upper is None or node.key < upper
+    left_height = check_invariants(node.left, lower, node.key)
+    right_height = check_invariants(node.right, node.key, upper)
+    assert abs(left_height - right_height) <= 1
+    assert node.height == 1 + max(left_height, right_height)
+    return node.height
+
+
+@pytest.fixture
+def tree(tmp_path):
+    return AVLTree(str(tmp_path / "tree.pkl"))
+
+
+def test_random_inserts_and_deletes_keep_the_tree_balanced(tree):
+    rng = random.Random(7)
+    expected = {}
+    for _ in range(3000):
+        key = rng.randrange(500)
+        if rng.random() < 0.6:
+            tree.insert(key, str(key))
+            expected.setdefault(key, str(key))
+        else:
+            removed = tree.delete(key)
+            assert (removed is not None) == (key in expected)
+            expected.pop(key, None)
+        check_invariants(tree.root)
+    assert list(tree.items()) == sorted(expected.items())
+
+
+def test_sequential_inserts_stay_logarithmic(tree):
+    for key in range(1024):
+        tree.insert(key, key)
+    assert check_invariants(tree.root) <= 11
+    for key in range(0, 1024, 2):
+        tree.delete(key)
+    check_invariants(tree.root)
+    assert [key for key, _ in tree.items()] == list(range(1, 1024, 2))
+
+
+def test_delete_keeps_node_identity_for_remaining_keys(tree):
+    for key in range(100):
+        tree.insert(key, key)
+    nodes = {key: tree.search(key) for key in range(100)}
+    for key in range(0, 100, 3):
+        tree.delete(key)
+    for key in range(100):
+        assert (tree.search(key) is nodes[key]) == (key % 3 != 0)
+
+
+@pytest.mark.parametrize("size", [0, 1, 2, 7, 100, 1000])
+def test_bulk_load_builds_a_balanced_tree(tree, size):
+    items = [(key, str(key)) for key in range(size)]
+    tree.bulk_load(items)
+    check_invariants(tree.root)
+    assert list(tree.items()) == items
+
+    tree.insert(size, str(size))
+    tree.delete(0)
+    check_invariants(tree.root)
+
+
+def test_bulk_load_rejects_unsorted_or_duplicate_keys(tree):
+    with pytest.raises(ValueError):
+        tree.bulk_load([(2, "b"), (1, "a")])
+    with pytest.raises(ValueError):
+        tree.bulk_load([(1, "a"), (1, "b")])
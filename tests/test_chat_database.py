@@ -0,0 +1,128 @@
+from copy import copy
+
+from backend.models.databases.chat_database import ChatDatabase
+from backend.models.message_store.message_store import MessageStore
+from backend.models.user import User
+from backend.utils.formatting import format_chat_dict
+
+
+class DeferredWorker:
+    # Holds dirty trees until the test flushes them, like the persistence worker between its passes
+
+    def __init__(self):
+        self.dirty_trees = set()
+
+    def register(self, tree):
+        tree.persistence_worker = self
+
+    def mark_dirty(self, tree, pending_bytes=0):
+        self.dirty_trees.add(tree)
+
+    def flush(self):
+        for tree in self.dirty_trees:
+            tree.flush()
+        self.dirty_trees.clear()
+
+
+def open_database(directory):
+    return ChatDatabase(str(directory / "chats.pkl"), journaled=True, segment_directory=str(directory / "segments"), hot_message_chunks=2)
+
+
+def send(database, chat, text):
+    message = format_chat_dict(chat.chat_id, "owner", text)
+    chat.add_message(message)
+    database.record_message(chat.chat_id, message)
+
+
+def test_snapshot_holds_the_state_from_when_save_was_called(tmp_path):
+    database = open_database(tmp_path)
+    owner = User("owner-id", "owner", b"", True, is_hashed=True)
+    chat_id, chat = database.add_chat(owner, [], "plans", {})
+    for index in range(3):
+        send(database, chat, f"before {index}")
+
+    worker = DeferredWorker()
+    database.attach_persistence_worker(worker)
+    database.save_chat_database()
+    # Changes made while the snapshot waits for the worker belong to the new journal epoch only
+    send(database, chat, "after")
+    chat.mark_as_read_by("owner")
+    database.record_read_seqs(chat, ["owner"])
+    worker.flush()
+    database.close()
+
+    reopened = open_database(tmp_path).search_for_chat(chat_id).value
+    assert [message["message"] for message in reopened.messages] == ["before 0", "before 1", "before 2", "after"]
+    assert [message["seq"] for message in reopened.messages] == [1, 2, 3, 4]
+    assert reopened.read_seqs == {"owner": 4}
+
+
+def test_message_store_copy_is_unaffected_by_later_changes():
+    store = MessageStore("chat", chunk_size=4)
+    for index in range(6):
+        store.append({"message_id": f"m{index}", "message": str(index)})
+    snapshot = copy(store)
+
+    store.append({"message_id": "m6", "message": "6"})
+    for _ in range(4):
+        store.remove_last()
+    store.append({"message_id": "m3b", "message": "3b"})
+
+    assert [message["message"] for message in snapshot] == ["0", "1", "2", "3", "4", "5"]
+    assert [message["message"] for message in store] == ["0", "1", "2", "3b"]
+
+
+def test_membership_changes_replay_from_their_journal_records(tmp_path):
+    database = open_database(tmp_path)
+    owner = User("owner-id", "owner", b"", True, is_hashed=True)
+    members = {username: User(f"{username}-id", username, b"", True, is_hashed=True) for username in ("ann", "bob", "cat")}
+    chat_id, chat = database.add_chat(owner, [], "plans", {})
+
+    for member in members.values():
+        chat.add_participant(member)
+        database.record_participant(chat, member.username)
+    chat.update_permissions("ann", {"can_edit": True})
+    database.record_participant(chat, "ann")
+    chat.mark_as_read_by("bob")
+    database.record_read_seqs(chat, ["bob"])
+    chat.remove_participant(members["bob"])
+    database.record_participant_removed(chat, "bob")
+    chat.promote_to_owner("cat")
+    chat.chat_name = "new plans"
+    database.record_participant(chat, "cat")
+    database.record_fields(chat, "owner", "chat_name")
+    database.close()
+
+    reopened = open_database(tmp_path).search_for_chat(chat_id).value
+    assert reopened.participants == chat.participants
+    assert set(reopened.participants) == {"owner", "ann", "cat"}
+    assert reopened.participants["ann"]["can_edit"] is True
+    assert reopened.read_seqs == {}
+    assert (reopened.owner, reopened.chat_name) == ("cat", "new plans")
+
+
+def test_replay_does_not_grow_the_segment_file(tmp_path):
+    database = open_database(tmp_path)
+    owner = User("owner-id", "owner", b"", True, is_hashed=True)
+    chat_id, chat = database.add_chat(owner, [], "plans", {})
+    message_ids = []
+    for index in range(3000):
+        send(database, chat, f"message {index}")
+        message_ids.append(chat.messages.last_message_id())
+    database.close()
+    segment_path = tmp_path / "segments" / f"{chat_id}.seg"
+    spilled_size = segment_path.stat().st_size
+    assert chat.messages.first_hot_chunk > 0 and spilled_size > 0
+
+    for _ in range(2):
+        reopened_database = open_database(tmp_path)
+        reopened_database.close()
+        assert segment_path.stat().st_size == spilled_size
+
+    messages = reopened_database.search_for_chat(chat_id).value.messages
+    assert len(messages) == 3000
+    assert message_ids[10] not in messages.index  # Found through the cold hash array, not the hot index
+    assert messages.position_of(message_ids[10]) == 10
+    assert messages.get(10)["message"] == "message 10"
+    assert messages.position_of(message_ids[2999]) == 2999
+    assert messages.position_of("not-a-message-id") is None
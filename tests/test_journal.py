@@ -0,0 +1,79 @@
+from backend.models.databases.avl_tree.avl_tree import AVLTree
+from backend.models.databases.journal.journal import Journal
+
+
+def write_records(path, epoch, records):
+    journal = Journal(str(path))
+    journal.reset(epoch)
+    for record in records:
+        journal.append(*record)
+    journal.write(*journal.drain())
+    journal.close()
+
+
+def replay(path, epoch):
+    applied = []
+    count = Journal(str(path)).replay(epoch, lambda operation, *args: applied.append((operation, *args)))
+    return count, applied
+
+
+def test_replay_recovers_records_before_a_torn_tail(tmp_path):
+    path = tmp_path / "chats.journal"
+    records = [("message", "chat", f"m{index}") for index in range(5)]
+    write_records(path, 3, records)
+    with open(path, "r+b") as file:
+        file.truncate(path.stat().st_size - 3)
+
+    count, applied = replay(path, 3)
+    assert count == 4
+    assert applied == records[:4]
+
+    # The torn bytes were cut off, so a record appended after recovery replays cleanly behind the others
+    journal = Journal(str(path))
+    journal.replay(3, lambda *record: None)
+    journal.append("message", "chat", "after crash")
+    journal.write(*journal.drain())
+    journal.close()
+    assert replay(path, 3) == (5, records[:4] + [("message", "chat", "after crash")])
+
+
+def test_replay_ignores_a_journal_from_another_epoch(tmp_path):
+    path = tmp_path / "chats.journal"
+    write_records(path, 2, [("message", "chat", "already in the snapshot")])
+
+    assert replay(path, 3) == (0, [])
+
+
+def open_tree(path, compaction_threshold=4):
+    tree = AVLTree(str(path), journaled=True, compaction_threshold=compaction_threshold)
+    tree.replay(lambda operation, key, value: tree.insert(key, value))
+    return tree
+
+
+def test_tree_recovers_from_snapshot_and_journal_across_compactions(tmp_path):
+    path = tmp_path / "tree.pkl"
+    tree = open_tree(path)
+    for key in range(10):
+        tree.insert(key, f"v{key}")
+        tree.log("insert", key, f"v{key}")
+    tree.flush()
+    tree.journal.close()
+
+    reopened = open_tree(path)
+    assert list(reopened.items()) == [(key, f"v{key}") for key in range(10)]
+
+
+def test_tree_loses_only_the_torn_record(tmp_path):
+    path = tmp_path / "tree.pkl"
+    tree = open_tree(path, compaction_threshold=100)
+    for key in range(6):
+        tree.insert(key, f"v{key}")
+        tree.log("insert", key, f"v{key}")
+    tree.flush()
+    tree.journal.close()
+    journal_path = tmp_path / "tree.pkl.journal"
+    with open(journal_path, "r+b") as file:
+        file.truncate(journal_path.stat().st_size - 1)
+
+    reopened = open_tree(path, compaction_threshold=100)
+    assert list(reopened.items()) == [(key, f"v{key}") for key in range(5)]
@@ -0,0 +1,83 @@
+import asyncio
+
+from backend.models.connections.operation_dispatcher import OperationRegistry, OperationPipeline, CONNECTION_LANE, EXCLUSIVE
+
+
+class Session:
+
+    def __init__(self):
+        self.connection = None
+        self.username = "user"
+
+
+def make_pipeline(registry, errors, max_lane_backlog=4):
+    async def send_error(connection, operation, code, message):
+        errors.append((operation, code))
+    return OperationPipeline(registry, Session(), send_error, max_lane_backlog=max_lane_backlog)
+
+
+def test_submit_blocked_on_a_full_lane_still_runs_in_order():
+    async def scenario():
+        registry = OperationRegistry()
+        gate = asyncio.Event()
+        ran = []
+        errors = []
+
+        @registry.register("step", {"index": int}, lane=CONNECTION_LANE)
+        async def step(session, payload):
+            if payload["index"] == 1:
+                await gate.wait()
+            ran.append(payload["index"])
+
+        pipeline = make_pipeline(registry, errors)
+        await pipeline.submit("step", {"index": 1})
+        await asyncio.sleep(0)  # The lane's worker takes operation 1 and blocks in it
+        for index in range(2, 6):
+            await pipeline.submit("step", {"index": index})
+        blocked_submit = asyncio.create_task(pipeline.submit("step", {"index": 6}))
+        await asyncio.sleep(0.01)
+        assert not blocked_submit.done()
+
+        # The worker runs 2-5 without yielding once released, emptying the queue before the blocked put lands
+        gate.set()
+        await blocked_submit
+        await pipeline.submit("step", {"index": 7})
+        await pipeline.drain()
+        assert ran == list(range(1, 8))
+        assert errors == []
+        assert pipeline.lanes == {}
+
+    asyncio.run(scenario())
+
+
+def test_exclusive_operation_waits_for_every_lane_to_drain():
+    async def scenario():
+        registry = OperationRegistry()
+        gate = asyncio.Event()
+        ran = []
+        errors = []
+
+        @registry.register("chat_step")
+        async def chat_step(session, payload):
+            await gate.wait()
+            ran.append(payload["chat_id"])
+
+        @registry.register("exclusive_step", lane=EXCLUSIVE)
+        async def exclusive_step(session, payload):
+            ran.append(("exclusive", len(pipeline.lanes)))
+
+        pipeline = make_pipeline(registry, errors)
+        for chat_id in ("a", "b", "a"):
+            await pipeline.submit("chat_step", {"chat_id": chat_id})
+        exclusive = asyncio.create_task(pipeline.submit("exclusive_step", {}))
+        await asyncio.sleep(0.01)
+        assert not exclusive.done()
+        assert ran == []
+
+        gate.set()
+        await exclusive
+        assert sorted(ran[:3]) == ["a", "a", "b"]
+        assert ran[3] == ("exclusive", 0)
+        assert errors == []
+
+    asyncio.run(scenario())
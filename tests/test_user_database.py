@@ -0,0 +1,41 @@
+import os
+
+from backend.models.databases.user_database import UserDatabase
+from backend.models.user import User
+
+
+def add_user(database, username):
+    user = User(f"{username}-id", username, b"", True, is_hashed=True)
+    database.add_user(username, user)
+    return user
+
+
+def test_follow_records_stay_the_same_size_as_followers_grow(tmp_path):
+    path = str(tmp_path / "users.pkl")
+    database = UserDatabase(path, journaled=True)
+    star = add_user(database, "star")
+    fans = [add_user(database, f"fan{index:04}") for index in range(1000)]
+
+    record_sizes = []
+    for fan in fans:
+        size_before = os.path.getsize(f"{path}.journal")
+        star.add_follower(fan)
+        database.record_added(star, "followers", fan.username)
+        database.record_added(fan, "following", "star")
+        record_sizes.append(os.path.getsize(f"{path}.journal") - size_before)
+    assert max(record_sizes) == min(record_sizes)
+
+    star.public_status = False
+    database.record_fields(star, "public_status")
+    star.block_user(fans[0])
+    database.record_added(star, "blocked_users", fans[0].username)
+    database.record_removed(star, "followers", fans[0].username)
+    database.record_removed(star, "following", fans[0].username)
+    database.close()
+
+    reopened = UserDatabase(path, journaled=True)
+    reopened_star = reopened.search_for_user("star").value
+    assert reopened_star.followers == {fan.username for fan in fans[1:]}
+    assert reopened_star.blocked_users == {"fan0000"}
+    assert reopened_star.public_status is False
+    assert reopened.search_for_user("fan0500").value.following == {"star"}
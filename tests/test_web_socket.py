@@ -0,0 +1,37 @@
+import importlib
+
+import pytest
+from fastapi.testclient import TestClient
+
+
+@pytest.fixture(scope="module")
+def client(tmp_path_factory):
+    # The app's databases are module-level singletons over files in the working directory
+    with pytest.MonkeyPatch.context() as patch:
+        patch.chdir(tmp_path_factory.mktemp("app"))
+        app = importlib.import_module("app")
+        with TestClient(app.app) as client:
+            yield client
+
+
+def register(client, username):
+    return client.post("/users/register", json={"username": username, "password": "password", "is_public": True}).json()["token"]
+
+
+def test_socket_cannot_take_another_users_name(client):
+    from backend.routes.web_socket import CONNECTIONS
+
+    attacker_token = register(client, "attacker")
+    victim_token = register(client, "victim")
+
+    with client.websocket_connect(f"/ws/victim?token={victim_token}"), \
+            client.websocket_connect(f"/ws/attacker?token={attacker_token}") as attacker:
+        victim_connection = CONNECTIONS.user_connections["victim"]
+        attacker.send_json({"operation": "update_username", "data": {"new_username": "victim"}})
+        attacker.send_json({"operation": "ping"})
+        error = attacker.receive_json()
+        assert error["type"] == "error"
+        assert error["code"] == "forbidden"
+        assert attacker.receive_json()["operation"] == "pong"
+        assert CONNECTIONS.user_connections["victim"] is victim_connection
+        assert "attacker" in CONNECTIONS.user_connections